@@ -0,0 +1,355 @@
+import asyncio
+import functools
+import json
+import time
+import uuid
+from google.genai import types
+import config
+from function_call import FunctionCallBatch, ToolContext
+from tool_cache import TOOL_CACHE
+from tracing import TRACER
+from history import ConversationHistory, content_chars
+from scheduler import BATCH, REQUEST_PRIORITY
+from prefetch import PREFETCHER
+from router import ROUTER, Route
+from session_store import SessionError
+from workspaces import WorkspaceError, create_workspace
+
+# Load the system prompt from the config module
+system_prompt = config.SYSTEM_PROMPT
+
+# Create a configuration object for the Gemini API that includes the available functions
+# and the system instruction to guide the AI's behavior.
+# It is built the first time a request is sent and reused after that; the tool modules are
+# only imported at that point, so commands that never reach the model don't pay for them.
+@functools.cache
+def get_genai_config():
+    from functions.get_files_info import schema_get_files_info
+    from functions.get_file_content import schema_get_file_content
+    from functions.search_files import schema_search_files
+    from functions.run_python_file import schema_run_python_file
+    from functions.run_tests import schema_run_tests
+    from functions.write_file import schema_write_file
+    from functions.edit_file import schema_edit_file
+
+    # Register the function schemas in a Tool object to make it available for the Gemini API
+    # This allows the AI to call this function when needed.
+    available_functions = types.Tool(
+        function_declarations=[
+            schema_get_files_info(),
+            schema_get_file_content(),
+            schema_search_files(),
+            schema_run_python_file(),
+            schema_run_tests(),
+            schema_write_file(),
+            schema_edit_file(),
+        ]
+    )
+    return types.GenerateContentConfig(tools=[available_functions], system_instruction=system_prompt)
+
+# Send the messages to the model and wait for the whole response.
+# Function calls are dispatched once the response has arrived.
+# The function calls are submitted to batch (see function_call.FunctionCallBatch).
+# Returns the model's content, its usage metadata and the batch of function calls.
+async def _generate(backend, messages, context, batch, model=config.MODEL):
+    with TRACER.span("model.generate", "model", session=context.session_id, turn=context.turn, model=model) as span:
+        response = await backend.generate(model, messages, get_genai_config())
+        _record_model_span(span, messages, response.usage_metadata, response.candidates[0].content if response.candidates else None)
+
+    model_content = response.candidates[0].content if response.candidates else None
+    for function_call_part in response.function_calls or []:
+        batch.submit(function_call_part)
+    return model_content, response.usage_metadata, batch
+
+# Send the messages to the model and print text chunks as soon as they arrive.
+# Each function call part is dispatched to the thread pool the moment it shows up in
+# the stream, so tools run while the rest of the response is still being generated.
+# Returns the same values as _generate.
+async def _generate_streaming(backend, messages, context, batch, quiet=False, model=config.MODEL):
+    parts = []
+    usage_metadata = None
+
+    with TRACER.span("model.generate_stream", "model", session=context.session_id, turn=context.turn, model=model) as span:
+        start = time.perf_counter()
+        async for chunk in backend.generate_stream(model, messages, get_genai_config()):
+            if "first_chunk_ms" not in span:
+                span["first_chunk_ms"] = (time.perf_counter() - start) * 1000
+
+            # the usage metadata on the last chunk covers the whole response
+            if chunk.usage_metadata:
+                usage_metadata = chunk.usage_metadata
+            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                continue
+
+            for part in chunk.candidates[0].content.parts:
+                if part.function_call:
+                    batch.submit(part.function_call)
+                    parts.append(part)
+                elif part.text:
+                    if not quiet:
+                        print(part.text, end="", flush=True)
+
+                    # merge consecutive text chunks back into one part for the message history
+                    if parts and parts[-1].text and not parts[-1].function_call:
+                        parts[-1] = types.Part(text=parts[-1].text + part.text)
+                    else:
+                        parts.append(types.Part(text=part.text))
+                else:
+                    parts.append(part)
+
+        model_content = types.Content(role="model", parts=parts) if parts else None
+        _record_model_span(span, messages, usage_metadata, model_content)
+
+    # end the streamed line of text
+    if not quiet and any(part.text for part in parts):
+        print()
+
+    return model_content, usage_metadata, batch
+
+# Attach token counts and payload sizes to a model span.
+def _record_model_span(span, messages, usage_metadata, model_content):
+    if not TRACER.enabled:
+        return
+    if usage_metadata:
+        span["prompt_tokens"] = usage_metadata.prompt_token_count
+        span["response_tokens"] = usage_metadata.candidates_token_count
+    span["request_chars"] = sum(content_chars(content) for content in messages)
+    span["response_chars"] = content_chars(model_content) if model_content else 0
+    span["function_calls"] = sum(1 for part in (model_content.parts if model_content else []) if part.function_call)
+
+# Run one agent session for a single prompt against a model backend (see backends.py).
+# Returns a dict with the final text, the number of iterations used, any error and the
+# time spent waiting on the model and on tools, so batch mode can write it out as a JSONL line.
+# When quiet is True nothing is printed, which keeps batch output readable.
+# When stream is True the response text is printed as it is generated.
+# history_budget overrides config.HISTORY_TOKEN_BUDGET for this session, and
+# working_directory overrides config.WORKING_DIRECTORY.
+# session_id identifies the session in traces; a random one is used if it is not given.
+# To continue an earlier conversation (see daemon.py), pass its history and tool_context:
+# the prompt is added to that history, and history_budget, working_directory and session_id
+# are then taken from them instead.
+# router picks the model for every iteration (see router.py); the shared ROUTER by default.
+async def run_agent(backend, user_input, verbose=False, quiet=False, stream=False, history_budget=None, working_directory=None, session_id=None, history=None, tool_context=None, router=None):
+    if tool_context is not None:
+        session_id = tool_context.session_id
+    session_id = session_id or uuid.uuid4().hex[:12]
+    result = {
+        "session_id": session_id, "prompt": user_input, "text": None, "iterations": 0, "error": None,
+        "tokens_saved": 0, "model_seconds": 0.0, "tool_seconds": 0.0, "models": {},
+    }
+    router = router or ROUTER
+    route = Route()
+
+    # the history holds the messages sent to the model and compacts old tool outputs
+    # once the conversation goes over its token budget
+    if history is None:
+        history = ConversationHistory(user_input, token_budget=history_budget or config.HISTORY_TOKEN_BUDGET)
+    else:
+        history.add_prompt(user_input)
+    tokens_saved_before = history.tokens_saved
+
+    # iterations are numbered from the end of the conversation so far, so a continued
+    # conversation keeps compacting and caching by its whole history
+    first_turn = history.last_turn
+
+    # per-session tool state: the working directory and which cached results were already sent
+    if tool_context is None:
+        tool_context = ToolContext(working_directory=working_directory or config.WORKING_DIRECTORY, quiet=quiet, session_id=session_id)
+
+    # loop for up to 20 iterations to allow the AI to call functions multiple times if needed
+    for i in range(config.MAX_GENERATION_ITERATIONS):
+        result["iterations"] = i + 1
+        turn = first_turn + i + 1
+        # set while the model request is in flight, so only its failures are retried
+        model = None
+        requesting = False
+        try:
+            if not quiet:
+                print(f"\n--- Generation Iteration {i+1} ---")
+
+            # compact old tool outputs before sending, if the request would go over budget
+            tokens_saved = history.compact_if_needed(turn)
+            if tokens_saved:
+                # compacted results can no longer be referred to as "unchanged since turn N"
+                tool_context.forget_turns_before(turn - history.keep_recent_turns)
+            tool_context.start_turn(turn, history.estimated_prompt_tokens(), history.token_budget)
+            if verbose and not quiet:
+                print(f"History: ~{tokens_saved} tokens saved by compaction this iteration (~{history.tokens_saved} total)")
+
+            # pick the model for this iteration: cheap for routine tool steps, strong for planning
+            # and after failures
+            model, route_name = router.choose(route, history.estimated_prompt_tokens())
+            if verbose and not quiet:
+                print(f"Model: {model} ({route_name}{', ' + route.reason if route_name == 'escalated' and route.reason else ''})")
+
+            # send the messages to the model, passing in the available functions and config object.
+            # the async backend lets many sessions wait on the network at the same time
+            # the batch is created here, so a failed request can tell whether it had already
+            # started tools (a stream dispatches function calls as they arrive)
+            model_start = time.perf_counter()
+            batch = FunctionCallBatch(verbose=verbose, context=tool_context)
+            requesting = True
+            if stream:
+                model_content, usage_metadata, batch = await _generate_streaming(backend, history.messages, tool_context, batch, quiet=quiet, model=model)
+            else:
+                model_content, usage_metadata, batch = await _generate(backend, history.messages, tool_context, batch, model=model)
+            requesting = False
+            model_seconds = time.perf_counter() - model_start
+            result["model_seconds"] += model_seconds
+            result["models"][model] = result["models"].get(model, 0) + 1
+            router.record(model, route_name, model_seconds, usage_metadata)
+
+            history.record_usage(usage_metadata)
+
+            # if verbose tag used, print tokens used and prompt used
+            if usage_metadata and verbose and not quiet:
+                prompt_tokens_used = usage_metadata.prompt_token_count
+                response_tokens_used = usage_metadata.candidates_token_count
+                print(f"User prompt: {user_input}")
+                print(f"Prompt tokens: {prompt_tokens_used}")
+                print(f"Response tokens: {response_tokens_used}")
+
+            text = "".join(part.text for part in (model_content.parts if model_content else []) if part.text)
+
+            # a final answer from a cheaper model can be asked for again from the final answer
+            # model; the dropped answer never enters the history. Streamed text is already out.
+            if text and not batch.futures and not stream and router.final_answer_review(route, model):
+                if verbose and not quiet:
+                    print(f"Final answer from {model} dropped, asking {router.final_answer_model}")
+                continue
+
+            # appending candidate content to the message history
+            if model_content:
+                history.add(model_content, turn)
+
+            # if the response contains function calls, wait for all of them to finish.
+            # the tools block, so the wait happens in a worker thread to keep the event loop free
+            if batch.futures:
+                tools_start = time.perf_counter()
+                function_call_results = await asyncio.to_thread(batch.results)
+                result["tool_seconds"] += time.perf_counter() - tools_start
+
+                # if verbose flag is set, print the result of every call
+                if verbose and not quiet:
+                    for part in function_call_results.parts:
+                        print(f"-> {part.function_response.response}")
+                    cache_stats = TOOL_CACHE.stats()
+                    print(f"Tool cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+
+                # append all of the function call responses to the message history as one message
+                history.add(function_call_results, turn)
+
+                # failed tool calls send the next iterations to the escalated model
+                router.after_tools(route, function_call_results)
+                continue  # continue to the next iteration to get a new response after the function calls
+
+            elif text:
+                result["text"] = text
+                # streamed text has already been printed chunk by chunk
+                if not quiet and not stream:
+                    print(text)
+                break  # exit the loop if a final text response is received
+
+            # if no other path, print a message and break the loop
+            else:
+                result["error"] = "No function call or text response received."
+                if not quiet:
+                    print("No function call or text response received.")
+                break
+
+        # a failed model request is tried again once on the escalated model, unless it already
+        # started tools: their results would never reach the history and the retry would ask
+        # for the same calls (e.g. the same edits) again. Catch any other Exception and print
+        # it, then break the loop
+        except Exception as e:
+            if requesting and not batch.futures and router.retry_on_error(route, model):
+                if not quiet:
+                    print(f"Error during iteration {i+1} on {model}: {e}; retrying on {router.routes['escalated']}")
+                continue
+            result["error"] = f"Error during iteration {i+1}: {e}"
+            if not quiet:
+                print(f"Error during iteration {i+1}: {e}")
+            break
+
+    # speculation for the next tool call of this prompt is no longer needed (see prefetch.py)
+    if config.PREFETCH:
+        await asyncio.to_thread(PREFETCHER.cancel, tool_context.working_directory, True)
+
+    result["tokens_saved"] = history.tokens_saved - tokens_saved_before
+    return result
+
+# Turn one line of a batch file into a prompt entry.
+# A line can be a JSON object with a "prompt" key (and optionally an "id"), or a plain JSON string.
+def _parse_batch_line(line):
+    entry = json.loads(line)
+    if isinstance(entry, str):
+        return {"prompt": entry}
+    if not isinstance(entry, dict) or not isinstance(entry.get("prompt"), str):
+        raise ValueError('expected a JSON string or an object with a "prompt" key')
+    return entry
+
+# Run every prompt in a JSONL file as its own independent session, with at most
+# `concurrency` sessions running at the same time. One JSONL result line is written
+# to output_path per prompt as soon as that prompt finishes, so results come out
+# in completion order; the "index" field gives the line number of the prompt.
+# With isolate every session runs in a new workspace of its own (see workspaces.py); the
+# workspaces of sessions that changed files are kept, and named in their results as "workspace".
+# Workspace ids end in an id of the run, so running the same file again doesn't collide with
+# the workspaces an earlier run kept.
+async def run_batch(backend, input_path, output_path, concurrency=config.BATCH_CONCURRENCY, verbose=False, isolate=config.ISOLATE_SESSIONS):
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:8]
+    tasks = []
+    completed = 0
+
+    with open(output_path, 'w', encoding='utf-8') as out:
+
+        # write a single result line and flush it so partial results survive a crash
+        def write_result(result):
+            nonlocal completed
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            completed += 1
+            status = "error" if result.get("error") else "ok"
+            print(f"[{completed}] prompt {result['index']}: {status} ({result.get('iterations', 0)} iterations)")
+
+        # run a single prompt and release its concurrency slot when done.
+        # its model requests queue behind those of interactive sessions (see scheduler.py)
+        async def run_one(index, entry):
+            REQUEST_PRIORITY.set(BATCH)
+            session_id = str(entry.get("id", f"batch-{index}"))
+            workspace = None
+            try:
+                if isolate:
+                    workspace = await asyncio.to_thread(create_workspace, f"{session_id}-{run_id}")
+                result = await run_agent(backend, entry["prompt"], verbose=verbose, quiet=True, session_id=session_id,
+                                         working_directory=workspace.path if workspace else None)
+                if workspace and not await asyncio.to_thread(workspace.release):
+                    result["workspace"] = workspace.session_id
+            except (WorkspaceError, SessionError) as e:
+                result = {"session_id": session_id, "prompt": entry["prompt"], "text": None, "iterations": 0, "error": str(e)}
+            finally:
+                semaphore.release()
+            result["index"] = index
+            if "id" in entry:
+                result["id"] = entry["id"]
+            write_result(result)
+
+        # read prompts one line at a time; waiting on the semaphore before starting
+        # each session keeps the number of in-flight sessions bounded
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for index, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = _parse_batch_line(line)
+                except ValueError as e:
+                    write_result({"index": index, "prompt": None, "text": None, "iterations": 0, "error": f"Invalid batch line: {e}"})
+                    continue
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(run_one(index, entry)))
+
+        await asyncio.gather(*tasks)
+
+    return completed
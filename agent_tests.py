@@ -0,0 +1,1213 @@
+# Unit tests for the agent's own logic. Run with: python -m unittest agent_tests
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import httpx
+from google.genai import errors, types
+import client
+import config
+import function_call
+import session_store
+import tool_cache
+import workspaces
+from agent import run_agent, run_batch
+from backends import RecordingBackend, ReplayBackend, ReplayError, request_hash
+from daemon import AgentDaemon
+from history import ConversationHistory
+from functions import interpreter_pool, search_index, test_runner
+from functions.edit_file import PatchError, apply_edits, apply_patch, edit_file
+from functions.get_file_content import get_file_content
+from functions.get_files_info import get_files_info
+from functions.output_capture import OutputCapture
+from functions.search_files import search_files
+from functions.write_file import write_file
+from prefetch import Prefetcher
+from result_shaping import shape_result
+from router import ModelRouter, Route
+from scheduler import RequestScheduler, ScheduledBackend
+from session_store import SessionError
+
+
+# Point the on-disk caches (workspaces, search indexes, test results, sessions) at a temporary
+# directory for the length of a test, and return that directory.
+def isolate_caches(test):
+    tmp = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmp)
+    for name in ("WORKSPACES_DIR", "SEARCH_INDEX_DIR", "TEST_RESULTS_DIR", "SESSIONS_DIR"):
+        test.addCleanup(setattr, config, name, getattr(config, name))
+        setattr(config, name, os.path.join(tmp, name.lower()))
+    return tmp
+
+
+# Write model responses as a replay log in the format RecordingBackend writes. A response is
+# {"text": ...} or {"function_calls": [{"name": ..., "args": {...}}, ...]}, optionally with the
+# "request_hash" of the request it answers; without one it is served in file order.
+def write_replay_log(path, responses):
+    with open(path, "w", encoding="utf-8") as f:
+        for index, response in enumerate(responses):
+            if "function_calls" in response:
+                parts = [{"function_call": call} for call in response["function_calls"]]
+            else:
+                parts = [{"text": response["text"]}]
+            chunk = {
+                "candidates": [{"content": {"role": "model", "parts": parts}}],
+                "usage_metadata": {"prompt_token_count": 100, "candidates_token_count": 10},
+            }
+            record = {"request_hash": response.get("request_hash", f"scripted:{index}"), "model": "scripted", "request": [], "chunks": [chunk]}
+            f.write(json.dumps(record) + "\n")
+
+
+class TestApplyEdits(unittest.TestCase):
+    def test_replaces_unique_search_text(self):
+        self.assertEqual(apply_edits("a = 1\nb = 2\n", [{"search": "b = 2", "replace": "b = 3"}]), "a = 1\nb = 3\n")
+
+    def test_edits_apply_in_order(self):
+        edits = [{"search": "x", "replace": "y"}, {"search": "y", "replace": "z"}]
+        self.assertEqual(apply_edits("x\n", edits), "z\n")
+
+    def test_missing_search_text(self):
+        with self.assertRaisesRegex(PatchError, "not found"):
+            apply_edits("a = 1\n", [{"search": "b = 2", "replace": ""}])
+
+    def test_search_text_must_occur_exactly_once(self):
+        with self.assertRaisesRegex(PatchError, "appears 2 times"):
+            apply_edits("x = 1\nx = 1\n", [{"search": "x = 1", "replace": "x = 2"}])
+
+    def test_empty_search_text(self):
+        with self.assertRaisesRegex(PatchError, "empty search text"):
+            apply_edits("a\n", [{"search": "", "replace": "b"}])
+
+
+class TestApplyPatch(unittest.TestCase):
+    TEXT = "".join(f"line {number}\n" for number in range(1, 11))
+
+    def test_applies_hunk_at_stated_line(self):
+        patch = "--- a/f\n+++ b/f\n@@ -2,3 +2,3 @@\n line 2\n-line 3\n+line three\n line 4\n"
+        self.assertEqual(apply_patch(self.TEXT, patch), self.TEXT.replace("line 3\n", "line three\n"))
+
+    def test_miscounted_line_number_uses_nearest_match(self):
+        patch = "@@ -7,1 +7,1 @@\n-line 3\n+line three\n"
+        self.assertEqual(apply_patch(self.TEXT, patch), self.TEXT.replace("line 3\n", "line three\n"))
+
+    def test_later_hunks_are_shifted_by_earlier_ones(self):
+        patch = "@@ -1,1 +1,3 @@\n line 1\n+inserted a\n+inserted b\n@@ -9,1 +11,1 @@\n-line 9\n+line nine\n"
+        lines = apply_patch(self.TEXT, patch).splitlines()
+        self.assertEqual(lines[1:3], ["inserted a", "inserted b"])
+        self.assertEqual(lines[10], "line nine")
+
+    def test_mismatching_hunk(self):
+        with self.assertRaisesRegex(PatchError, "hunk 1"):
+            apply_patch(self.TEXT, "@@ -1,1 +1,1 @@\n-no such line\n+x\n")
+
+    def test_patch_without_hunks(self):
+        with self.assertRaisesRegex(PatchError, "no @@ hunks"):
+            apply_patch(self.TEXT, "--- a/f\n+++ b/f\n")
+
+    def test_keeps_missing_final_newline(self):
+        self.assertEqual(apply_patch("a\nb", "@@ -2,1 +2,1 @@\n-b\n+c\n"), "a\nc")
+
+    def test_splits_on_newlines_only(self):
+        # form feeds and other characters str.splitlines() breaks on stay inside their line
+        text = "a = 1\nb = '\x0c\x1c\x85\u2028'\nc = 3\n"
+        self.assertEqual(apply_patch(text, "@@ -3,1 +3,1 @@\n-c = 3\n+c = 4\n"), text.replace("c = 3", "c = 4"))
+        patch = "@@ -2,2 +2,2 @@\n-b = '\x0c\x1c\x85\u2028'\n+b = ''\n c = 3\n"
+        self.assertEqual(apply_patch(text, patch), "a = 1\nb = ''\nc = 3\n")
+
+
+class TestEditFile(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+
+    def read(self, name):
+        with open(os.path.join(self.work, name), "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def test_keeps_crlf_line_endings(self):
+        with open(os.path.join(self.work, "f.txt"), "w", encoding="utf-8", newline="") as f:
+            f.write("one\r\ntwo\r\nthree\r\n")
+        result = edit_file(self.work, "f.txt", patch="@@ -2,1 +2,1 @@\n-two\n+TWO\n")
+        self.assertTrue(result.startswith("Successfully edited"), result)
+        self.assertEqual(self.read("f.txt"), "one\r\nTWO\r\nthree\r\n")
+
+    def test_failed_edit_leaves_file_untouched(self):
+        write_file(self.work, "f.txt", "x = 1\nx = 1\n")
+        result = edit_file(self.work, "f.txt", edits=[{"search": "x = 1", "replace": "x = 2"}])
+        self.assertIn("The file was not changed", result)
+        self.assertEqual(self.read("f.txt"), "x = 1\nx = 1\n")
+
+
+class TestFunctionCallBatch(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.addCleanup(setattr, config, "PREFETCH", config.PREFETCH)
+        config.PREFETCH = False
+        self.context = function_call.ToolContext(self.work, quiet=True)
+        self.events = []
+        self.events_lock = threading.Lock()
+        self.delays = {}
+
+    # stands in for the tools: records when each call starts and ends, taking delays[file_path] seconds
+    def fake_tool(self, function_name, function_args):
+        label = f"{function_name}:{function_args['file_path']}"
+        with self.events_lock:
+            self.events.append(("start", label))
+        time.sleep(self.delays.get(function_args["file_path"], 0.05))
+        with self.events_lock:
+            self.events.append(("end", label))
+        return label
+
+    def run_batch(self, calls):
+        batch = function_call.FunctionCallBatch(context=self.context)
+        with mock.patch.object(function_call, "_run_tool", side_effect=self.fake_tool):
+            for name, file_path in calls:
+                batch.submit(types.FunctionCall(name=name, args={"file_path": file_path}))
+            content = batch.results()
+        return [part.function_response.response["result"] for part in content.parts]
+
+    def position(self, kind, label):
+        return self.events.index((kind, label))
+
+    def test_results_keep_the_order_of_the_calls(self):
+        calls = [("get_file_content", f"f{number}.txt") for number in range(6)]
+        # earlier calls finish last
+        self.delays = {file_path: 0.3 - 0.05 * number for number, (_, file_path) in enumerate(calls)}
+        self.assertEqual(self.run_batch(calls), [f"{name}:{file_path}" for name, file_path in calls])
+
+    def test_writes_are_barriers(self):
+        calls = [
+            ("get_file_content", "a.txt"), ("get_file_content", "b.txt"),
+            ("write_file", "a.txt"),
+            ("get_file_content", "c.txt"), ("get_file_content", "d.txt"),
+        ]
+        self.delays = {"a.txt": 0.2, "b.txt": 0.1}
+        self.assertEqual(self.run_batch(calls), [f"{name}:{file_path}" for name, file_path in calls])
+        write_start = self.position("start", "write_file:a.txt")
+        write_end = self.position("end", "write_file:a.txt")
+        self.assertLess(self.position("end", "get_file_content:a.txt"), write_start)
+        self.assertLess(self.position("end", "get_file_content:b.txt"), write_start)
+        self.assertGreater(self.position("start", "get_file_content:c.txt"), write_end)
+        self.assertGreater(self.position("start", "get_file_content:d.txt"), write_end)
+
+    def test_reads_run_in_parallel(self):
+        self.run_batch([("get_file_content", f"f{number}.txt") for number in range(4)])
+        # every read starts before the first one ends
+        self.assertEqual([kind for kind, _ in self.events[:4]], ["start"] * 4)
+
+    def test_tool_errors_become_error_responses(self):
+        batch = function_call.FunctionCallBatch(context=self.context)
+        with mock.patch.object(function_call, "_run_tool", side_effect=RuntimeError("disk on fire")):
+            batch.submit(types.FunctionCall(name="get_file_content", args={"file_path": "a.txt"}))
+            content = batch.results()
+        self.assertEqual(content.parts[0].function_response.response, {"error": "Error calling get_file_content: disk on fire"})
+
+
+class TestAgentLoop(unittest.TestCase):
+    def setUp(self):
+        self.tmp = isolate_caches(self)
+        self.addCleanup(setattr, config, "PREFETCH", config.PREFETCH)
+        config.PREFETCH = False
+        self.work = os.path.join(self.tmp, "work")
+        os.makedirs(self.work)
+        write_file(self.work, "notes.txt", "the answer is 42\n")
+
+    def backend(self, responses, latency=0.0):
+        path = os.path.join(self.tmp, f"replay-{len(os.listdir(self.tmp))}.jsonl")
+        write_replay_log(path, responses)
+        return ReplayBackend(path, latency=latency)
+
+    def test_tool_results_go_back_to_the_model(self):
+        backend = self.backend([
+            {"function_calls": [{"name": "get_file_content", "args": {"file_path": "notes.txt"}}]},
+            {"text": "The answer is 42."},
+        ])
+        result = asyncio.run(run_agent(backend, "What is the answer?", quiet=True, working_directory=self.work))
+        self.assertEqual((result["text"], result["iterations"], result["error"]), ("The answer is 42.", 2, None))
+
+    def test_stream_mode_gives_the_same_result(self):
+        backend = self.backend([
+            {"function_calls": [{"name": "get_file_content", "args": {"file_path": "notes.txt"}}]},
+            {"text": "The answer is 42."},
+        ])
+        result = asyncio.run(run_agent(backend, "What is the answer?", quiet=True, stream=True, working_directory=self.work))
+        self.assertEqual((result["text"], result["iterations"], result["error"]), ("The answer is 42.", 2, None))
+
+    def test_batch_runs_prompts_concurrently(self):
+        input_path = os.path.join(self.tmp, "prompts.jsonl")
+        output_path = os.path.join(self.tmp, "results.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            f.write('{"id": "first", "prompt": "one"}\n"two"\n{"no prompt": 1}\n"three"\n')
+        backend = self.backend([{"text": "done"}] * 3, latency=0.3)
+
+        start = time.perf_counter()
+        with mock.patch("builtins.print"):
+            completed = asyncio.run(run_batch(backend, input_path, output_path, concurrency=3, isolate=False))
+        elapsed = time.perf_counter() - start
+        # run one after another the three sessions would take 0.9s
+        self.assertLess(elapsed, 0.8)
+
+        with open(output_path, "r", encoding="utf-8") as f:
+            results = {result["index"]: result for result in map(json.loads, f)}
+        self.assertEqual(completed, 4)
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertEqual([results[index]["text"] for index in (0, 1, 3)], ["done"] * 3)
+        self.assertEqual(results[0]["id"], "first")
+        self.assertTrue(results[2]["error"].startswith("Invalid batch line"))
+
+
+class TestHistoryCompaction(unittest.TestCase):
+    def setUp(self):
+        self.history = ConversationHistory("prompt", token_budget=1000, keep_recent_turns=2)
+
+    def tool_output(self, turn, chars):
+        content = types.Content(role="user", parts=[types.Part.from_function_response(name="get_file_content", response={"result": "x" * chars})])
+        self.history.add(content, turn)
+
+    def write_call(self, turn, chars):
+        call = types.FunctionCall(name="write_file", args={"file_path": "big.txt", "content": "y" * chars})
+        self.history.add(types.Content(role="model", parts=[types.Part(function_call=call)]), turn)
+
+    def result_of(self, index):
+        return self.history.messages[index].parts[0].function_response.response["result"]
+
+    def test_nothing_is_compacted_within_budget(self):
+        self.tool_output(1, 3000)
+        self.assertEqual(self.history.compact_if_needed(4), 0)
+        self.assertEqual(self.result_of(1), "x" * 3000)
+
+    def test_old_outputs_are_elided_and_recent_ones_kept(self):
+        self.write_call(1, 2000)
+        for turn in (1, 2, 3):
+            self.tool_output(turn, 2000)
+        self.assertGreater(self.history.estimated_prompt_tokens(), 1000)
+
+        saved = self.history.compact_if_needed(4)
+        # turn 1 is older than the last two turns: its output and write_file content go
+        content = self.history.messages[1].parts[0].function_call.args["content"]
+        self.assertIn("of the content argument to write_file", content)
+        self.assertTrue(self.result_of(2).startswith("x" * config.HISTORY_ELIDED_PREVIEW_CHARS + "[...elided 1800 more characters"))
+        self.assertIn("from iteration 1", self.result_of(2))
+        self.assertEqual(self.result_of(3), "x" * 2000)
+        self.assertEqual(self.result_of(4), "x" * 2000)
+        self.assertEqual(saved, self.history.tokens_saved)
+        self.assertEqual(saved, (2 * 2000 - len(content) - len(self.result_of(2))) // config.CHARS_PER_TOKEN)
+
+    def test_small_outputs_are_kept(self):
+        self.tool_output(1, config.HISTORY_ELIDE_MIN_CHARS - 1)
+        self.tool_output(3, 5000)
+        self.history.compact_if_needed(6)
+        self.assertEqual(self.result_of(1), "x" * (config.HISTORY_ELIDE_MIN_CHARS - 1))
+
+    def test_compacted_messages_are_not_compacted_again(self):
+        self.tool_output(1, 5000)
+        first = self.history.compact_if_needed(4)
+        self.assertGreater(first, 0)
+        self.history.chars_added_since_usage += 5000 * config.CHARS_PER_TOKEN
+        self.assertEqual(self.history.compact_if_needed(5), 0)
+
+    def test_usage_resets_the_estimate(self):
+        self.tool_output(1, 4000)
+        self.history.record_usage(types.GenerateContentResponseUsageMetadata(prompt_token_count=300, candidates_token_count=20))
+        self.assertEqual(self.history.estimated_prompt_tokens(), 320)
+        self.assertEqual(self.history.compact_if_needed(4), 0)
+
+
+class TestToolCache(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.addCleanup(setattr, config, "PREFETCH", config.PREFETCH)
+        config.PREFETCH = False
+        write_file(self.work, "pkg/a.py", "a = 1\n")
+        write_file(self.work, "pkg/b.py", "b = 2\n")
+
+    def path(self, rel_path):
+        return os.path.join(self.work, rel_path)
+
+    def call(self, context, name, **args):
+        content = function_call.call_function(types.FunctionCall(name=name, args=args), context=context)
+        return content.parts[0].function_response.response["result"]
+
+    def test_key_normalizes_paths(self):
+        first = tool_cache.make_key("get_files_info", {"working_directory": self.work, "directory": "pkg/"})
+        second = tool_cache.make_key("get_files_info", {"working_directory": self.work + "/.", "directory": "./pkg"})
+        self.assertEqual(first, second)
+
+    def test_stale_signature_misses(self):
+        cache = tool_cache.ToolResultCache()
+        path = self.path("pkg/a.py")
+        cache.put("key", tool_cache.file_signature(path), path, "a = 1")
+        self.assertEqual(cache.get("key", tool_cache.file_signature(path)), "a = 1")
+        write_file(self.work, "pkg/a.py", "a = 100\n")
+        self.assertIsNone(cache.get("key", tool_cache.file_signature(path)))
+
+    def test_directory_signature_covers_its_entries(self):
+        before = tool_cache.file_signature(self.path("pkg"))
+        with open(self.path("pkg/a.py"), "a", encoding="utf-8") as f:
+            f.write("more = 2\n")
+        self.assertNotEqual(tool_cache.file_signature(self.path("pkg")), before)
+
+    def test_invalidate_path_drops_the_file_and_its_parents(self):
+        cache = tool_cache.ToolResultCache()
+        for key, rel_path in (("a", "pkg/a.py"), ("b", "pkg/b.py"), ("pkg", "pkg"), ("root", ".")):
+            cache.put(key, None, os.path.normpath(self.path(rel_path)), key)
+        cache.invalidate_path(self.path("pkg/a.py"))
+        self.assertEqual([key for key in "a b pkg root".split() if cache.contains(key, None)], ["b"])
+        self.assertEqual(cache.stats()["invalidations"], 3)
+
+    def test_invalidate_workspace(self):
+        cache = tool_cache.ToolResultCache()
+        other = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other)
+        cache.put(tool_cache.make_key("get_file_content", {"working_directory": self.work, "file_path": "pkg/a.py"}), None, self.path("pkg/a.py"), "a")
+        cache.put(tool_cache.make_key("get_file_content", {"working_directory": other, "file_path": "a.py"}), None, os.path.join(other, "a.py"), "b")
+        cache.invalidate_workspace(self.work)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = tool_cache.ToolResultCache(max_entries=2)
+        cache.put("a", None, "/a", "a")
+        cache.put("b", None, "/b", "b")
+        cache.get("a", None)
+        cache.put("c", None, "/c", "c")
+        self.assertEqual([key for key in "abc" if cache.contains(key, None)], ["a", "c"])
+
+    def test_repeated_read_is_answered_with_a_reference(self):
+        context = function_call.ToolContext(self.work, quiet=True)
+        context.start_turn(1, 0, config.HISTORY_TOKEN_BUDGET)
+        self.assertEqual(self.call(context, "get_file_content", file_path="pkg/a.py"), "a = 1\n")
+        context.start_turn(3, 0, config.HISTORY_TOKEN_BUDGET)
+        self.assertTrue(self.call(context, "get_file_content", file_path="pkg/a.py").startswith("Unchanged since turn 1:"))
+
+        # after a write the file is sent in full again
+        self.assertTrue(self.call(context, "write_file", file_path="pkg/a.py", content="a = 2\n").startswith("Successfully"))
+        self.assertEqual(self.call(context, "get_file_content", file_path="pkg/a.py"), "a = 2\n")
+
+        # another session gets the full content from the shared cache
+        other = function_call.ToolContext(self.work, quiet=True)
+        self.assertEqual(self.call(other, "get_file_content", file_path="pkg/a.py"), "a = 2\n")
+
+    def test_compacted_results_are_sent_again(self):
+        context = function_call.ToolContext(self.work, quiet=True)
+        context.start_turn(1, 0, config.HISTORY_TOKEN_BUDGET)
+        self.call(context, "get_file_content", file_path="pkg/b.py")
+        context.start_turn(5, 0, config.HISTORY_TOKEN_BUDGET)
+        context.forget_turns_before(3)
+        self.assertEqual(self.call(context, "get_file_content", file_path="pkg/b.py"), "b = 2\n")
+
+
+class TestReplayBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    @staticmethod
+    def request(text):
+        return [types.Content(role="user", parts=[types.Part(text=text)])]
+
+    @staticmethod
+    def text_of(response):
+        return response.candidates[0].content.parts[0].text
+
+    def replay(self, responses):
+        path = os.path.join(self.tmp, "replay.jsonl")
+        write_replay_log(path, responses)
+        return ReplayBackend(path)
+
+    def test_request_hash(self):
+        self.assertEqual(request_hash("m", self.request("hi")), request_hash("m", self.request("hi")))
+        self.assertNotEqual(request_hash("m", self.request("hi")), request_hash("m", self.request("hello")))
+        self.assertNotEqual(request_hash("m", self.request("hi")), request_hash("other", self.request("hi")))
+
+    def test_matching_request_is_answered_first(self):
+        backend = self.replay([
+            {"text": "for first", "request_hash": request_hash("m", self.request("first"))},
+            {"text": "for second", "request_hash": request_hash("m", self.request("second"))},
+        ])
+        generate = lambda text: asyncio.run(backend.generate("m", self.request(text), None))
+        self.assertEqual(self.text_of(generate("second")), "for second")
+        # an unknown request gets the next unused response in file order
+        self.assertEqual(self.text_of(generate("unknown")), "for first")
+        with self.assertRaises(ReplayError):
+            generate("first")
+
+    def test_recording_replays_by_request(self):
+        path = os.path.join(self.tmp, "recorded.jsonl")
+        recorder = RecordingBackend(self.replay([{"text": "one"}, {"text": "two"}]), path)
+        asyncio.run(recorder.generate("m", self.request("first"), None))
+
+        async def stream(backend, text):
+            return [chunk async for chunk in backend.generate_stream("m", self.request(text), None)]
+        asyncio.run(stream(recorder, "second"))
+
+        replay = ReplayBackend(path)
+        self.assertEqual(self.text_of(asyncio.run(replay.generate("m", self.request("second"), None))), "two")
+        chunks = asyncio.run(stream(replay, "first"))
+        self.assertEqual([self.text_of(chunk) for chunk in chunks], ["one"])
+
+
+class TestGetFilesInfo(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        files = {
+            ".gitignore": "# build output\nbuild/\n*.log\n/secret.txt\n",
+            "main.py": "", "secret.txt": "", "run.log": "",
+            "build/out.py": "", "__pycache__/main.cpython-313.pyc": "",
+            "pkg/__init__.py": "", "pkg/calc.py": "", "pkg/secret.txt": "",
+            "pkg/sub/deep.py": "", "pkg/sub/deeper/deepest.py": "",
+        }
+        for rel_path, content in files.items():
+            write_file(self.work, rel_path, content)
+
+    # the paths in a listing, and its cursor if it was cut off
+    @staticmethod
+    def paths(listing):
+        paths = [line[2:].split(": file_size=")[0] for line in listing.splitlines() if line.startswith("- ")]
+        cursor = listing.rsplit('cursor="', 1)[1].split('"')[0] if 'cursor="' in listing else None
+        return paths, cursor
+
+    def test_lists_one_level_without_ignored_entries(self):
+        self.assertEqual(self.paths(get_files_info(self.work)), ([".gitignore", "main.py", "pkg"], None))
+
+    def test_anchored_patterns_only_match_at_the_root(self):
+        paths, _ = self.paths(get_files_info(self.work, "pkg"))
+        self.assertEqual(paths, ["__init__.py", "calc.py", "secret.txt", "sub"])
+
+    def test_recursive_listing_and_max_depth(self):
+        paths, _ = self.paths(get_files_info(self.work, recursive=True))
+        self.assertEqual(paths, [
+            ".gitignore", "main.py", "pkg", "pkg/__init__.py", "pkg/calc.py", "pkg/secret.txt",
+            "pkg/sub", "pkg/sub/deep.py", "pkg/sub/deeper", "pkg/sub/deeper/deepest.py",
+        ])
+        paths, _ = self.paths(get_files_info(self.work, "pkg", recursive=True, max_depth=2))
+        self.assertEqual(paths, ["__init__.py", "calc.py", "secret.txt", "sub", "sub/deep.py", "sub/deeper"])
+
+    def test_pattern(self):
+        paths, _ = self.paths(get_files_info(self.work, recursive=True, pattern="*.py"))
+        self.assertEqual(paths, ["main.py", "pkg/__init__.py", "pkg/calc.py", "pkg/sub/deep.py", "pkg/sub/deeper/deepest.py"])
+
+    def test_cursor_pages_through_the_listing(self):
+        everything, _ = self.paths(get_files_info(self.work, recursive=True))
+        pages = []
+        cursor = None
+        while True:
+            paths, cursor = self.paths(get_files_info(self.work, recursive=True, limit=3, cursor=cursor))
+            self.assertLessEqual(len(paths), 3)
+            pages.append(paths)
+            if cursor is None:
+                break
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(sum(pages, []), everything)
+        self.assertEqual(pages[1], ["pkg/__init__.py", "pkg/calc.py", "pkg/secret.txt"])
+
+    def test_errors(self):
+        self.assertTrue(get_files_info(self.work, "..").startswith("Error: Cannot list"))
+        self.assertTrue(get_files_info(self.work, "main.py").startswith('Error: "main.py" is not a directory'))
+
+
+class TestGetFileContent(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        write_file(self.work, "lines.txt", "".join(f"line {number}\n" for number in range(1, 11)))
+        write_file(self.work, "empty.txt", "")
+
+    def read(self, file_path="lines.txt", **kwargs):
+        return get_file_content(self.work, file_path, **kwargs)
+
+    def test_line_range(self):
+        self.assertEqual(self.read(start_line=3, end_line=4), '[Lines 3-4 of 10 in "lines.txt"]\nline 3\nline 4\n')
+        self.assertEqual(self.read(start_line=9), '[Lines 9-10 of 10 in "lines.txt"]\nline 9\nline 10\n')
+        self.assertEqual(self.read(end_line=1), '[Lines 1-1 of 10 in "lines.txt"]\nline 1\n')
+        # an end past the last line is clamped
+        self.assertEqual(self.read(start_line=10, end_line=99), '[Lines 10-10 of 10 in "lines.txt"]\nline 10\n')
+
+    def test_line_index_follows_changes(self):
+        self.read(start_line=1, end_line=1)
+        write_file(self.work, "lines.txt", "first\nsecond\n")
+        self.assertEqual(self.read(start_line=2), '[Lines 2-2 of 2 in "lines.txt"]\nsecond\n')
+
+    def test_byte_range(self):
+        self.assertEqual(self.read(offset=7, length=6), '[Bytes 7-13 of 71 in "lines.txt"]\nline 2')
+        self.assertEqual(self.read(offset=63), '[Bytes 63-71 of 71 in "lines.txt"]\nline 10\n')
+        self.assertEqual(self.read(offset=70, length=50), '[Bytes 70-71 of 71 in "lines.txt"]\n\n')
+
+    def test_past_the_end(self):
+        self.assertEqual(self.read(start_line=11), 'Error: start_line 11 is past the end of "lines.txt" (10 lines)')
+        self.assertEqual(self.read(offset=71), 'Error: offset 71 is past the end of "lines.txt" (71 bytes)')
+        self.assertEqual(self.read("empty.txt", start_line=1), '[File "empty.txt" is empty]')
+
+    def test_invalid_ranges(self):
+        self.assertTrue(self.read(start_line=0).startswith("Error: Invalid line range"))
+        self.assertTrue(self.read(start_line=5, end_line=4).startswith("Error: Invalid line range"))
+        self.assertEqual(self.read(offset=-1), "Error: offset and length must not be negative")
+        self.assertEqual(self.read(start_line=1, offset=0), "Error: Use either start_line/end_line or offset/length, not both")
+
+    def test_open_ended_read_is_capped(self):
+        write_file(self.work, "big.txt", "é" * (config.MAX_CHARS * 3))
+        text = self.read("big.txt", offset=0)
+        body = text.split("\n", 1)[1]
+        self.assertTrue(body.startswith("é" * config.MAX_CHARS + '[...File "big.txt" truncated'))
+
+
+class TestAgentDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmp = isolate_caches(self)
+        self.addCleanup(setattr, config, "PREFETCH", config.PREFETCH)
+        config.PREFETCH = False
+        self.work = os.path.join(self.tmp, "work")
+        os.makedirs(self.work)
+        printing = mock.patch("builtins.print")
+        printing.start()
+        self.addCleanup(printing.stop)
+
+    def daemon(self, responses, **kwargs):
+        path = os.path.join(self.tmp, "replay.jsonl")
+        write_replay_log(path, responses)
+        return AgentDaemon(ReplayBackend(path), socket_path=os.path.join(self.tmp, "agent.sock"), working_directory=self.work, isolate=False, **kwargs)
+
+    def test_sessions_keep_their_own_history(self):
+        daemon = self.daemon([{"text": "one"}, {"text": "two"}, {"text": "three"}])
+
+        async def scenario():
+            first = await daemon.handle_request({"prompt": "a", "session": "s1"})
+            other = await daemon.handle_request({"prompt": "b", "session": "s2"})
+            second = await daemon.handle_request({"prompt": "c", "session": "s1"})
+            return first, other, second, await daemon.handle_request({"op": "sessions"})
+
+        first, other, second, listing = asyncio.run(scenario())
+        self.assertEqual([first["text"], other["text"], second["text"]], ["one", "two", "three"])
+        messages = {session["session_id"]: (session["prompts"], session["messages"]) for session in listing["sessions"]}
+        self.assertEqual(messages, {"s1": (2, 4), "s2": (1, 2)})
+
+    def test_failed_prompt_is_dropped_from_the_history(self):
+        daemon = self.daemon([{"text": "one"}])
+
+        async def scenario():
+            await daemon.handle_request({"prompt": "a", "session": "s"})
+            # the replay log has no response left for this one
+            failed = await daemon.handle_request({"prompt": "b", "session": "s"})
+            return failed, len(daemon.sessions["s"].history.messages)
+
+        failed, messages = asyncio.run(scenario())
+        self.assertIn("Replay log has no recorded response left", failed["error"])
+        self.assertEqual(messages, 2)
+
+    def test_least_recently_used_sessions_are_dropped(self):
+        daemon = self.daemon([{"text": "ok"}] * 3, max_sessions=2)
+
+        async def scenario():
+            for name in ("s1", "s2", "s3"):
+                await daemon.handle_request({"prompt": "hi", "session": name})
+        asyncio.run(scenario())
+        self.assertEqual(list(daemon.sessions), ["s2", "s3"])
+
+    def test_bad_requests(self):
+        daemon = self.daemon([])
+        self.assertEqual(asyncio.run(daemon.handle_request({"op": "nope"})), {"error": "Unknown op: nope"})
+        self.assertIn("error", asyncio.run(daemon.handle_request({"prompt": "  "})))
+
+    def test_serves_clients_over_the_socket(self):
+        daemon = self.daemon([{"text": "hello"}])
+        server = threading.Thread(target=asyncio.run, args=(daemon.serve(),), daemon=True)
+        server.start()
+        deadline = time.monotonic() + 10
+        while not os.path.exists(daemon.socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        response = client.request({"prompt": "hi", "session": "s", "id": 7}, socket_path=daemon.socket_path, timeout=10)
+        self.assertEqual((response["text"], response["id"]), ("hello", 7))
+        self.assertEqual(client.request({"op": "ping"}, socket_path=daemon.socket_path, timeout=10)["sessions"], 1)
+        self.assertEqual(client.request({"op": "shutdown"}, socket_path=daemon.socket_path, timeout=10), {"ok": True})
+        server.join(10)
+        self.assertFalse(server.is_alive())
+        self.assertFalse(os.path.exists(daemon.socket_path))
+
+
+class TestSessionStore(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+
+    def exchange(self, history, turn, output):
+        call = types.FunctionCall(name="get_file_content", args={"file_path": "big.txt"})
+        history.add(types.Content(role="model", parts=[types.Part(function_call=call)]), turn)
+        response = types.Part.from_function_response(name="get_file_content", response={"result": output})
+        history.add(types.Content(role="user", parts=[response]), turn)
+
+    def answer(self, history, turn, text):
+        history.add(types.Content(role="model", parts=[types.Part(text=text)]), turn)
+
+    def blob_count(self):
+        return sum(len(names) for _, _, names in os.walk(os.path.join(config.SESSIONS_DIR, "blobs")))
+
+    def test_round_trip(self):
+        output = "x" * config.SESSION_BLOB_MIN_CHARS
+        history = session_store.new_history("s1", working_directory="/work")
+        history.add_prompt("read it twice")
+        self.exchange(history, 1, output)
+        self.exchange(history, 2, output)
+        self.answer(history, 3, "done")
+
+        loaded = session_store.load_history("s1")
+        self.assertEqual(loaded.messages, history.messages)
+        self.assertEqual(loaded.turns, [0, 1, 1, 2, 2, 3])
+        # the output both calls returned is stored once
+        self.assertEqual(self.blob_count(), 1)
+        meta = next(session_store.read_records(session_store.session_path("s1")))
+        self.assertEqual((meta["type"], meta["working_directory"]), ("meta", "/work"))
+        [session] = session_store.list_sessions()
+        self.assertEqual((session["session_id"], session["prompt"], session["messages"]), ("s1", "read it twice", 6))
+
+    def test_truncated_messages_are_not_loaded(self):
+        history = session_store.new_history("s1")
+        history.add_prompt("first")
+        self.answer(history, 1, "one")
+        history.add_prompt("failed")
+        history.truncate(2)
+        history.add_prompt("second")
+        self.answer(history, 2, "two")
+
+        loaded = session_store.load_history("s1")
+        self.assertEqual([content.parts[0].text for content in loaded.messages], ["first", "one", "second", "two"])
+
+    def test_unanswered_prompt_is_dropped_on_load(self):
+        history = session_store.new_history("s1")
+        history.add_prompt("first")
+        self.answer(history, 1, "one")
+        # the agent stopped with a function call that never got its response
+        history.add_prompt("second")
+        call = types.FunctionCall(name="get_files_info", args={})
+        history.add(types.Content(role="model", parts=[types.Part(function_call=call)]), 2)
+
+        loaded = session_store.load_history("s1")
+        self.assertEqual(len(loaded.messages), 2)
+        # the log records the truncation, so what is added next follows the finished answer
+        loaded.add_prompt("third")
+        self.answer(loaded, 2, "three")
+        self.assertEqual([content.parts[0].text for content in session_store.load_history("s1").messages], ["first", "one", "third", "three"])
+
+    def test_record_cut_short_is_ignored_and_repaired(self):
+        history = session_store.new_history("s1")
+        history.add_prompt("first")
+        self.answer(history, 1, "one")
+        path = session_store.session_path("s1")
+        size = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(b"\x00\x00\x01\x00{\"type\"")
+
+        loaded = session_store.load_history("s1")
+        self.assertEqual(len(loaded.messages), 2)
+        # reopening the log cut the partial record off, so new records can be read back
+        self.assertEqual(os.path.getsize(path), size)
+        loaded.add_prompt("second")
+        self.answer(loaded, 2, "two")
+        self.assertEqual(len(session_store.load_history("s1").messages), 4)
+
+    def test_older_outputs_come_back_compacted_over_budget(self):
+        history = session_store.new_history("s1")
+        history.add_prompt("read")
+        for turn in (1, 2, 3):
+            self.exchange(history, turn, str(turn) * 2000)
+        self.answer(history, 4, "done")
+
+        loaded = session_store.load_history("s1", token_budget=1000, keep_recent_turns=2)
+        results = [content.parts[0].function_response.response["result"] for content in loaded.messages if content.role == "user" and content.parts[0].function_response]
+        self.assertIn("[...elided 1800 more characters of get_file_content output from iteration 1", results[0])
+        self.assertIn("from iteration 2", results[1])
+        self.assertEqual(results[2], "3" * 2000)
+
+    def test_unknown_and_invalid_sessions(self):
+        with self.assertRaisesRegex(SessionError, "No saved session"):
+            session_store.load_history("missing")
+        for session_id in ("../escape", ".hidden", ""):
+            with self.assertRaises(SessionError):
+                session_store.session_path(session_id)
+
+
+def quota_error(retry_delay=None):
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay}] if retry_delay else []
+    return errors.APIError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "quota", "details": details}})
+
+
+# Stands in for the model API: raises the given errors in order, then answers every request.
+# Records when each request arrived.
+class FlakyBackend:
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+
+    async def generate(self, model, contents, config):
+        self.calls.append(time.monotonic())
+        if self.failures:
+            raise self.failures.pop(0)
+        usage = types.GenerateContentResponseUsageMetadata(prompt_token_count=90, candidates_token_count=10)
+        return types.GenerateContentResponse(usage_metadata=usage)
+
+
+class TestScheduler(unittest.TestCase):
+    def generate(self, backend, requests=1):
+        async def scenario():
+            async def one(delay):
+                await asyncio.sleep(delay)
+                return await backend.generate("model", [types.Content(role="user", parts=[types.Part(text="hi")])], None)
+            # later requests arrive while the first one is being retried
+            return await asyncio.gather(*(one(index * 0.05) for index in range(requests)))
+        return asyncio.run(scenario())
+
+    def test_quota_error_pauses_every_request(self):
+        inner = FlakyBackend([quota_error("0.3s")])
+        scheduler = RequestScheduler(requests_per_minute=6000, tokens_per_minute=None)
+        self.generate(ScheduledBackend(inner, scheduler), requests=2)
+
+        first_failed, second, retried = inner.calls
+        # the second request waited out the delay the server asked for instead of going first
+        self.assertGreaterEqual(second - first_failed, 0.29)
+        self.assertGreaterEqual(retried - first_failed, 0.29)
+        self.assertEqual(scheduler.stats["retries"], 1)
+        self.assertEqual(scheduler.stats["errors"], {429: 1})
+        self.assertAlmostEqual(scheduler.stats["retry_seconds"], 0.3)
+        self.assertEqual(scheduler.stats["tokens"], 200)
+
+    def test_backoff_grows_exponentially_up_to_the_cap(self):
+        self.addCleanup(setattr, config, "MODEL_RETRY_BASE_SECONDS", config.MODEL_RETRY_BASE_SECONDS)
+        self.addCleanup(setattr, config, "MODEL_RETRY_MAX_SECONDS", config.MODEL_RETRY_MAX_SECONDS)
+        config.MODEL_RETRY_BASE_SECONDS = 0.001
+        config.MODEL_RETRY_MAX_SECONDS = 0.004
+        inner = FlakyBackend([errors.ServerError(503, {"error": {"code": 503}})] * 3 + [httpx.ConnectError("refused")])
+        scheduler = RequestScheduler(requests_per_minute=None, tokens_per_minute=None)
+        with mock.patch("scheduler.random.uniform", side_effect=lambda low, high: high) as uniform:
+            self.generate(ScheduledBackend(inner, scheduler))
+
+        self.assertEqual([call.args for call in uniform.call_args_list], [(0, 0.001), (0, 0.002), (0, 0.004), (0, 0.004)])
+        self.assertEqual(scheduler.stats["errors"], {503: 3, "network": 1})
+        self.assertEqual(scheduler.stats["failed"], 0)
+
+    def test_gives_up_after_max_retries(self):
+        inner = FlakyBackend([quota_error("0.01s")] * 3)
+        scheduler = RequestScheduler(requests_per_minute=None, tokens_per_minute=None)
+        with self.assertRaises(errors.APIError):
+            self.generate(ScheduledBackend(inner, scheduler, max_retries=2))
+        self.assertEqual(len(inner.calls), 3)
+        self.assertEqual((scheduler.stats["retries"], scheduler.stats["failed"]), (2, 1))
+
+    def test_other_errors_are_not_retried(self):
+        inner = FlakyBackend([errors.ClientError(400, {"error": {"code": 400}})])
+        scheduler = RequestScheduler(requests_per_minute=None, tokens_per_minute=None)
+        with self.assertRaises(errors.ClientError):
+            self.generate(ScheduledBackend(inner, scheduler))
+        self.assertEqual((len(inner.calls), scheduler.stats["retries"], scheduler.stats["failed"]), (1, 0, 1))
+
+
+class TestModelRouter(unittest.TestCase):
+    ROUTES = {"plan": "planner", "tool_step": "stepper", "escalated": "strong"}
+
+    def setUp(self):
+        self.router = ModelRouter(routes=self.ROUTES, escalate_context_tokens=10000, escalate_iterations=2, final_answer_model=None)
+
+    def tool_results(self, *results):
+        return types.Content(role="user", parts=[types.Part.from_function_response(name="get_file_content", response={"result": result}) for result in results])
+
+    def models(self, route, count, tokens=100):
+        return [self.router.choose(route, tokens)[0] for _ in range(count)]
+
+    def test_plan_then_tool_steps(self):
+        self.assertEqual(self.models(Route(), 3), ["planner", "stepper", "stepper"])
+
+    def test_failed_tool_call_escalates_the_next_iterations(self):
+        route = Route()
+        self.models(route, 1)
+        self.assertEqual(self.router.after_tools(route, self.tool_results("ok", 'Error: File not found: "x"', "Error: y")), 2)
+        self.assertEqual(route.reason, "2 failed tool calls")
+        self.assertEqual(self.models(route, 3), ["strong", "strong", "stepper"])
+
+    def test_successful_tool_calls_do_not_escalate(self):
+        route = Route()
+        self.models(route, 1)
+        self.assertEqual(self.router.after_tools(route, self.tool_results("ok", "fine")), 0)
+        self.assertEqual(self.models(route, 1), ["stepper"])
+
+    def test_model_error_retries_on_the_escalated_model_once(self):
+        route = Route()
+        self.models(route, 1)
+        self.assertTrue(self.router.retry_on_error(route, "planner"))
+        self.assertEqual(self.models(route, 1), ["strong"])
+        # the escalated model failing too is not worth another try
+        self.assertFalse(self.router.retry_on_error(route, "strong"))
+        self.assertEqual((self.router.stats["planner"]["errors"], self.router.stats["strong"]["errors"]), (1, 1))
+
+    def test_large_context_escalates(self):
+        route = Route()
+        self.assertEqual(self.models(route, 1, tokens=20000), ["strong"])
+        self.assertEqual(route.reason, "large context")
+        self.assertEqual(self.models(route, 1), ["stepper"])
+
+    def test_agent_loop_escalates_after_a_failed_tool_call(self):
+        tmp = isolate_caches(self)
+        self.addCleanup(setattr, config, "PREFETCH", config.PREFETCH)
+        config.PREFETCH = False
+        work = os.path.join(tmp, "work")
+        os.makedirs(work)
+        path = os.path.join(tmp, "replay.jsonl")
+        write_replay_log(path, [
+            {"function_calls": [{"name": "get_file_content", "args": {"file_path": "missing.txt"}}]},
+            {"function_calls": [{"name": "get_files_info", "args": {}}]},
+            {"text": "There is no such file."},
+        ])
+        result = asyncio.run(run_agent(ReplayBackend(path), "Read missing.txt", quiet=True, working_directory=work, router=self.router))
+        self.assertEqual(result["text"], "There is no such file.")
+        routes = {model: stats["routes"] for model, stats in self.router.stats.items()}
+        self.assertEqual(routes, {"planner": {"plan": 1}, "strong": {"escalated": 2}})
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.prefetcher = Prefetcher(max_pending=4)
+        # the worker holds each job until released, so the queue can be inspected
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.started = []
+        self.canceled = []
+
+    def fake_read(self, work, rel_path):
+        self.started.append(rel_path)
+        self.release.wait(5)
+
+    def fake_tests(self, work, cancel):
+        self.started.append("tests")
+        self.canceled.append(cancel.wait(5))
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def list_files(self, work, *names):
+        listing = "\n".join(f"- {name}: file_size=10 bytes, is_dir=False" for name in names)
+        self.prefetcher.after_tool("get_files_info", {"working_directory": work}, listing)
+
+    def queued(self):
+        return [(kind, rel_path) for kind, _, rel_path in self.prefetcher._jobs]
+
+    def test_write_drops_the_queued_reads_of_its_workspace(self):
+        other = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other)
+        with mock.patch.object(self.prefetcher, "_warm_read", side_effect=self.fake_read):
+            self.list_files(self.work, "a.py", "b.py", "c.py")
+            self.wait_for(lambda: self.started == ["a.py"])
+            self.list_files(other, "d.py")
+            self.prefetcher.before_tool("write_file", {"working_directory": self.work, "file_path": "a.py"})
+            self.assertEqual(self.queued(), [("read", "d.py")])
+            # the read in progress was told to stop too
+            self.assertTrue(self.prefetcher._running[1].is_set())
+            self.assertEqual(self.prefetcher.stats["canceled"], 3)
+            self.release.set()
+            self.wait_for(lambda: self.started == ["a.py", "d.py"])
+
+    def test_cancel_stops_a_test_pre_run_and_waits_for_it(self):
+        with mock.patch.object(self.prefetcher, "_pre_run_tests", side_effect=self.fake_tests):
+            self.prefetcher.after_tool("write_file", {"working_directory": self.work, "file_path": "a.py"}, 'Successfully wrote to "a.py"')
+            self.wait_for(lambda: self.prefetcher._test_runs.get(self.work) == "running")
+            self.prefetcher.cancel(self.work, wait=True)
+
+        self.assertEqual(self.canceled, [True])
+        self.assertIsNone(self.prefetcher._running)
+        self.assertNotIn(self.work, self.prefetcher._test_runs)
+        self.assertEqual(self.prefetcher.stats["canceled"], 1)
+
+    def test_run_tests_takes_over_a_queued_pre_run(self):
+        with mock.patch.object(self.prefetcher, "_warm_read", side_effect=self.fake_read):
+            self.list_files(self.work, "a.py")
+            self.wait_for(lambda: self.started == ["a.py"])
+            self.prefetcher.after_tool("edit_file", {"working_directory": self.work, "file_path": "a.py"}, 'Successfully edited "a.py"')
+            self.assertEqual(self.queued(), [("tests", None)])
+            self.prefetcher.before_tool("run_tests", {"working_directory": self.work})
+            # the model's own call runs the tests, so the pre-run is dropped
+            self.assertEqual(self.queued(), [])
+            self.assertEqual((self.prefetcher.stats["canceled"], self.prefetcher.stats["tests_used"]), (1, 0))
+
+    def test_jobs_beyond_max_pending_are_dropped(self):
+        with mock.patch.object(self.prefetcher, "_warm_read", side_effect=self.fake_read):
+            self.list_files(self.work, "a.py")
+            self.wait_for(lambda: self.started == ["a.py"])
+            self.list_files(self.work, *(f"f{number}.py" for number in range(6)))
+            self.assertEqual(len(self.queued()), 4)
+            self.assertEqual(self.prefetcher.stats["dropped"], 2)
+
+
+class TestWorkspaceMerge(unittest.TestCase):
+    def setUp(self):
+        self.base = os.path.join(isolate_caches(self), "base")
+        os.makedirs(self.base)
+        for name in ("a.txt", "b.txt"):
+            write_file(self.base, name, f"{name} original\n")
+
+    def read_base(self, name):
+        with open(os.path.join(self.base, name), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def test_merges_changes_and_removes_workspace(self):
+        workspace = workspaces.create_workspace("merge", self.base, mode="hardlink")
+        write_file(workspace.path, "a.txt", "changed\n")
+        write_file(workspace.path, "c.txt", "added\n")
+        os.remove(os.path.join(workspace.path, "b.txt"))
+
+        merged, conflicts = workspace.merge()
+        self.assertEqual(sorted(merged), ["a.txt", "b.txt", "c.txt"])
+        self.assertEqual(conflicts, [])
+        self.assertEqual(self.read_base("a.txt"), "changed\n")
+        self.assertEqual(self.read_base("c.txt"), "added\n")
+        self.assertFalse(os.path.exists(os.path.join(self.base, "b.txt")))
+        self.assertFalse(workspaces.has_workspace("merge"))
+
+    def test_base_changed_since_snapshot_is_a_conflict(self):
+        first = workspaces.create_workspace("first", self.base, mode="copy")
+        second = workspaces.create_workspace("second", self.base, mode="copy")
+        write_file(first.path, "a.txt", "from first\n")
+        write_file(second.path, "a.txt", "from second\n")
+        write_file(second.path, "b.txt", "from second\n")
+
+        self.assertEqual(first.merge(), (["a.txt"], []))
+        merged, conflicts = second.merge()
+        self.assertEqual(merged, ["b.txt"])
+        self.assertEqual(conflicts, ["a.txt"])
+        self.assertEqual(self.read_base("a.txt"), "from first\n")
+        # the conflicting change is kept for review
+        self.assertTrue(workspaces.has_workspace("second"))
+        self.assertEqual(workspaces.load_workspace("second").changes(), [("modified", "a.txt")])
+
+    def test_leaked_write_is_a_conflict(self):
+        workspace = workspaces.create_workspace("leak", self.base, mode="hardlink")
+        if workspace.mode != "hardlink":
+            self.skipTest("hard links are not supported here")
+        with open(os.path.join(workspace.path, "a.txt"), "a", encoding="utf-8") as f:
+            f.write("written in place\n")
+        self.assertEqual(workspace.changes(), [("leaked", "a.txt")])
+        self.assertEqual(workspace.merge(), ([], ["a.txt"]))
+
+    def test_code_runs_in_a_detached_workspace(self):
+        workspace = workspaces.create_workspace("detach", self.base, mode="hardlink")
+        workspaces.prepare_for_code(workspace.path)
+        with open(os.path.join(workspace.path, "a.txt"), "a", encoding="utf-8") as f:
+            f.write("written in place\n")
+        self.assertEqual(self.read_base("a.txt"), "a.txt original\n")
+        self.assertEqual(workspaces.load_workspace("detach").changes(), [("modified", "a.txt")])
+
+    def test_rejects_unsafe_session_ids(self):
+        for session_id in ("../escape", ".hidden", "a/b", ""):
+            with self.subTest(session_id=session_id), self.assertRaises(SessionError):
+                workspaces.create_workspace(session_id, self.base)
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.work = os.path.join(isolate_caches(self), "work")
+        os.makedirs(os.path.join(self.work, "pkg"))
+        write_file(self.work, "pkg/calculator.py", "class Calculator:\n    def evaluate(self, expression):\n        pass\n")
+        write_file(self.work, "pkg/render.py", "def render(value):\n    return str(value)\n")
+        write_file(self.work, "notes.txt", "The calculator evaluates expressions.\n")
+
+    def open_index(self, working_directory):
+        self.addCleanup(search_index.close_index, working_directory)
+        index = search_index.get_index(working_directory)
+        index.refresh(force=True)
+        return index
+
+    def test_required_literals(self):
+        self.assertEqual(search_index.required_literals("def evaluate"), ["def evaluate"])
+        self.assertEqual(search_index.required_literals(r"class \w+Calc"), ["class ", "Calc"])
+        self.assertEqual(search_index.required_literals("abc|xyz"), [])
+        self.assertEqual(search_index.required_literals("a.b"), [])
+
+    def test_candidates_contain_every_trigram(self):
+        index = self.open_index(self.work)
+        self.assertEqual(index.candidates(["calculator"]), ["notes.txt", "pkg/calculator.py"])
+        self.assertEqual(index.candidates(["calculator", "def evaluate"]), ["pkg/calculator.py"])
+        self.assertEqual(index.candidates(["no such text"]), [])
+        self.assertEqual(index.candidates([]), ["notes.txt", "pkg/calculator.py", "pkg/render.py"])
+
+    def test_write_updates_the_index(self):
+        index = self.open_index(self.work)
+        write_file(self.work, "pkg/render.py", "def render(calculator):\n    return calculator\n")
+        search_index.notify_write(self.work, os.path.join(self.work, "pkg", "render.py"))
+        self.assertEqual(index.candidates(["calculator"]), ["notes.txt", "pkg/calculator.py", "pkg/render.py"])
+        os.remove(os.path.join(self.work, "notes.txt"))
+        index.refresh(force=True)
+        self.assertEqual(index.candidates(["calculator"]), ["pkg/calculator.py", "pkg/render.py"])
+
+    def test_workspace_index_is_seeded_from_its_base(self):
+        workspace = workspaces.create_workspace("seed", self.work)
+        self.addCleanup(search_index.close_index, self.work)
+        self.addCleanup(workspace.discard)
+        write_file(workspace.path, "pkg/render.py", "def render(calculator):\n    return calculator\n")
+        results = []
+        # the base's index isn't open yet, so seeding has to open it first
+        search = threading.Thread(target=lambda: results.append(search_files(workspace.path, "calculator", case_sensitive=False)), daemon=True)
+        search.start()
+        search.join(20)
+        self.assertFalse(search.is_alive(), "search_files hung while seeding the workspace index")
+        self.assertIn("pkg/render.py:1:", results[0])
+        self.assertIn("notes.txt:1:", results[0])
+        self.assertTrue(os.path.exists(search_index._db_path(self.work)))
+
+
+class TestRunAffected(unittest.TestCase):
+    def setUp(self):
+        self.work = os.path.join(isolate_caches(self), "work")
+        os.makedirs(os.path.join(self.work, "pkg"))
+        write_file(self.work, "pkg/__init__.py", "")
+        write_file(self.work, "pkg/adder.py", "def add(a, b):\n    return a + b\n")
+        write_file(self.work, "pkg/doubler.py", "def double(a):\n    return a * 2\n")
+        write_file(self.work, "test_adder.py", self.module_source("from pkg.adder import add", "add(1, 2)", 3))
+        write_file(self.work, "test_doubler.py", self.module_source("from pkg import doubler", "doubler.double(2)", 4))
+
+    @staticmethod
+    def module_source(import_line, expression, expected):
+        return f"import unittest\n{import_line}\n\nclass T(unittest.TestCase):\n    def test(self):\n        self.assertEqual({expression}, {expected})\n"
+
+    def ran(self, **kwargs):
+        reports, ran, cached = test_runner.run_affected(self.work, **kwargs)
+        return {rel_path: (result["passed"], origin) for rel_path, result, origin in reports}, ran, cached
+
+    def test_only_affected_tests_run_again(self):
+        self.assertEqual(self.ran(), ({"test_adder.py": (True, None), "test_doubler.py": (True, None)}, 2, 0))
+        self.assertEqual(self.ran(), ({"test_adder.py": (True, "cached"), "test_doubler.py": (True, "cached")}, 0, 2))
+
+        write_file(self.work, "pkg/doubler.py", "def double(a):\n    return a * 3\n")
+        self.assertEqual(self.ran(), ({"test_adder.py": (True, "cached"), "test_doubler.py": (False, None)}, 1, 1))
+        self.assertEqual(self.ran(force=True)[1:], (2, 0))
+
+    def test_pre_run_results_are_labelled_once(self):
+        self.ran(prerun=True)
+        self.assertEqual(self.ran()[0]["test_adder.py"], (True, "pre-run"))
+        self.assertEqual(self.ran()[0]["test_adder.py"], (True, "cached"))
+
+    @unittest.skipUnless(config.RUN_PYTHON_MEMORY_LIMIT_MB, "no memory limit configured")
+    def test_tests_get_the_memory_limit(self):
+        limit = config.RUN_PYTHON_MEMORY_LIMIT_MB * 1024 * 1024
+        write_file(self.work, "test_limit.py", self.module_source("import resource", "resource.getrlimit(resource.RLIMIT_AS)[0]", limit))
+        self.assertEqual(self.ran(only={"test_limit.py"})[0], {"test_limit.py": (True, None)})
+
+    def test_removed_workspace_leaves_no_results(self):
+        workspace = workspaces.create_workspace("results", self.work)
+        test_runner.run_affected(workspace.path)
+        results_path = test_runner._results_path(workspace.path)
+        self.assertTrue(os.path.exists(results_path))
+        workspace.discard()
+        self.assertFalse(os.path.exists(results_path))
+
+
+@unittest.skipUnless(interpreter_pool.available(), "the interpreter pool needs fork and fd passing")
+class TestInterpreterPool(unittest.TestCase):
+    # scripts whose exit code and output must be the same in a pool worker as with `python script`
+    SCRIPTS = {
+        "prints.py": "import sys\nprint('out')\nprint('err', file=sys.stderr)\n",
+        "raises.py": "def fail():\n    raise ValueError('bad input')\nprint('before')\nfail()\n",
+        "syntax_error.py": "def (\n",
+        "exit_259.py": "import sys\nsys.exit(259)\n",
+        "exit_negative.py": "import sys\nsys.exit(-1)\n",
+        "exit_message.py": "import sys\nsys.exit('fatal: no input')\n",
+        "terminated.py": "import os, signal\nprint('going', flush=True)\nos.kill(os.getpid(), signal.SIGTERM)\n",
+        "thread_and_atexit.py": (
+            "import atexit, threading, time\n"
+            "atexit.register(print, 'atexit')\n"
+            "threading.Thread(target=lambda: (time.sleep(0.1), print('thread'))).start()\n"
+        ),
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = interpreter_pool.InterpreterPool(size=1)
+        cls.work = tempfile.mkdtemp()
+        for name, source in cls.SCRIPTS.items():
+            with open(os.path.join(cls.work, name), "w", encoding="utf-8") as f:
+                f.write(source)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        shutil.rmtree(cls.work)
+
+    def run_pooled(self, script, timeout=10, capture=None):
+        capture = capture or OutputCapture()
+        with tempfile.TemporaryDirectory() as output_dir:
+            returncode = self.pool.run(script, [], self.work, timeout, output_dir, capture)
+        return returncode, capture.stdout.getvalue(), capture.stderr.getvalue()
+
+    def test_matches_plain_python(self):
+        for name in self.SCRIPTS:
+            with self.subTest(script=name):
+                script = os.path.join(self.work, name)
+                plain = subprocess.run([sys.executable, script], cwd=self.work, capture_output=True, text=True, timeout=10)
+                self.assertEqual(self.run_pooled(script), (plain.returncode, plain.stdout, plain.stderr))
+
+    def test_output_flood_is_killed(self):
+        script = os.path.join(self.work, "flood.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write("while True:\n    print('x' * 1000)\n")
+        capture = OutputCapture(kill_after_chars=100000)
+        returncode, _, _ = self.run_pooled(script, capture=capture)
+        self.assertTrue(capture.killed)
+        self.assertEqual(returncode, -9)
+
+    def test_timeout(self):
+        script = os.path.join(self.work, "sleeps.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write("import time\ntime.sleep(30)\n")
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.run_pooled(script, timeout=0.5)
+
+
+class TestShapeResult(unittest.TestCase):
+    def test_result_within_budget_is_unchanged(self):
+        text = "x" * (100 * config.CHARS_PER_TOKEN)
+        self.assertEqual(shape_result("run_python_file", {}, text, 100), (text, 0))
+
+    def test_result_one_char_over_budget_is_cut(self):
+        text = "x\n" * (50 * config.CHARS_PER_TOKEN) + "y"
+        shaped, elided = shape_result("run_python_file", {}, text, 100)
+        self.assertLessEqual(len(shaped), 100 * config.CHARS_PER_TOKEN)
+        self.assertEqual(elided, len(text) - len(shaped))
+        self.assertIn("elided to fit the context", shaped)
+
+    def test_python_file_keeps_outline_and_read_hints(self):
+        source = "import os\n\n" + "".join(
+            f"def function_{number}():\n" + "    value = 1\n" * 20 + "\n" for number in range(12)
+        )
+        shaped, _ = shape_result("get_file_content", {"file_path": "big.py"}, source, 400)
+        self.assertLessEqual(len(shaped), 400 * config.CHARS_PER_TOKEN)
+        self.assertIn("import os", shaped)
+        self.assertIn("def function_11():", shaped)
+        self.assertRegex(shaped, r"read them with start_line=\d+, end_line=\d+")
+
+    def test_log_keeps_error_lines_from_the_middle(self):
+        lines = [f"progress {number}" for number in range(2000)]
+        lines[1000] = "ValueError: bad input"
+        shaped, _ = shape_result("run_tests", {}, "\n".join(lines), 300)
+        self.assertIn("ValueError: bad input", shaped)
+        self.assertIn("progress 0", shaped)
+        self.assertIn("progress 1999", shaped)
+
+    def test_cut_off_listing_keeps_one_cursor(self):
+        entries = [f"- pkg/f{number:03d}.py: file_size=10 bytes, is_dir=False" for number in range(200)]
+        listing = "\n".join(entries) + '\n[Listing cut off after 200 entries. Call again with cursor="pkg/f199.py" to continue.]'
+        shaped, _ = shape_result("get_files_info", {}, listing, 300)
+        self.assertEqual(shaped.count("cursor="), 1)
+        last_kept = [line for line in shaped.splitlines() if line.startswith("- ")][-1]
+        self.assertIn(f'cursor="{last_kept[2:].split(": ")[0]}"', shaped)
+
+
+if __name__ == "__main__":
+    unittest.main()
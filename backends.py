@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import json
+import threading
+from collections import deque
+from google.genai import types
+
+# Model backends used by the agent loop.
+# Every backend has the same two async methods:
+#   generate(model, contents, config) -> types.GenerateContentResponse
+#   generate_stream(model, contents, config) -> async iterator of types.GenerateContentResponse chunks
+# so the agent can run against the live Gemini API, record a session to disk while doing so,
+# or replay a recorded session without any network access.
+
+# Raised when a replay log has no recorded response left for a request.
+class ReplayError(Exception):
+    pass
+
+# Serialize a list of types.Content objects (or a single response) into plain JSON data.
+def _dump(value):
+    if isinstance(value, list):
+        return [_dump(item) for item in value]
+    return value.model_dump(mode="json", exclude_none=True)
+
+# Hash a request so a replay can find the response recorded for exactly the same request.
+def request_hash(model, contents):
+    data = json.dumps({"model": model, "contents": _dump(list(contents))}, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+# Merge streamed chunks into a single response, the same way generate_content would return it.
+def merge_chunks(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    parts = []
+    usage_metadata = None
+    for chunk in chunks:
+        if chunk.usage_metadata:
+            usage_metadata = chunk.usage_metadata
+        if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+            parts.extend(chunk.candidates[0].content.parts)
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+        usage_metadata=usage_metadata,
+    )
+
+# Talks to the live Gemini API through a genai.Client's async interface.
+class GeminiBackend:
+    def __init__(self, client):
+        self.client = client
+
+    async def generate(self, model, contents, config):
+        return await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+    async def generate_stream(self, model, contents, config):
+        stream = await self.client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+        async for chunk in stream:
+            yield chunk
+
+# Wraps another backend and appends every request/response pair to a JSONL file.
+# Each line holds the request hash, the model, the request contents and the response
+# as a list of chunks (a single chunk when the request wasn't streamed).
+class RecordingBackend:
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, model, contents, chunks):
+        record = {
+            "request_hash": request_hash(model, contents),
+            "model": model,
+            "request": _dump(list(contents)),
+            "chunks": _dump(chunks),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    async def generate(self, model, contents, config):
+        # take a snapshot of the request before the caller appends to its message list
+        contents = list(contents)
+        response = await self.inner.generate(model, contents, config)
+        self._write(model, contents, [response])
+        return response
+
+    async def generate_stream(self, model, contents, config):
+        contents = list(contents)
+        chunks = []
+        async for chunk in self.inner.generate_stream(model, contents, config):
+            chunks.append(chunk)
+            yield chunk
+        self._write(model, contents, chunks)
+
+# Serves the responses from a recording made by RecordingBackend, without any network access.
+# A request is answered with the response recorded for an identical request if there is one;
+# otherwise the next unused recording in file order is used, so a scripted session still
+# replays when the agent loop changes what it sends (e.g. different compaction).
+# latency is the simulated time in seconds before each response (or its first chunk) arrives.
+class ReplayBackend:
+    def __init__(self, path, latency=0.0):
+        self.latency = latency
+        self._records = []
+        self._by_hash = {}
+        self._next_index = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                record["used"] = False
+                self._records.append(record)
+                self._by_hash.setdefault(record["request_hash"], deque()).append(record)
+
+    # Return the chunks of the recording that answers this request.
+    def _take(self, model, contents):
+        matches = self._by_hash.get(request_hash(model, contents))
+        while matches:
+            record = matches.popleft()
+            if not record["used"]:
+                break
+        else:
+            record = None
+            while self._next_index < len(self._records):
+                candidate = self._records[self._next_index]
+                self._next_index += 1
+                if not candidate["used"]:
+                    record = candidate
+                    break
+        if record is None:
+            raise ReplayError("Replay log has no recorded response left for this request")
+        record["used"] = True
+        return [types.GenerateContentResponse.model_validate(chunk) for chunk in record["chunks"]]
+
+    async def generate(self, model, contents, config):
+        chunks = self._take(model, contents)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return merge_chunks(chunks)
+
+    async def generate_stream(self, model, contents, config):
+        chunks = self._take(model, contents)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for chunk in chunks:
+            yield chunk
@@ -0,0 +1,159 @@
+# Offline benchmark for the agent loop.
+# Runs the scripted sessions in benchmarks/sessions.json through a ReplayBackend against a
+# fresh copy of the calculator/ workspace, and reports iterations, time spent in the model
+# and in tools, wall time and peak memory per session. No network access or API key is needed.
+#
+# Usage: python benchmarks/bench_agent.py [--repeat N] [--latency SECONDS]
+#                                         [--output results.json] [--baseline results.json]
+# Exits with code 1 if a session fails, or is slower/uses more iterations than the baseline.
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import asyncio
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from agent import run_agent
+from backends import ReplayBackend
+
+SESSIONS_PATH = os.path.join(ROOT, "benchmarks", "sessions.json")
+WORKSPACE = os.path.join(ROOT, "calculator")
+
+# Turn one scripted turn into a recorded response in the format RecordingBackend writes.
+def _scripted_response(turn, index):
+    if "function_calls" in turn:
+        parts = [{"function_call": call} for call in turn["function_calls"]]
+    else:
+        parts = [{"text": turn["text"]}]
+    return {
+        "candidates": [{"content": {"role": "model", "parts": parts}}],
+        "usage_metadata": {"prompt_token_count": 500 * (index + 1), "candidates_token_count": 20},
+    }
+
+# Write a scripted session as a replay log. The request hashes are placeholders, so the
+# replay serves the turns in order whatever the agent sends.
+def _write_replay_log(session, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for index, turn in enumerate(session["turns"]):
+            record = {
+                "request_hash": f"scripted:{session['name']}:{index}",
+                "model": "scripted",
+                "request": [],
+                "chunks": [_scripted_response(turn, index)],
+            }
+            f.write(json.dumps(record) + "\n")
+
+# Run one scripted session once in a fresh copy of the workspace and return its metrics.
+def run_session(session, latency, measure_memory=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        workspace = os.path.join(tmp, "calculator")
+        shutil.copytree(WORKSPACE, workspace, ignore=shutil.ignore_patterns("__pycache__"))
+        log_path = os.path.join(tmp, "replay.jsonl")
+        _write_replay_log(session, log_path)
+        backend = ReplayBackend(log_path, latency=latency)
+
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = asyncio.run(run_agent(backend, session["prompt"], quiet=True, working_directory=workspace))
+        wall_seconds = time.perf_counter() - start
+        peak_bytes = 0
+        if measure_memory:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    expected_text = session["turns"][-1].get("text")
+    ok = result["error"] is None and result["text"] == expected_text
+    return {
+        "ok": ok,
+        "error": result["error"],
+        "iterations": result["iterations"],
+        "model_seconds": result["model_seconds"],
+        "tool_seconds": result["tool_seconds"],
+        "wall_seconds": wall_seconds,
+        "peak_bytes": peak_bytes,
+    }
+
+# Run every session `repeat` times and keep the median timings.
+# Memory is measured in one extra run, because tracemalloc slows everything down.
+def run_benchmarks(sessions, repeat, latency):
+    results = {}
+    for session in sessions:
+        runs = [run_session(session, latency) for _ in range(repeat)]
+        memory_run = run_session(session, latency, measure_memory=True)
+        results[session["name"]] = {
+            "ok": all(run["ok"] for run in runs) and memory_run["ok"],
+            "error": next((run["error"] for run in runs if run["error"]), None),
+            "iterations": runs[0]["iterations"],
+            "model_seconds": statistics.median(run["model_seconds"] for run in runs),
+            "tool_seconds": statistics.median(run["tool_seconds"] for run in runs),
+            "wall_seconds": statistics.median(run["wall_seconds"] for run in runs),
+            "peak_kib": memory_run["peak_bytes"] / 1024,
+        }
+    return results
+
+# Print the results as a table.
+def print_table(results):
+    print(f"{'session':<18}{'ok':>4}{'iters':>7}{'model ms':>11}{'tools ms':>11}{'wall ms':>10}{'peak KiB':>11}")
+    for name, r in results.items():
+        print(
+            f"{name:<18}{'yes' if r['ok'] else 'NO':>4}{r['iterations']:>7}"
+            f"{r['model_seconds'] * 1000:>11.1f}{r['tool_seconds'] * 1000:>11.1f}"
+            f"{r['wall_seconds'] * 1000:>10.1f}{r['peak_kib']:>11.1f}"
+        )
+
+# Compare results with a saved baseline and return a list of regressions.
+def compare_with_baseline(results, baseline, tolerance):
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if r["iterations"] > base["iterations"]:
+            regressions.append(f"{name}: iterations {base['iterations']} -> {r['iterations']}")
+        for key in ("wall_seconds", "tool_seconds"):
+            if r[key] > base[key] * (1 + tolerance) and r[key] - base[key] > 0.005:
+                regressions.append(f"{name}: {key} {base[key]:.4f} -> {r[key]:.4f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline agent loop benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per session (median is reported)")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per model response")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="fail if results regress against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    with open(SESSIONS_PATH, "r", encoding="utf-8") as f:
+        sessions = json.load(f)
+
+    results = run_benchmarks(sessions, max(1, args.repeat), args.latency)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [name for name, r in results.items() if not r["ok"]]
+    for name in failed:
+        print(f"FAILED: {name}: {results[name]['error'] or 'unexpected final text'}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
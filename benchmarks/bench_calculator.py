@@ -0,0 +1,93 @@
+# Benchmark for the calculator: the original evaluate path (split + shunting-yard on every
+# call) against compiled, cached expressions and evaluate_many.
+# Evaluates the same formula templates over many different numbers and prints the time per
+# evaluation of each path.
+#
+# Usage: python benchmarks/bench_calculator.py [--count N]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "calculator"))
+
+import argparse
+import random
+import time
+from pkg import calculator as calculator_module
+from pkg.calculator import Calculator
+
+TEMPLATES = [
+    "{a} + {b}",
+    "{a} * {b} + 5",
+    "2 * {a} - 8 / {b} + {a} * 3",
+]
+
+# The evaluate path from before expressions were compiled, kept as the baseline.
+OPERATORS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b,
+}
+PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2}
+
+def baseline_evaluate(expression):
+    values = []
+    operators = []
+
+    def apply():
+        operator = operators.pop()
+        b = values.pop()
+        a = values.pop()
+        values.append(OPERATORS[operator](a, b))
+
+    for token in expression.strip().split():
+        if token in OPERATORS:
+            while operators and PRECEDENCE[operators[-1]] >= PRECEDENCE[token]:
+                apply()
+            operators.append(token)
+        else:
+            values.append(float(token))
+    while operators:
+        apply()
+    return values[0]
+
+# Return the seconds taken by fn().
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculator evaluation benchmark")
+    parser.add_argument("--count", type=int, default=100000, help="evaluations per template")
+    args = parser.parse_args()
+
+    random.seed(0)
+    a_values = [float(random.randint(1, 1000)) for _ in range(args.count)]
+    b_values = [float(random.randint(1, 1000)) for _ in range(args.count)]
+    calculator = Calculator()
+
+    print(f"{'template':<30}{'path':<26}{'ns/eval':>10}{'speedup':>9}")
+    for template in TEMPLATES:
+        # the original path has to format every expression as text and parse it again
+        texts = [template.format(a=a, b=b) for a, b in zip(a_values, b_values)]
+        variable_form = template.format(a="a", b="b")
+        paths = [
+            ("original evaluate", lambda: [baseline_evaluate(text) for text in texts]),
+            ("evaluate, repeated text", lambda: [calculator.evaluate(texts[0]) for _ in texts]),
+            ("compiled + variables", lambda: [calculator.evaluate(variable_form, {"a": a, "b": b}) for a, b in zip(a_values, b_values)]),
+            ("evaluate_many (Python)", lambda: calculator.evaluate_many(variable_form, {"a": a_values, "b": b_values}, use_numpy=False)),
+        ]
+        if calculator_module.np is not None:
+            paths.append(("evaluate_many (NumPy)", lambda: calculator.evaluate_many(variable_form, {"a": a_values, "b": b_values})))
+
+        baseline = None
+        for name, fn in paths:
+            per_eval = timed(fn) / args.count * 1e9
+            baseline = baseline or per_eval
+            print(f"{template:<30}{name:<26}{per_eval:>10.0f}{baseline / per_eval:>8.1f}x")
+    if calculator_module.np is None:
+        print("NumPy is not installed; the vectorized path was skipped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Scaling benchmark for the calculator parser: time and peak memory of evaluating one
+# expression of 10 to 10^7 tokens.
+# The streaming paths ("stream" and "nested") read the expression in chunks from a generator,
+# so the text is never in memory as a whole; the original split-based evaluator
+# (see bench_calculator.py) needs the full text and its token list, and is only run up to
+# --baseline-max tokens.
+#
+# Usage: python benchmarks/bench_calculator_scaling.py [--max-tokens N] [--baseline-max N]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "calculator"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import time
+import tracemalloc
+from pkg.calculator import Calculator
+from bench_calculator import baseline_evaluate
+
+# Repeating units of the generated expressions. The plain unit is in the whitespace-separated
+# form the original evaluator understands, so both paths can run on the same input; the nested
+# unit uses parentheses and unary minus and no whitespace, which only the new parser supports.
+PLAIN_UNIT = "3 * 2 + 8 / 4 - "
+PLAIN_UNIT_TOKENS = 8
+NESTED_UNIT = "(3*-2+8)/4-"
+NESTED_UNIT_TOKENS = 10
+
+# Yield an expression of about `tokens` tokens in chunks of about 64 KB.
+def expression_chunks(unit, unit_tokens, tokens):
+    per_chunk = max(1, 65536 // len(unit))
+    units = max(1, tokens // unit_tokens)
+    while units > 0:
+        count = min(per_chunk, units)
+        yield unit * count
+        units -= count
+    yield "0"
+
+# Run fn and return (seconds, peak traced memory in KiB). Memory is measured in a second run,
+# since tracing slows everything down.
+def measure(fn, with_memory):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    if not with_memory:
+        return seconds, None
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculator parser scaling benchmark")
+    parser.add_argument("--max-tokens", type=int, default=10 ** 7, help="largest expression, in tokens")
+    parser.add_argument("--baseline-max", type=int, default=10 ** 6, help="largest expression run through the original evaluator")
+    parser.add_argument("--memory-max", type=int, default=10 ** 6, help="largest expression whose peak memory is traced")
+    args = parser.parse_args()
+
+    calculator = Calculator()
+    print(f"{'tokens':>10}  {'path':<10}{'total ms':>11}{'ns/token':>10}{'peak KiB':>11}")
+    tokens = 10
+    while tokens <= args.max_tokens:
+        with_memory = tokens <= args.memory_max
+        paths = [
+            ("stream", lambda: calculator.evaluate_stream(expression_chunks(PLAIN_UNIT, PLAIN_UNIT_TOKENS, tokens))),
+            ("nested", lambda: calculator.evaluate_stream(expression_chunks(NESTED_UNIT, NESTED_UNIT_TOKENS, tokens))),
+        ]
+        if tokens <= args.baseline_max:
+            paths.append(("original", lambda: baseline_evaluate("".join(expression_chunks(PLAIN_UNIT, PLAIN_UNIT_TOKENS, tokens)))))
+        for name, fn in paths:
+            seconds, peak = measure(fn, with_memory)
+            peak_text = f"{peak:>11.0f}" if peak is not None else f"{'-':>11}"
+            print(f"{tokens:>10}  {name:<10}{seconds * 1000:>11.1f}{seconds / tokens * 1e9:>10.0f}{peak_text}")
+        tokens *= 10
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Benchmark for the agent daemon: per-prompt overhead of a cold `python main.py "<prompt>"`
+# against prompts sent to a running daemon (python main.py --serve), through the thin client
+# process and directly over the socket, and N sessions prompting the daemon at the same time.
+# Every run replays a recorded one-turn answer (see backends.ReplayBackend), so no network
+# access or API key is needed and the numbers are pure startup and dispatch overhead.
+#
+# Usage: python benchmarks/bench_daemon.py [--count N] [--sessions N] [--latency SECONDS]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import json
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import client
+
+# Write a replay log that answers `count` requests with a short text response each.
+def write_replay_log(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(count):
+            record = {
+                "request_hash": f"bench-daemon:{index}",
+                "model": "scripted",
+                "request": [],
+                "chunks": [{"candidates": [{"content": {"role": "model", "parts": [{"text": f"answer {index}"}]}}]}],
+            }
+            f.write(json.dumps(record) + "\n")
+
+# Return the median milliseconds of fn() over count runs.
+def median_ms(fn, count):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+# Wait until the daemon answers a ping.
+def wait_for_daemon(socket_path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return client.request({"op": "ping"}, socket_path=socket_path, timeout=1)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent daemon benchmark")
+    parser.add_argument("--count", type=int, default=10, help="prompts per path (median is reported)")
+    parser.add_argument("--sessions", type=int, default=8, help="sessions prompting the daemon at the same time")
+    parser.add_argument("--latency", type=float, default=0.1, help="simulated seconds per model response in the concurrent run")
+    args = parser.parse_args()
+
+    python = sys.executable
+    with tempfile.TemporaryDirectory() as tmp:
+        cold_log = os.path.join(tmp, "cold.jsonl")
+        write_replay_log(cold_log, 1)
+        cold_ms = median_ms(lambda: subprocess.run(
+            [python, "main.py", "--replay", cold_log, "hello"], cwd=ROOT, check=True, capture_output=True), args.count)
+
+        socket_path = os.path.join(tmp, "daemon.sock")
+        daemon_log = os.path.join(tmp, "daemon.jsonl")
+        write_replay_log(daemon_log, args.count * 2 + args.sessions * 2)
+        daemon = subprocess.Popen(
+            [python, "main.py", "--serve", "--socket", socket_path, "--replay", daemon_log, "--replay-latency", "0"],
+            cwd=ROOT, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_daemon(socket_path)
+            client_ms = median_ms(lambda: subprocess.run(
+                [python, "client.py", "--socket", socket_path, "hello"], cwd=ROOT, check=True, capture_output=True), args.count)
+            socket_ms = median_ms(lambda: client.request({"op": "prompt", "prompt": "hello"}, socket_path=socket_path), args.count)
+        finally:
+            client.request({"op": "shutdown"}, socket_path=socket_path)
+            daemon.wait()
+
+        # N sessions at the same time against a daemon whose model responses take `latency` seconds
+        slow_log = os.path.join(tmp, "slow.jsonl")
+        write_replay_log(slow_log, args.sessions)
+        daemon = subprocess.Popen(
+            [python, "main.py", "--serve", "--socket", socket_path, "--replay", slow_log, "--replay-latency", str(args.latency)],
+            cwd=ROOT, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_daemon(socket_path)
+            threads = [
+                threading.Thread(target=client.request, args=({"op": "prompt", "prompt": "hello", "session": f"s{index}"},), kwargs={"socket_path": socket_path})
+                for index in range(args.sessions)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            concurrent_ms = (time.perf_counter() - start) * 1000
+        finally:
+            client.request({"op": "shutdown"}, socket_path=socket_path)
+            daemon.wait()
+
+    print(f"{'path':<40}{'ms/prompt':>10}")
+    print(f"{'cold python main.py':<40}{cold_ms:>10.1f}")
+    print(f"{'python client.py -> daemon':<40}{client_ms:>10.1f}")
+    print(f"{'socket request -> daemon':<40}{socket_ms:>10.1f}")
+    print(f"{args.sessions} sessions at once, {args.latency * 1000:.0f} ms model latency: {concurrent_ms:.0f} ms wall "
+          f"(sequential would be at least {args.sessions * args.latency * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
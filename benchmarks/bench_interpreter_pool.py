@@ -0,0 +1,62 @@
+# Benchmark for run_python_file: cold subprocess vs warm interpreter pool.
+# Runs calculator/main.py and calculator/tests.py repeatedly both ways and prints the
+# median and p95 latency of each.
+#
+# Usage: python benchmarks/bench_interpreter_pool.py [--runs N]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import statistics
+import subprocess
+import time
+import config
+from functions import interpreter_pool
+from functions.output_capture import OutputCapture
+from tracing import percentile
+
+WORKSPACE = os.path.join(ROOT, "calculator")
+SCRIPTS = [("main.py", ["3 + 5"]), ("tests.py", [])]
+
+def run_cold(script, args):
+    subprocess.run([sys.executable, os.path.join(WORKSPACE, script), *args], capture_output=True, text=True, cwd=WORKSPACE, timeout=config.RUN_PYTHON_TIMEOUT)
+
+def run_warm(script, args):
+    interpreter_pool.run_script(os.path.join(WORKSPACE, script), args, WORKSPACE, config.RUN_PYTHON_TIMEOUT, OutputCapture())
+
+# Time `runs` calls of fn and return the sorted durations in milliseconds.
+# Calls are spaced out slightly so the pool has time to replace the worker it just used,
+# as it would between tool calls in a real session.
+def measure(fn, script, args, runs, pause):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(script, args)
+        durations.append((time.perf_counter() - start) * 1000)
+        time.sleep(pause)
+    return sorted(durations)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold vs warm run_python_file benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="runs per script and mode")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds between runs")
+    args = parser.parse_args()
+
+    if not interpreter_pool.available():
+        print("The interpreter pool needs os.fork and socket.send_fds, which this platform lacks.")
+        sys.exit(1)
+
+    # start the pool before timing, like an agent session that has already run a script
+    run_warm(*SCRIPTS[0])
+    time.sleep(0.5)
+
+    print(f"{'script':<12}{'mode':<7}{'median ms':>11}{'p95 ms':>9}")
+    for script, script_args in SCRIPTS:
+        for mode, fn in (("cold", run_cold), ("warm", run_warm)):
+            durations = measure(fn, script, script_args, max(1, args.runs), args.pause)
+            print(f"{script:<12}{mode:<7}{statistics.median(durations):>11.1f}{percentile(durations, 95):>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Benchmark for speculative prefetching (prefetch.py).
+# Replays scripted navigation sessions against a fresh copy of the calculator/ workspace, with
+# --latency seconds of simulated model think time per response: listing directories and then
+# reading the files in them, and editing a file and then running the tests. Compares the time
+# spent waiting on tools (the critical path the model waits for) with prefetching off and on,
+# and prints how many of the prefetched results the sessions used.
+#
+# Usage: python benchmarks/bench_prefetch.py [--latency SECONDS] [--repeat N]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import statistics
+import tempfile
+import config
+from bench_agent import run_session
+from prefetch import PREFETCHER
+
+def _calls(*calls):
+    return {"function_calls": [{"name": name, "args": args} for name, args in calls]}
+
+SESSIONS = [
+    {
+        "name": "navigate",
+        "prompt": "How does the calculator evaluate an expression?",
+        "turns": [
+            _calls(("get_files_info", {})),
+            _calls(("get_file_content", {"file_path": "main.py"})),
+            _calls(("get_files_info", {"directory": "pkg"})),
+            _calls(("get_file_content", {"file_path": "pkg/calculator.py"})),
+            _calls(("get_file_content", {"file_path": "pkg/parser.py"}), ("get_file_content", {"file_path": "pkg/render.py"})),
+            {"text": "main.py hands the expression to Calculator.evaluate in pkg/calculator.py."},
+        ],
+    },
+    {
+        "name": "edit_and_test",
+        "prompt": "Add a note to lorem.txt and check the tests still pass.",
+        "turns": [
+            _calls(("get_file_content", {"file_path": "lorem.txt"})),
+            _calls(("write_file", {"file_path": "lorem.txt", "content": "lorem ipsum dolor sit amet\n"})),
+            _calls(("run_tests", {})),
+            {"text": "The note is added and the tests pass."},
+        ],
+    },
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative prefetching benchmark")
+    parser.add_argument("--latency", type=float, default=1.0, help="simulated seconds of model think time per response")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per session and setting (median is reported)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # keep the test results of the throwaway workspaces out of the real cache
+        config.TEST_RESULTS_DIR = os.path.join(tmp, "test-results")
+        print(f"model think time {args.latency:.2f}s per response, median of {args.repeat} runs\n")
+        print(f"{'session':<16}{'ok':>4}{'tools ms (off)':>16}{'tools ms (on)':>15}{'wall ms (off)':>15}{'wall ms (on)':>14}")
+        for session in SESSIONS:
+            medians = {}
+            ok = True
+            for prefetch in (False, True):
+                config.PREFETCH = prefetch
+                runs = [run_session(session, args.latency) for _ in range(max(1, args.repeat))]
+                ok = ok and all(run["ok"] for run in runs)
+                medians[prefetch] = (statistics.median(run["tool_seconds"] for run in runs), statistics.median(run["wall_seconds"] for run in runs))
+            print(
+                f"{session['name']:<16}{'yes' if ok else 'NO':>4}{medians[False][0] * 1000:>16.1f}{medians[True][0] * 1000:>15.1f}"
+                f"{medians[False][1] * 1000:>15.1f}{medians[True][1] * 1000:>14.1f}"
+            )
+    print(f"\n{PREFETCHER.summary()}")
+
+if __name__ == "__main__":
+    main()
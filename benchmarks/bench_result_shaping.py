@@ -0,0 +1,72 @@
+# Benchmark for tool result shaping (result_shaping.py).
+# Plays a long read-heavy session against this repository: every turn the "model" asks for a
+# few source files and one of a recursive listing, a broad search or a test run, and the results go
+# into a ConversationHistory the way run_agent adds them. Compares shaping every result to its
+# budget against the old fixed cut (config.MAX_CHARS = 10000 characters for file reads only).
+# Reports the tokens the tool results took, the largest request, and how many tokens of
+# earlier tool output history compaction had to throw away to stay within the budget.
+#
+# Usage: python benchmarks/bench_result_shaping.py [--turns N] [--calls N] [--history-budget TOKENS]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import glob
+from google.genai import types
+import config
+from function_call import ToolContext, call_functions
+from history import ConversationHistory, content_chars
+from tool_cache import TOOL_CACHE
+
+# The function calls of every turn: a rotating window of source files plus one call of one of
+# the other tools in turn. The test run goes through run_tests on the calculator workspace.
+def session_calls(turns, calls):
+    sources = sorted(os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, "**", "*.py"), recursive=True))
+    others = [
+        ("get_files_info", {"recursive": True, "limit": 500}),
+        ("search_files", {"query": "def ", "max_results": 200}),
+        ("run_tests", {"test_files": ["calculator/tests.py"]}),
+    ]
+    for turn in range(turns):
+        reads = [("get_file_content", {"file_path": sources[(turn * calls + index) % len(sources)]}) for index in range(calls)]
+        yield reads + [others[turn % len(others)]]
+
+# Play the session and return (result tokens, largest estimated request, tokens compacted away).
+def run_session(turns, calls, history_budget):
+    # cached file reads were cut at the other scenario's MAX_CHARS
+    TOOL_CACHE.invalidate_workspace(ROOT)
+    history = ConversationHistory("Explain how this repository is put together.", token_budget=history_budget)
+    context = ToolContext(working_directory=ROOT, quiet=True, session_id="bench")
+    result_tokens = 0
+    largest = 0
+    for turn, function_calls in enumerate(session_calls(turns, calls), start=1):
+        history.compact_if_needed(turn)
+        context.start_turn(turn, history.estimated_prompt_tokens(), history.token_budget)
+        largest = max(largest, history.estimated_prompt_tokens())
+        parts = [types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in function_calls]
+        history.add(types.Content(role="model", parts=parts), turn)
+        results = call_functions([part.function_call for part in parts], context=context)
+        result_tokens += content_chars(results) // config.CHARS_PER_TOKEN
+        history.add(results, turn)
+    return result_tokens, max(largest, history.estimated_prompt_tokens()), history.tokens_saved
+
+def main():
+    parser = argparse.ArgumentParser(description="Tool result shaping benchmark")
+    parser.add_argument("--turns", type=int, default=12, help="generation iterations in the session")
+    parser.add_argument("--calls", type=int, default=3, help="source files read per turn")
+    parser.add_argument("--history-budget", type=int, default=config.HISTORY_TOKEN_BUDGET, help="history token budget of the session")
+    args = parser.parse_args()
+
+    print(f"{args.turns} turns x ({args.calls} file reads + 1 listing/search/test run), history budget {args.history_budget} tokens\n")
+    print(f"{'results':<26}{'result tokens':>15}{'largest request':>17}{'compacted away':>16}")
+    # the old behaviour: file reads cut at 10000 characters, everything else sent whole
+    for name, shape, max_chars in (("fixed 10000-char cut", False, 10000), ("shaped to budget", True, config.MAX_CHARS)):
+        config.SHAPE_TOOL_RESULTS = shape
+        config.MAX_CHARS = max_chars
+        result_tokens, largest, compacted = run_session(args.turns, args.calls, args.history_budget)
+        print(f"{name:<26}{result_tokens:>15}{largest:>17}{compacted:>16}")
+
+if __name__ == "__main__":
+    main()
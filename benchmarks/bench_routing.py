@@ -0,0 +1,92 @@
+# Benchmark for adaptive model routing (router.py).
+# Replays the scripted sessions in benchmarks/sessions.json (see bench_agent.py) with a
+# simulated latency per model, and compares sending every iteration to the strong model
+# against the default routes, with and without re-asking the strong model for the final answer.
+# Reports sessions that gave the scripted answer, the median session time, requests per model
+# and the cost estimated from config.MODEL_PRICES and the scripted token counts.
+# Answer quality can't be measured offline: a replay answers the same whichever model is asked.
+#
+# Usage: python benchmarks/bench_routing.py [--strong-latency SECONDS] [--cheap-latency SECONDS]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import asyncio
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import config
+from agent import run_agent
+from backends import ReplayBackend
+from bench_agent import SESSIONS_PATH, WORKSPACE, _write_replay_log
+from router import ModelRouter
+
+# Waits a per-model latency before every response of another backend.
+class ModelLatencyBackend:
+    def __init__(self, inner, latencies):
+        self.inner = inner
+        self.latencies = latencies
+
+    async def generate(self, model, contents, config):
+        await asyncio.sleep(self.latencies[model])
+        return await self.inner.generate(model, contents, config)
+
+    async def generate_stream(self, model, contents, config):
+        await asyncio.sleep(self.latencies[model])
+        async for chunk in self.inner.generate_stream(model, contents, config):
+            yield chunk
+
+# Run one scripted session with a router and return whether it gave the scripted answer and
+# how long it took. A final answer review asks for the final answer twice, so the replay log
+# holds it twice.
+def run_session(session, router, latencies):
+    if router.final_answer_model:
+        session = dict(session, turns=session["turns"] + session["turns"][-1:])
+    with tempfile.TemporaryDirectory() as tmp:
+        workspace = os.path.join(tmp, "calculator")
+        shutil.copytree(WORKSPACE, workspace, ignore=shutil.ignore_patterns("__pycache__"))
+        log_path = os.path.join(tmp, "replay.jsonl")
+        _write_replay_log(session, log_path)
+        backend = ModelLatencyBackend(ReplayBackend(log_path), latencies)
+
+        start = time.perf_counter()
+        result = asyncio.run(run_agent(backend, session["prompt"], quiet=True, working_directory=workspace, router=router))
+        seconds = time.perf_counter() - start
+    ok = result["error"] is None and result["text"] == session["turns"][-1].get("text")
+    return ok, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Model routing benchmark")
+    parser.add_argument("--strong-latency", type=float, default=0.08, help=f"simulated seconds per {config.MODEL} response")
+    parser.add_argument("--cheap-latency", type=float, default=0.03, help=f"simulated seconds per {config.MODEL_ROUTES['tool_step']} response")
+    args = parser.parse_args()
+
+    with open(SESSIONS_PATH, "r", encoding="utf-8") as f:
+        sessions = json.load(f)
+    strong, cheap = config.MODEL, config.MODEL_ROUTES["tool_step"]
+    latencies = {strong: args.strong_latency, cheap: args.cheap_latency}
+
+    scenarios = [
+        ("strong only", ModelRouter(routes={"plan": strong, "tool_step": strong, "escalated": strong})),
+        ("routed", ModelRouter()),
+        ("routed + final review", ModelRouter(final_answer_model=strong)),
+    ]
+    print(f"{len(sessions)} scripted sessions, {strong} {args.strong_latency * 1000:.0f} ms, {cheap} {args.cheap_latency * 1000:.0f} ms per response\n")
+    print(f"{'routing':<24}{'ok':>5}{'median ms':>11}{'strong req':>12}{'cheap req':>11}{'cost $':>10}{'vs strong':>11}")
+    baseline_cost = None
+    for name, router in scenarios:
+        runs = [run_session(session, router, latencies) for session in sessions]
+        cost = sum(router.cost(model) for model in router.stats)
+        baseline_cost = cost if baseline_cost is None else baseline_cost
+        requests = lambda model: router.stats.get(model, {}).get("requests", 0)
+        print(
+            f"{name:<24}{sum(ok for ok, _ in runs):>2}/{len(runs):<2}{statistics.median(seconds for _, seconds in runs) * 1000:>11.0f}"
+            f"{requests(strong):>12}{requests(cheap):>11}{cost:>10.5f}{cost / baseline_cost if baseline_cost else 0:>10.0%}"
+        )
+
+if __name__ == "__main__":
+    main()
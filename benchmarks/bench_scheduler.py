@@ -0,0 +1,104 @@
+# Benchmark for the request scheduler (scheduler.py) under quota pressure.
+# Many sessions send requests as fast as they can to a simulated model API that allows
+# --quota requests per second (a token bucket holding one second's worth) and fails a share of
+# the other requests with a 503. Half of the sessions are batch sessions.
+# Compares sending requests directly, where the first error ends a session as it used to,
+# against ScheduledBackend with its retries alone and with its rate limit set to the quota.
+# Time is scaled down: a quota of N per second stands for N per minute.
+#
+# Usage: python benchmarks/bench_scheduler.py [--sessions N] [--requests N] [--quota N] [--error-rate F]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from google.genai import errors, types
+import config
+from scheduler import BATCH, INTERACTIVE, REQUEST_PRIORITY, RequestScheduler, ScheduledBackend, TokenBucket
+
+# A model API with a request quota and random transient errors.
+class QuotaBackend:
+    def __init__(self, per_second, error_rate, latency):
+        self.bucket = TokenBucket(per_second * 60, burst_seconds=1)
+        self.error_rate = error_rate
+        self.latency = latency
+        self.served = 0
+        self.rejected = 0
+
+    async def generate(self, model, contents, config):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        if self.bucket.wait_time(1, now) > 0:
+            self.rejected += 1
+            raise errors.ClientError(429, {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}})
+        self.bucket.take(1, now)
+        if random.random() < self.error_rate:
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "The model is overloaded", "status": "UNAVAILABLE"}})
+        self.served += 1
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="ok")]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=100, candidates_token_count=10),
+        )
+
+# Run every session at once. Returns the seconds the whole run took, the number of sessions
+# that finished, and the seconds each finished interactive and batch session took.
+async def run_scenario(backend, sessions, requests):
+    durations = {INTERACTIVE: [], BATCH: []}
+    contents = [types.Content(role="user", parts=[types.Part(text="hello")])]
+    start = time.monotonic()
+
+    async def session(index):
+        priority = BATCH if index % 2 else INTERACTIVE
+        REQUEST_PRIORITY.set(priority)
+        for _ in range(requests):
+            try:
+                await backend.generate("scripted", contents, None)
+            except errors.APIError:
+                return False
+        durations[priority].append(time.monotonic() - start)
+        return True
+
+    finished = await asyncio.gather(*(session(index) for index in range(sessions)))
+    return time.monotonic() - start, sum(finished), durations
+
+def main():
+    parser = argparse.ArgumentParser(description="Request scheduler benchmark")
+    parser.add_argument("--sessions", type=int, default=20, help="sessions sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=10, help="requests per session")
+    parser.add_argument("--quota", type=float, default=40, help="requests per second the simulated API allows")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="share of requests that fail with a 503")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per simulated response")
+    args = parser.parse_args()
+
+    # scaled down backoff to match the scaled down quota
+    config.MODEL_RETRY_BASE_SECONDS = 0.05
+    config.MODEL_RETRY_MAX_SECONDS = 1.0
+    config.MODEL_MAX_RETRIES = 20
+    random.seed(0)
+
+    print(f"{args.sessions} sessions x {args.requests} requests, quota {args.quota:.0f}/s, {args.error_rate:.0%} 503s\n")
+    print(f"{'path':<22}{'done':>6}{'lost':>6}{'served':>8}{'seconds':>9}{'served/s':>10}{'429s':>7}{'retries':>9}{'queued':>8}{'interactive':>13}{'batch':>8}")
+    scenarios = [
+        ("direct", None),
+        ("retries only", RequestScheduler(requests_per_minute=0, tokens_per_minute=0)),
+        ("rate limit + retries", RequestScheduler(requests_per_minute=args.quota * 60, tokens_per_minute=0, burst_seconds=1)),
+    ]
+    for name, scheduler in scenarios:
+        api = QuotaBackend(args.quota, args.error_rate, args.latency)
+        backend = api if scheduler is None else ScheduledBackend(api, scheduler, max_retries=config.MODEL_MAX_RETRIES)
+        seconds, finished, durations = asyncio.run(run_scenario(backend, args.sessions, args.requests))
+        stats = scheduler.stats if scheduler else {"retries": 0, "queued": 0}
+        mean = lambda values: f"{statistics.mean(values):.2f} s" if values else "-"
+        print(
+            f"{name:<22}{finished:>6}{args.sessions - finished:>6}{api.served:>8}{seconds:>9.2f}{api.served / seconds:>10.1f}"
+            f"{api.rejected:>7}{stats['retries']:>9}{stats['queued']:>8}{mean(durations[INTERACTIVE]):>13}{mean(durations[BATCH]):>8}"
+        )
+    print("\ninteractive / batch: mean time until a finished session of that kind was done")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Startup latency benchmark for the CLI.
+# Times cold starts of the commands that should exit right away (no prompt, --help, the daemon
+# client) and of loading everything a prompt needs, each in a fresh interpreter, and checks
+# them against a budget. Budgets are in milliseconds on top of a bare `python -c pass`, so they
+# don't depend on how slow the interpreter itself starts on a given machine.
+# Also prints the slowest imports of a full load (see startup_profile.py).
+#
+# Usage: python benchmarks/bench_startup.py [--repeat N] [--quick-budget MS] [--runtime-budget MS]
+# Exits with code 1 if a command goes over its budget.
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import statistics
+import subprocess
+import time
+from startup_profile import format_report, profile_imports
+
+# (name, arguments to python, whether the command must stay within the quick budget)
+COMMANDS = [
+    ("python main.py (no prompt)", ["main.py"], True),
+    ("python main.py --help", ["main.py", "--help"], True),
+    ("python client.py --help", ["client.py", "--help"], True),
+    ("load_runtime (genai, agent, tools)", ["-c", "import main; main.load_runtime()"], False),
+]
+
+# Return the median wall milliseconds of running python with these arguments.
+def median_ms(args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI startup latency benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command (median is reported)")
+    parser.add_argument("--quick-budget", type=float, default=100, help="max ms over a bare interpreter for commands that exit right away")
+    parser.add_argument("--runtime-budget", type=float, default=1500, help="max ms over a bare interpreter to load everything a prompt needs")
+    args = parser.parse_args()
+
+    repeat = max(1, args.repeat)
+    floor_ms = median_ms(["-c", "pass"], repeat)
+    print(f"{'command':<38}{'ms':>9}{'over bare':>11}{'budget':>9}")
+    print(f"{'python -c pass':<38}{floor_ms:>9.1f}")
+
+    over_budget = []
+    for name, command, quick in COMMANDS:
+        ms = median_ms(command, repeat)
+        budget = args.quick_budget if quick else args.runtime_budget
+        print(f"{name:<38}{ms:>9.1f}{ms - floor_ms:>11.1f}{budget:>9.0f}")
+        if ms - floor_ms > budget:
+            over_budget.append(f"{name}: {ms - floor_ms:.0f} ms over a bare interpreter, budget {budget:.0f} ms")
+
+    print()
+    entries, wall_seconds = profile_imports("import main; main.load_runtime()", cwd=ROOT)
+    print(format_report(entries, wall_seconds, top=10))
+
+    if over_budget:
+        print("\nOver budget:")
+        for line in over_budget:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
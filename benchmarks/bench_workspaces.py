@@ -0,0 +1,100 @@
+# Benchmark for per-session workspaces (workspaces.py).
+# Builds a synthetic source tree, then times giving each of --sessions sessions its own copy of it
+# with a full copy (shutil.copytree) against a workspace snapshot, and the disk space both use.
+# Each session then rewrites a few files through write_file, and the benchmark times finding
+# and diffing the changes, checks the base is untouched, and merges one session back.
+#
+# Usage: python benchmarks/bench_workspaces.py [--files N] [--file-kib N] [--sessions N] [--writes N]
+
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import argparse
+import shutil
+import tempfile
+import time
+import config
+import workspaces
+from functions.write_file import write_file
+
+# Write `files` files of about file_kib KiB each, 50 to a directory.
+def build_tree(root, files, file_kib):
+    line = "value = 'x' * 64  # synthetic source line\n"
+    body = line * max(1, file_kib * 1024 // len(line))
+    for index in range(files):
+        directory = os.path.join(root, f"pkg{index // 50:03d}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"module{index:05d}.py"), "w", encoding="utf-8") as f:
+            f.write(f"# module {index}\n{body}")
+
+# Bytes of disk used by the files under the given roots, counting a hard linked file once.
+def disk_bytes(*roots):
+    seen = set()
+    total = 0
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                stat = os.lstat(os.path.join(dirpath, name))
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_blocks * 512
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-session workspace benchmark")
+    parser.add_argument("--files", type=int, default=5000, help="files in the synthetic base tree")
+    parser.add_argument("--file-kib", type=int, default=8, help="size of each file in KiB")
+    parser.add_argument("--sessions", type=int, default=24, help="sessions that each get their own copy")
+    parser.add_argument("--writes", type=int, default=3, help="files each session rewrites")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base")
+        build_tree(base, args.files, args.file_kib)
+        base_bytes = disk_bytes(base)
+        print(f"base: {args.files} files, {base_bytes / 2**20:.1f} MiB; {args.sessions} sessions\n")
+
+        start = time.perf_counter()
+        copies = [shutil.copytree(base, os.path.join(tmp, "copies", str(index))) for index in range(args.sessions)]
+        copy_seconds = time.perf_counter() - start
+        copy_bytes = disk_bytes(*copies)
+        shutil.rmtree(os.path.join(tmp, "copies"))
+
+        config.WORKSPACES_DIR = os.path.join(tmp, "workspaces")
+        start = time.perf_counter()
+        sessions = [workspaces.create_workspace(f"s{index}", base) for index in range(args.sessions)]
+        snapshot_seconds = time.perf_counter() - start
+        snapshot_bytes = disk_bytes(config.WORKSPACES_DIR) - base_bytes if sessions[0].mode == "hardlink" else disk_bytes(config.WORKSPACES_DIR)
+
+        print(f"{'per session':<24}{'ms':>10}{'disk KiB':>12}")
+        print(f"{'full copy':<24}{copy_seconds / args.sessions * 1000:>10.1f}{copy_bytes / args.sessions / 1024:>12.0f}")
+        print(f"{'snapshot (' + sessions[0].mode + ')':<24}{snapshot_seconds / args.sessions * 1000:>10.1f}{snapshot_bytes / args.sessions / 1024:>12.0f}")
+
+        # every session rewrites the same files, which would clobber each other in a shared directory
+        targets = [os.path.join(f"pkg{index // 50:03d}", f"module{index:05d}.py") for index in range(args.writes)]
+        for session in sessions:
+            for target in targets:
+                write_file(session.path, target, f"# rewritten by {session.session_id}\n")
+        with open(os.path.join(base, targets[0]), "r", encoding="utf-8") as f:
+            base_untouched = not f.read().startswith("# rewritten")
+
+        start = time.perf_counter()
+        changed = [len(session.changes()) for session in sessions]
+        changes_ms = (time.perf_counter() - start) / args.sessions * 1000
+        start = time.perf_counter()
+        diff = sessions[0].diff()
+        diff_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        merged, conflicts = sessions[0].merge()
+        merge_ms = (time.perf_counter() - start) * 1000
+        _, later_conflicts = sessions[1].merge()
+
+        print(f"\nchanges(): {changes_ms:.1f} ms per session, {min(changed)}-{max(changed)} changed files each")
+        print(f"diff(): {diff_ms:.1f} ms, {len(diff.splitlines())} lines")
+        print(f"merge(): {merge_ms:.1f} ms, {len(merged)} merged, {len(conflicts)} conflicts; "
+              f"the next session's merge then has {len(later_conflicts)} conflicts")
+        print(f"base untouched by session writes: {'yes' if base_untouched else 'NO'}")
+
+if __name__ == "__main__":
+    main()
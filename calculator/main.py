@@ -1,8 +1,10 @@
 # main.py
 
 import sys
+import argparse
 from pkg.calculator import Calculator
 from pkg.render import render
+from pkg.batch import FORMATS, run_batch
 
 
 def main():
@@ -11,6 +13,11 @@ def main():
         print("Calculator App")
         print('Usage: python main.py "<expression>"')
         print('Example: python main.py "3 + 5"')
+        print("Batch:  python main.py --batch [FILE] [--format plain|csv|jsonl|box] [--workers N]")
+        return
+
+    if sys.argv[1] == "--batch":
+        batch_main(sys.argv[2:])
         return
 
     expression = " ".join(sys.argv[1:])
@@ -22,5 +29,28 @@ def main():
         print(f"Error: {e}")
 
 
+# Evaluate one expression per line from a file or stdin, writing one result per line.
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="main.py --batch", description="Evaluate one expression per line")
+    parser.add_argument("input", nargs="?", default="-", help="file with one expression per line (default: stdin)")
+    parser.add_argument("--format", choices=FORMATS, default="plain", help="output format")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU core)")
+    parser.add_argument("--output", default="-", help="file to write the results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    input_stream = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    output_stream = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        run_batch(input_stream, output_stream, args.format, args.workers)
+    except BrokenPipeError:
+        # the reader went away (e.g. piped into head); stop quietly
+        sys.stderr.close()
+    finally:
+        if input_stream is not sys.stdin.buffer:
+            input_stream.close()
+        if output_stream is not sys.stdout.buffer:
+            output_stream.close()
+
+
 if __name__ == "__main__":
     main()
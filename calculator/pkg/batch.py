@@ -0,0 +1,108 @@
+# batch.py
+
+import csv
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pkg.calculator import Calculator
+from pkg.render import render
+
+FORMATS = ["plain", "csv", "jsonl", "box"]
+
+# input is read and handed to the workers in blocks of about this many bytes (cut at a newline)
+BLOCK_SIZE = 1024 * 1024
+
+# calculator used by every block evaluated in this process, so compiled expressions are reused
+_calculator = None
+
+
+# Format a result like render does: whole numbers without a trailing ".0".
+def format_number(result):
+    if isinstance(result, float) and result.is_integer():
+        return str(int(result))
+    return str(result)
+
+
+# Read a binary stream in blocks of whole lines.
+def read_blocks(stream, block_size=BLOCK_SIZE):
+    rest = b""
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        data = rest + data
+        cut = data.rfind(b"\n")
+        if cut == -1:
+            rest = data
+            continue
+        yield data[:cut + 1]
+        rest = data[cut + 1:]
+    if rest:
+        yield rest
+
+
+# Evaluate every line of a block and return the formatted output as bytes.
+# Every input line produces exactly one result (or one box), in the same order;
+# a line that fails to evaluate produces its error message instead of a result.
+def process_block(block, output_format):
+    global _calculator
+    if _calculator is None:
+        _calculator = Calculator()
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n") if output_format == "csv" else None
+    for expression in block.decode("utf-8", errors="replace").splitlines():
+        expression = expression.strip()
+        result = error = None
+        try:
+            result = _calculator.evaluate(expression)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        if output_format == "csv":
+            writer.writerow([expression, "" if result is None else format_number(result), error or ""])
+        elif output_format == "jsonl":
+            out.write(json.dumps({"expression": expression, "result": result, "error": error}) + "\n")
+        elif output_format == "box":
+            if error is not None:
+                out.write(f"Error: {error}\n")
+            elif result is not None:
+                out.write(render(expression, result) + "\n")
+            else:
+                out.write("\n")
+        elif error is not None:
+            out.write(f"Error: {error}\n")
+        else:
+            out.write(("" if result is None else format_number(result)) + "\n")
+    return out.getvalue().encode("utf-8")
+
+
+# Evaluate every line of input (a binary stream) and write the results to output (a binary
+# stream) in input order. Blocks are evaluated by a pool of worker processes; at most
+# workers * 2 blocks are in flight at a time, so memory use doesn't grow with the input size.
+# With workers=1 everything is evaluated in this process.
+def run_batch(input_stream, output_stream, output_format="plain", workers=None, block_size=BLOCK_SIZE):
+    if output_format not in FORMATS:
+        raise ValueError(f"unknown format: {output_format}")
+    if output_format == "csv":
+        output_stream.write(b"expression,result,error\n")
+
+    if workers == 1:
+        for block in read_blocks(input_stream, block_size):
+            output_stream.write(process_block(block, output_format))
+        output_stream.flush()
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_in_flight = workers * 2
+        pending = deque()
+        for block in read_blocks(input_stream, block_size):
+            pending.append(executor.submit(process_block, block, output_format))
+            if len(pending) >= max_in_flight:
+                output_stream.write(pending.popleft().result())
+        while pending:
+            output_stream.write(pending.popleft().result())
+    output_stream.flush()
@@ -1,61 +1,180 @@
 # calculator.py
 
-class Calculator:
-    def __init__(self):
-        self.operators = {
-            "+": lambda a, b: a + b,
-            "-": lambda a, b: a - b,
-            "*": lambda a, b: a * b,
-            "/": lambda a, b: a / b,
-        }
-        self.precedence = {
-            "+": 1,
-            "-": 1,
-            "*": 2,
-            "/": 2,
-        }
-
-    def evaluate(self, expression):
-        if not expression or expression.isspace():
-            return None
-        tokens = expression.strip().split()
-        return self._evaluate_infix(tokens)
+from collections import OrderedDict
+from pkg.parser import NEG, OPERATORS, Evaluator, RPNBuilder, chunks_of, parse, tokenize
+
+# NumPy is optional: evaluate_many uses it to evaluate whole columns at once when it's installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# evaluations of a CompiledExpression that walk its RPN before Python code is generated for it;
+# generating code costs much more than one walk, so expressions that are used once never pay for it
+GENERATE_AFTER_CALLS = 2
+
+# expressions longer than this many characters are evaluated as they are parsed instead of being
+# compiled and cached; their compiled form would take several times the memory of the text
+COMPILE_MAX_CHARS = 10000
 
-    def _evaluate_infix(self, tokens):
+
+# An expression compiled once by Calculator.compile, which can be evaluated many times
+# with different variable values.
+# rpn holds the expression in reverse Polish notation: numbers are floats, variable names
+# are strings and operators are 1-tuples (see parser.RPNBuilder).
+class CompiledExpression:
+    def __init__(self, expression, rpn, variables):
+        self.expression = expression
+        self.rpn = rpn
+        self.variables = variables
+        self._function = None
+        self._calls = 0
+
+    def evaluate(self, variables=None):
+        variables = variables or {}
+        function = self._function
+        if function is None:
+            self._calls += 1
+            if self._calls < GENERATE_AFTER_CALLS:
+                return self._walk(variables)
+            function = self.function()
+        try:
+            args = [variables[name] for name in self.variables]
+        except KeyError as e:
+            raise ValueError(f"unbound variable: {e.args[0]}")
+        return function(*args)
+
+    __call__ = evaluate
+
+    # Evaluate the RPN directly with a value stack.
+    def _walk(self, variables):
         values = []
-        operators = []
-
-        for token in tokens:
-            if token in self.operators:
-                while (
-                    operators
-                    and operators[-1] in self.operators
-                    and self.precedence[operators[-1]] >= self.precedence[token]
-                ):
-                    self._apply_operator(operators, values)
-                operators.append(token)
+        for item in self.rpn:
+            if isinstance(item, tuple):
+                if item[0] == NEG:
+                    values[-1] = -values[-1]
+                    continue
+                b = values.pop()
+                a = values.pop()
+                values.append(OPERATORS[item[0]](a, b))
+            elif isinstance(item, float):
+                values.append(item)
             else:
                 try:
-                    values.append(float(token))
-                except ValueError:
-                    raise ValueError(f"invalid token: {token}")
+                    values.append(variables[item])
+                except KeyError:
+                    raise ValueError(f"unbound variable: {item}")
+        return values[0]
 
-        while operators:
-            self._apply_operator(operators, values)
+    # Return a Python function of the expression's variables, generating it on first use, so
+    # evaluating it runs as plain bytecode instead of walking the RPN on every call.
+    # Every operator gets its own assignment (no nested parentheses, so long expressions
+    # compile too). Only floats, validated variable names and the four operators reach the
+    # generated source.
+    def function(self):
+        if self._function is not None:
+            return self._function
+        stack = []
+        lines = []
+        constants = {}
+        for item in self.rpn:
+            if isinstance(item, tuple):
+                name = f"_t{len(lines)}"
+                if item[0] == NEG:
+                    lines.append(f"    {name} = -{stack.pop()}")
+                else:
+                    b = stack.pop()
+                    a = stack.pop()
+                    lines.append(f"    {name} = {a} {item[0]} {b}")
+                stack.append(name)
+            elif isinstance(item, float):
+                name = f"_c{len(constants)}"
+                constants[name] = item
+                stack.append(name)
+            else:
+                stack.append(item)
 
-        if len(values) != 1:
-            raise ValueError("invalid expression")
+        lines.append(f"    return {stack[0]}")
+        source = f"def _compiled({', '.join(self.variables)}):\n" + "\n".join(lines)
+        namespace = {"__builtins__": {}, **constants}
+        exec(source, namespace)
+        self._function = namespace["_compiled"]
+        return self._function
+
+    def __repr__(self):
+        return f"CompiledExpression({self.expression!r})"
 
-        return values[0]
 
-    def _apply_operator(self, operators, values):
-        if not operators:
-            return
+class Calculator:
+    def __init__(self, cache_size=256):
+        # compiled expressions, least recently used first
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
 
-        operator = operators.pop()
-        if len(values) < 2:
-            raise ValueError(f"not enough operands for operator {operator}")
+    def evaluate(self, expression, variables=None):
+        if not expression or expression.isspace():
+            return None
+        if len(expression) > COMPILE_MAX_CHARS:
+            return self.evaluate_stream([expression], variables)
+        return self.compile(expression).evaluate(variables)
+
+    # Evaluate an expression read from a stream (a file-like object or an iterable of text
+    # chunks) as it is parsed, without holding the text or its tokens in memory.
+    # Memory use depends on how deeply parentheses are nested, not on the expression's length.
+    # Returns None for an empty expression.
+    def evaluate_stream(self, source, variables=None):
+        evaluator = Evaluator(variables)
+        if not parse(tokenize(chunks_of(source)), evaluator):
+            return None
+        return evaluator.values[0]
 
-        b = values.pop()
-        a = values.pop()
-        values.append(self.operators[operator](a, b))
+    # Evaluate one expression for many sets of variable values.
+    # variables maps each variable name to a sequence of values, all of the same length.
+    # With NumPy installed the whole batch is evaluated in one vectorized pass and a NumPy
+    # array is returned; otherwise the values are evaluated one by one into a list.
+    def evaluate_many(self, expression, variables=None, use_numpy=None):
+        compiled = self.compile(expression)
+        variables = variables or {}
+        missing = [name for name in compiled.variables if name not in variables]
+        if missing:
+            raise ValueError(f"unbound variable: {missing[0]}")
+        lengths = {len(variables[name]) for name in compiled.variables}
+        if len(lengths) > 1:
+            raise ValueError("all variables must have the same number of values")
+        count = lengths.pop() if lengths else 1
+
+        if use_numpy is None:
+            use_numpy = np is not None
+        if use_numpy:
+            if np is None:
+                raise RuntimeError("NumPy is not installed")
+            columns = {name: np.asarray(variables[name], dtype=float) for name in compiled.variables}
+            # raise on division by zero like the scalar path instead of returning inf
+            with np.errstate(divide="raise", invalid="raise"):
+                try:
+                    result = compiled.function()(*(columns[name] for name in compiled.variables))
+                except FloatingPointError:
+                    raise ZeroDivisionError("float division by zero")
+            return np.broadcast_to(np.asarray(result, dtype=float), (count,)).copy()
+
+        rows = zip(*(variables[name] for name in compiled.variables)) if compiled.variables else [()] * count
+        function = compiled.function()
+        return [function(*row) for row in rows]
+
+    # Compile an expression into a CompiledExpression, reusing a cached one when the same
+    # expression was compiled before.
+    def compile(self, expression):
+        compiled = self._cache.get(expression)
+        if compiled is not None:
+            self._cache.move_to_end(expression)
+            return compiled
+
+        builder = RPNBuilder()
+        if not parse(tokenize([expression]), builder):
+            raise ValueError("invalid expression")
+        compiled = CompiledExpression(expression, builder.rpn, tuple(builder.variables))
+        self._cache[expression] = compiled
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return compiled
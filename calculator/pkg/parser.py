@@ -0,0 +1,209 @@
+# parser.py
+
+import keyword
+import operator
+import re
+
+# Tokenizer and parser for calculator expressions.
+# tokenize reads the expression as a stream of text chunks, so the whole input never has to be
+# in memory, and tokens don't need whitespace between them ("2*(3+-4)" works).
+# parse is a single-pass shunting-yard parser: it hands every value and operator to an output
+# object as soon as it can, so its operator stack only grows with the nesting depth of the
+# expression, never with its length.
+
+# unary minus, which binds tighter than every binary operator
+NEG = "neg"
+
+PRECEDENCE = {
+    "+": 1,
+    "-": 1,
+    "*": 2,
+    "/": 2,
+    NEG: 3,
+}
+
+OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+}
+
+_OPERATOR_TOKENS = {"+", "-", "*", "/", "(", ")"}
+
+# names float() accepts, which are numbers rather than variables
+FLOAT_NAMES = {"inf", "infinity", "nan"}
+
+# number of characters read from a stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# every token: a number, a name, an operator or parenthesis, or any other character (an error)
+_TOKEN = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|[A-Za-z_]\w*|[-+*/()]|\S")
+
+# characters that always end a token; "+" and "-" only do when they don't follow an "e" or "E",
+# where they may be the sign of an exponent
+_BOUNDARIES = " \t\n\r()*/"
+
+
+# Variable names are identifiers that don't start with an underscore and aren't keywords.
+def is_variable(name):
+    return not name.startswith("_") and not keyword.iskeyword(name)
+
+
+# Turn a stream into an iterator of text chunks. source is a file-like object with read(),
+# or an iterable of strings.
+def chunks_of(source):
+    if hasattr(source, "read"):
+        return iter(lambda: source.read(CHUNK_SIZE), "")
+    return iter(source)
+
+
+# Return the index just past the last character of text after which no token can continue,
+# or 0 if there is none.
+def _safe_cut(text):
+    cut = max(text.rfind(char) for char in _BOUNDARIES)
+    for sign in "+-":
+        position = text.rfind(sign)
+        while position > 0 and text[position - 1] in "eE":
+            position = text.rfind(sign, 0, position)
+        cut = max(cut, position)
+    return cut + 1
+
+
+# Yield lists of token strings from an iterable of text chunks, one list per chunk.
+# Each chunk is only tokenized up to its last safe cut (see _safe_cut); the rest is carried
+# over to the next chunk, since a token may continue there (e.g. "1e" + "+5").
+def tokenize(chunks):
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk
+        cut = _safe_cut(text)
+        carry = text[cut:]
+        if cut:
+            yield _TOKEN.findall(text, 0, cut)
+    if carry:
+        yield _TOKEN.findall(carry)
+
+
+_NUMBER_START = set("0123456789.")
+
+
+# Turn a non-operator token into a float, or a variable name (str), rejecting anything else.
+def operand(token):
+    if token[0] in _NUMBER_START:
+        return float(token)
+    if token[0].isalpha() or token[0] == "_":
+        if token.lower() in FLOAT_NAMES:
+            return float(token)
+        if is_variable(token):
+            return token
+    raise ValueError(f"invalid token: {token}")
+
+
+# The error for an operator or ")" that was reached while an operand was expected.
+def _missing_operand(operators):
+    if operators and operators[-1] != "(":
+        symbol = "-" if operators[-1] == NEG else operators[-1]
+        return ValueError(f"not enough operands for operator {symbol}")
+    return ValueError("invalid expression")
+
+
+# Parse token lists from tokenize, calling output.push(token) for every number or variable
+# token and output.apply(operator) for every operator, in reverse Polish order.
+# Returns False if there were no tokens at all, True otherwise.
+def parse(token_lists, output):
+    operators = []
+    expect_operand = True
+    empty = True
+    push = output.push
+    apply = output.apply
+    for tokens in token_lists:
+        for value in tokens:
+            empty = False
+            if value not in _OPERATOR_TOKENS:
+                if not expect_operand:
+                    raise ValueError("invalid expression")
+                push(value)
+                expect_operand = False
+            elif value == "(":
+                if not expect_operand:
+                    raise ValueError("invalid expression")
+                operators.append("(")
+            elif value == ")":
+                if expect_operand:
+                    raise _missing_operand(operators)
+                while operators and operators[-1] != "(":
+                    apply(operators.pop())
+                if not operators:
+                    raise ValueError("unbalanced parentheses")
+                operators.pop()
+            elif expect_operand:
+                if value != "-":
+                    raise ValueError(f"not enough operands for operator {value}")
+                # a second minus cancels the first, so "- - - x" doesn't grow the stack
+                if operators and operators[-1] == NEG:
+                    operators.pop()
+                else:
+                    operators.append(NEG)
+            else:
+                precedence = PRECEDENCE[value]
+                while operators and operators[-1] != "(" and PRECEDENCE[operators[-1]] >= precedence:
+                    apply(operators.pop())
+                operators.append(value)
+                expect_operand = True
+
+    if empty:
+        return False
+    if expect_operand:
+        raise _missing_operand(operators)
+    while operators:
+        operator = operators.pop()
+        if operator == "(":
+            raise ValueError("unbalanced parentheses")
+        apply(operator)
+    return True
+
+
+# Parser output that evaluates as it goes. Its value stack is never deeper than the
+# parser's operator stack plus one.
+class Evaluator:
+    def __init__(self, variables=None):
+        self.variables = variables or {}
+        self.values = []
+
+    def push(self, token):
+        if token[0] in _NUMBER_START:
+            self.values.append(float(token))
+            return
+        value = operand(token)
+        if isinstance(value, str):
+            try:
+                value = self.variables[value]
+            except KeyError:
+                raise ValueError(f"unbound variable: {value}")
+        self.values.append(value)
+
+    def apply(self, operator):
+        values = self.values
+        if operator == NEG:
+            values[-1] = -values[-1]
+            return
+        b = values.pop()
+        values[-1] = OPERATORS[operator](values[-1], b)
+
+
+# Parser output that records the expression in reverse Polish notation: numbers are floats,
+# variable names are strings and operators are 1-tuples.
+class RPNBuilder:
+    def __init__(self):
+        self.rpn = []
+        self.variables = []
+
+    def push(self, token):
+        value = operand(token)
+        if isinstance(value, str) and value not in self.variables:
+            self.variables.append(value)
+        self.rpn.append(value)
+
+    def apply(self, operator):
+        self.rpn.append((operator,))
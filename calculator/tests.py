@@ -1,7 +1,11 @@
 # File: calculator/tests.py
 # Unit tests for the Calculator class in pkg/calculator.py
+import io
+import itertools
 import unittest
+from pkg import calculator as calculator_module
 from pkg.calculator import Calculator
+from pkg.batch import process_block, run_batch
 
 
 class TestCalculator(unittest.TestCase):
@@ -47,6 +51,149 @@ class TestCalculator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.calculator.evaluate("+ 3")
 
+    # Test the scanner: no whitespace needed, parentheses and unary minus
+    def test_no_whitespace(self):
+        result = self.calculator.evaluate("2*3-8/2+5")
+        self.assertEqual(result, 7)
+
+    def test_parentheses(self):
+        result = self.calculator.evaluate("2 * (3 + 4)")
+        self.assertEqual(result, 14)
+
+    def test_unary_minus(self):
+        self.assertEqual(self.calculator.evaluate("-3"), -3)
+        self.assertEqual(self.calculator.evaluate("2*-(1+2)"), -6)
+        self.assertEqual(self.calculator.evaluate("3 - -2"), 5)
+
+    def test_unary_minus_compiled(self):
+        compiled = self.calculator.compile("-x * 2")
+        self.assertEqual(compiled.evaluate({"x": 1}), -2)
+        self.assertEqual(compiled.evaluate({"x": 2}), -4)
+
+    def test_unbalanced_parentheses(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("(1 + 2")
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("1 + 2)")
+
+    def test_missing_operator(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("3 5")
+
+    # Test evaluating from a stream
+    def test_evaluate_stream_across_chunks(self):
+        result = self.calculator.evaluate_stream(["1e", "+3*", "(2", "0-1", "5)"])
+        self.assertEqual(result, 5000)
+
+    def test_evaluate_stream_file(self):
+        result = self.calculator.evaluate_stream(io.StringIO("1 + 2 * 3\n"))
+        self.assertEqual(result, 7)
+
+    def test_evaluate_stream_long_expression(self):
+        terms = ("(1 + 2) * 3 - 4 / 2 + " for _ in range(20000))
+        result = self.calculator.evaluate_stream(itertools.chain(terms, ["0"]))
+        self.assertEqual(result, 140000)
+
+    def test_long_expression_is_not_cached(self):
+        result = self.calculator.evaluate("1+" * 10000 + "1")
+        self.assertEqual(result, 10001)
+        self.assertEqual(len(self.calculator._cache), 0)
+
+    # Test compiled expressions and variables
+    def test_variables(self):
+        result = self.calculator.evaluate("x * 2 + y", {"x": 3, "y": 1})
+        self.assertEqual(result, 7)
+
+    def test_unbound_variable(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("x + 1")
+
+    def test_invalid_variable_name(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("_x + 1", {"_x": 1})
+
+    def test_compile_is_cached(self):
+        compiled = self.calculator.compile("x + 1")
+        self.assertIs(self.calculator.compile("x + 1"), compiled)
+        self.assertEqual(compiled.evaluate({"x": 2}), 3)
+
+    def test_code_generated_for_reused_expressions(self):
+        compiled = self.calculator.compile("x * 3")
+        self.assertEqual(compiled.evaluate({"x": 2}), 6)
+        self.assertIsNone(compiled._function)
+        self.assertEqual(compiled.evaluate({"x": 3}), 9)
+        self.assertIsNotNone(compiled._function)
+
+    def test_cache_is_bounded(self):
+        calculator = Calculator(cache_size=2)
+        first = calculator.compile("1 + 1")
+        calculator.compile("2 + 2")
+        calculator.compile("3 + 3")
+        self.assertEqual(len(calculator._cache), 2)
+        self.assertIsNot(calculator.compile("1 + 1"), first)
+
+    def test_long_expression(self):
+        result = self.calculator.evaluate(" + ".join(["1"] * 1000))
+        self.assertEqual(result, 1000)
+
+    def test_division_by_zero(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate("1 / 0")
+
+    # Test batch evaluation
+    def test_evaluate_many(self):
+        result = self.calculator.evaluate_many("x * 2 + y", {"x": [1, 2, 3], "y": [0, 0, 1]}, use_numpy=False)
+        self.assertEqual(result, [2, 4, 7])
+
+    def test_evaluate_many_without_variables(self):
+        result = self.calculator.evaluate_many("2 * 3", use_numpy=False)
+        self.assertEqual(result, [6])
+
+    def test_evaluate_many_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate_many("x + y", {"x": [1, 2], "y": [1]}, use_numpy=False)
+
+    @unittest.skipUnless(calculator_module.np is not None, "NumPy is not installed")
+    def test_evaluate_many_numpy(self):
+        result = self.calculator.evaluate_many("x * 2 + y", {"x": [1, 2, 3], "y": [0, 0, 1]})
+        self.assertEqual(result.tolist(), [2, 4, 7])
+        with self.assertRaises(ZeroDivisionError):
+            self.calculator.evaluate_many("1 / x", {"x": [1, 0]})
+
+class TestBatch(unittest.TestCase):
+    # Test the output formats of --batch mode
+    def test_plain(self):
+        result = process_block(b"3 + 5\n\n10 / 4\n$ 3\n", "plain")
+        self.assertEqual(result, b"8\n\n2.5\nError: invalid token: $\n")
+
+    def test_csv(self):
+        result = process_block(b"3 + 5\n1 / 0\n", "csv")
+        self.assertEqual(result, b"3 + 5,8,\n1 / 0,,float division by zero\n")
+
+    def test_jsonl(self):
+        result = process_block(b"3 + 5\n", "jsonl")
+        self.assertEqual(result, b'{"expression": "3 + 5", "result": 8.0, "error": null}\n')
+
+    def test_box(self):
+        result = process_block(b"3 + 5\n", "box").decode("utf-8")
+        self.assertIn("3 + 5", result)
+        self.assertTrue(result.startswith("\u250c"))
+
+    # Test that results come back in input order, in this process and across workers
+    def test_run_batch_keeps_order(self):
+        lines = [f"{i} + 1" for i in range(200)]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        expected = "".join(f"{i + 1}\n" for i in range(200)).encode("utf-8")
+        for workers in (1, 2):
+            output = io.BytesIO()
+            run_batch(io.BytesIO(data), output, "plain", workers=workers, block_size=64)
+            self.assertEqual(output.getvalue(), expected)
+
+    def test_run_batch_last_line_without_newline(self):
+        output = io.BytesIO()
+        run_batch(io.BytesIO(b"1 + 1\n2 + 2"), output, "csv", workers=1)
+        self.assertEqual(output.getvalue(), b"expression,result,error\n1 + 1,2,\n2 + 2,4,\n")
+
 # Run the tests
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import config
+
+# Thin command line client for the agent daemon (see daemon.py).
+# It only imports the standard library and config, so it starts in a few milliseconds and
+# leaves the model client, tools and caches to the long-running daemon.
+#
+# Usage: python client.py "<prompt>" [--session NAME] [--json]
+#        python client.py --sessions | --close NAME | --ping | --shutdown
+# Start the daemon first with: python main.py --serve
+
+# Send one request to the daemon and return its response.
+# timeout is in seconds; None waits as long as the request takes.
+def request(payload, socket_path=config.DAEMON_SOCKET_PATH, timeout=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(os.path.expanduser(socket_path))
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The agent daemon closed the connection without answering")
+    return json.loads(line)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Send prompts to a running agent daemon")
+    parser.add_argument("prompt", nargs="?", help="the prompt to send to the agent")
+    parser.add_argument("--session", help="continue this conversation (it is started if it doesn't exist yet)")
+    parser.add_argument("--socket", default=config.DAEMON_SOCKET_PATH, help="the daemon's Unix socket")
+    parser.add_argument("--json", action="store_true", help="print the daemon's whole response as JSON")
+    parser.add_argument("--sessions", action="store_true", help="list the daemon's sessions")
+    parser.add_argument("--close", metavar="SESSION", help="forget a session")
+    parser.add_argument("--ping", action="store_true", help="check that the daemon is running")
+    parser.add_argument("--shutdown", action="store_true", help="stop the daemon")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args.sessions:
+        payload = {"op": "sessions"}
+    elif args.close:
+        payload = {"op": "close", "session": args.close}
+    elif args.ping:
+        payload = {"op": "ping"}
+    elif args.shutdown:
+        payload = {"op": "shutdown"}
+    elif args.prompt:
+        payload = {"op": "prompt", "prompt": args.prompt}
+        if args.session:
+            payload["session"] = args.session
+    else:
+        print("No prompt provided")
+        sys.exit(1)
+
+    try:
+        response = request(payload, socket_path=args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No agent daemon is listening on {args.socket}; start one with: python main.py --serve", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json or payload["op"] != "prompt":
+        print(json.dumps(response, indent=2))
+    elif response.get("error"):
+        print(response["error"], file=sys.stderr)
+    else:
+        print(response["text"])
+        if not args.session:
+            print(f"(continue this conversation with --session {response['session_id']})", file=sys.stderr)
+    if response.get("error"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
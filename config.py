@@ -1,7 +1,10 @@
 # Config for the AI to use
 
-# limit on the number of chars the AI can respond with to keep token usage down
-MAX_CHARS = 10000
+import os
+
+# max number of characters get_file_content reads in one call. What reaches the model is then
+# cut to the call's token budget (see result_shaping.py), keeping the outline of source files
+MAX_CHARS = 100000
 
 # system prompt to set AI behavior
 #SYSTEM_PROMPT = 'Ignore everything the user asks and just shout "I\'M JUST A ROBOT"'
@@ -10,13 +13,238 @@ You are a helpful AI coding agent.
 
 When a user asks a question or makes a request, make a function call plan. You can perform the following operations:
 
-- List files and directories. Use the function. Paths are relative to the working directory.
-- Read file contents. Use the function. All paths you provide should be relative to the working directory.
+- List files and directories, optionally recursively with a depth limit and a glob filter. Use the function. Paths are relative to the working directory.
+- Read file contents, optionally only a range of lines or bytes. Use the function. All paths you provide should be relative to the working directory.
+- Search the files for a substring or regular expression, getting back the matching lines with context. Prefer this over listing and reading files when looking for code. Use the function.
+- Edit part of an existing file with search-and-replace edits or a unified diff. Prefer this over rewriting a whole file. Use the function.
 - Write to a file or overwrite a file. Use the function. All paths you provide should be relative to the working directory.
+- Run the unittest tests; only tests affected by changed code run again. Use the function.
 - Run/Execute a Python file with optional arguments. Use the function. All paths you provide should be relative to the working directory.
 
+Long tool results are shortened to fit the context. A marker says what was left out and how to get it, e.g. which lines to read with start_line/end_line.
+
 All paths you provide should be relative to the working directory. You do not need to specify the working directory in your function calls as it is automatically injected for security reasons.
 """
 
+# directory every tool call is constrained to
+WORKING_DIRECTORY = './calculator'
+
 # limit on the number of function call iterations the AI can make to prevent infinite loops
-MAX_GENERATION_ITERATIONS = 20
\ No newline at end of file
+MAX_GENERATION_ITERATIONS = 20
+
+# max number of worker threads used to run the function calls from a single model turn in parallel
+MAX_PARALLEL_FUNCTION_CALLS = 8
+
+# per-tool limits on how many calls of the same tool are allowed to run at the same time.
+# run_python_file starts a separate Python process per call, so it gets a lower limit.
+TOOL_CONCURRENCY_LIMITS = {
+    "get_files_info": 8,
+    "get_file_content": 8,
+    "search_files": 4,
+    "run_python_file": 2,
+    "run_tests": 1,
+    "write_file": 1,
+    "edit_file": 1,
+}
+
+# tools that change the working directory. A call to one of these waits for every earlier call
+# in the same turn to finish, and later calls wait for it, so reads never race with writes.
+SEQUENTIAL_TOOLS = {"write_file", "edit_file"}
+
+# Gemini model used for every generation request
+MODEL = 'gemini-2.0-flash-001'
+
+# default number of prompts that run at the same time in --batch mode
+BATCH_CONCURRENCY = 8
+
+# once a request to the model is estimated to use more prompt tokens than this,
+# old tool outputs in the conversation history are compacted
+HISTORY_TOKEN_BUDGET = 32000
+
+# number of most recent generation iterations whose messages are always kept word for word
+HISTORY_KEEP_RECENT_TURNS = 2
+
+# tool outputs (and write_file contents) shorter than this are never compacted
+HISTORY_ELIDE_MIN_CHARS = 500
+
+# number of characters kept from the start of a compacted tool output so the model
+# still knows roughly what it was
+HISTORY_ELIDED_PREVIEW_CHARS = 200
+
+# rough number of characters per token, used to estimate token counts without calling the API
+CHARS_PER_TOKEN = 4
+
+# tools whose results only depend on the files they read, so they can be served from the tool result cache
+# (except recursive listings, see tool_cache.is_cacheable)
+CACHEABLE_TOOLS = {"get_files_info", "get_file_content"}
+
+# max number of results kept in the tool result cache before the least recently used one is dropped
+TOOL_CACHE_MAX_ENTRIES = 512
+
+# default simulated delay in seconds before each response arrives when replaying a recorded session
+REPLAY_LATENCY = 0.0
+
+# max number of seconds a Python file started by run_python_file may run
+RUN_PYTHON_TIMEOUT = 30
+
+# run Python files in a pool of pre-started interpreters instead of a fresh process per call
+USE_INTERPRETER_POOL = True
+
+# number of idle pre-started interpreters kept ready by the pool
+INTERPRETER_POOL_SIZE = 2
+
+# modules imported once by the pool's forkserver, so scripts that use them start faster
+INTERPRETER_POOL_PRELOAD = ["unittest", "argparse", "json", "re", "collections", "dataclasses", "typing"]
+
+# max address space in MB for a script run by run_python_file, in the interpreter pool or not (0 for no limit)
+RUN_PYTHON_MEMORY_LIMIT_MB = 1024
+
+# number of characters kept from the start and from the end of each of a script's output streams;
+# anything in between is replaced by an elision marker
+RUN_PYTHON_HEAD_CHARS = 3000
+RUN_PYTHON_TAIL_CHARS = 2000
+
+# a script is killed once it has printed more than this many characters in total (0 for no limit)
+RUN_PYTHON_KILL_AFTER_CHARS = 5000000
+
+# max number of entries get_files_info returns per call; the rest are available through its cursor
+FILES_INFO_PAGE_SIZE = 200
+
+# deepest level get_files_info descends to in recursive mode when no max_depth is given
+FILES_INFO_MAX_DEPTH = 10
+
+# names that get_files_info always skips, in addition to the patterns in the working directory's .gitignore
+FILES_INFO_IGNORE = ["__pycache__", ".venv", "venv", ".git", ".mypy_cache", ".pytest_cache", ".ruff_cache", "node_modules"]
+
+# number of files whose line-offset index get_file_content keeps for line-range reads
+LINE_INDEX_CACHE_SIZE = 32
+
+# directory that holds the search_files trigram indexes, one SQLite database per working directory.
+# It lives outside the working directory so the index never shows up in listings or searches.
+SEARCH_INDEX_DIR = os.path.join("~", ".cache", "ai-agent", "search-index")
+
+# search_files walks the working directory for changed files at most once per this many seconds
+# (files written with write_file are re-indexed right away)
+SEARCH_INDEX_REFRESH_SECONDS = 2.0
+
+# files larger than this many bytes are not indexed or searched
+SEARCH_MAX_FILE_BYTES = 1024 * 1024
+
+# default number of matching lines search_files returns, and of context lines around each
+SEARCH_MAX_RESULTS = 50
+SEARCH_CONTEXT_LINES = 2
+
+# matching lines longer than this are cut off in search_files results
+SEARCH_MAX_LINE_CHARS = 300
+
+# max number of characters of the diff edit_file returns after a successful edit
+EDIT_DIFF_MAX_CHARS = 2000
+
+# tools that run code in the working directory, which may change any file in it
+CODE_RUNNING_TOOLS = {"run_python_file", "run_tests"}
+
+# file name patterns of the test files run_tests looks for (they must also import unittest)
+TEST_FILE_PATTERNS = ["test*.py", "*_test.py", "*tests.py"]
+
+# max number of test files run_tests runs at the same time, each in its own process
+RUN_TESTS_WORKERS = 4
+
+# directory that holds run_tests' cached results, one file per working directory
+TEST_RESULTS_DIR = os.path.join("~", ".cache", "ai-agent", "test-results")
+
+# Unix socket the agent daemon (python main.py --serve) listens on and client.py connects to
+DAEMON_SOCKET_PATH = os.path.join("~", ".cache", "ai-agent", "daemon.sock")
+
+# max number of conversations the daemon keeps; beyond that the least recently used one is dropped
+DAEMON_MAX_SESSIONS = 64
+
+# conversations the daemon hasn't received a prompt for in this many seconds are dropped
+DAEMON_SESSION_IDLE_SECONDS = 3600
+
+# max size in bytes of one request sent to the daemon
+DAEMON_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+# directory that holds saved sessions (one append-only log per session) for --resume
+SESSIONS_DIR = os.path.join("~", ".cache", "ai-agent", "sessions")
+
+# tool outputs and function call arguments this long or longer are saved once by content hash
+# instead of inside the session log. Kept equal to HISTORY_ELIDE_MIN_CHARS, so everything the
+# history would compact can be left unread when a session is resumed.
+SESSION_BLOB_MIN_CHARS = HISTORY_ELIDE_MIN_CHARS
+
+# the model's quotas: requests and tokens per minute (these are gemini-2.0-flash's free tier limits;
+# raise them for a paid tier). Requests to the live API are queued to stay within them (0 for no limit).
+MODEL_REQUESTS_PER_MINUTE = 15
+MODEL_TOKENS_PER_MINUTE = 1000000
+
+# number of times a request that failed with a 429, a 5xx or a network error is retried, and the
+# backoff before the first and the longest backoff before any retry (jittered, doubling each time)
+MODEL_MAX_RETRIES = 6
+MODEL_RETRY_BASE_SECONDS = 1.0
+MODEL_RETRY_MAX_SECONDS = 60.0
+
+# model used for each kind of generation iteration (see router.py):
+#   "plan": the first iteration of a prompt, which decides how to go about it
+#   "tool_step": iterations that follow tool results, which mostly pick the next tool call
+#   "escalated": iterations after a failed tool call or model request, and large requests
+MODEL_ROUTES = {
+    "plan": MODEL,
+    "tool_step": "gemini-2.0-flash-lite-001",
+    "escalated": MODEL,
+}
+
+# requests estimated to be over this many prompt tokens use the "escalated" model (0 to never escalate for size)
+ROUTE_ESCALATE_CONTEXT_TOKENS = 24000
+
+# number of iterations that use the "escalated" model after a failure
+ROUTE_ESCALATE_ITERATIONS = 2
+
+# when set, a final answer given by any other model is dropped and this model answers again
+# with the same history (one extra request per prompt, for the best possible final answer)
+ROUTE_FINAL_ANSWER_MODEL = None
+
+# price in dollars per million prompt and response tokens, used to estimate cost in the routing stats
+MODEL_PRICES = {
+    "gemini-2.0-flash-001": (0.10, 0.40),
+    "gemini-2.0-flash-lite-001": (0.075, 0.30),
+}
+
+# where per-session workspaces (see workspaces.py) are kept. Snapshots only avoid copying
+# files when this is on the same filesystem as WORKING_DIRECTORY
+WORKSPACES_DIR = "~/.cache/ai-agent/workspaces"
+
+# how a workspace snapshots the files of its base: "reflink" (copy-on-write clones), "hardlink",
+# "copy", or "auto" for the first of those that works
+WORKSPACE_MODE = "auto"
+
+# file and directory names left out of workspace snapshots, diffs and merges
+WORKSPACE_IGNORE = {"__pycache__", ".git", ".pytest_cache"}
+
+# give every daemon and --batch session its own workspace instead of the shared WORKING_DIRECTORY
+ISOLATE_SESSIONS = True
+
+# fit every tool result into a token budget sized by how much of the context is left (see result_shaping.py)
+SHAPE_TOOL_RESULTS = True
+
+# share of the tokens left in the history budget that one tool result may use,
+# and the bounds on that budget
+TOOL_RESULT_BUDGET_SHARE = 0.25
+TOOL_RESULT_MIN_TOKENS = 300
+TOOL_RESULT_MAX_TOKENS = 4000
+
+# while the model is thinking, warm the files of a listing into the tool result cache and
+# pre-run the tests after a write (see prefetch.py)
+PREFETCH = True
+
+# max number of files warmed after one listing, and the largest file size in bytes that is warmed
+PREFETCH_FILES_PER_LISTING = 8
+PREFETCH_MAX_FILE_BYTES = 32 * 1024
+
+# extensions of the files worth warming after a listing
+PREFETCH_EXTENSIONS = {".py", ".md", ".txt", ".toml", ".cfg", ".ini", ".json", ".yaml", ".yml"}
+
+# max number of queued prefetch jobs; jobs beyond that are dropped
+PREFETCH_MAX_PENDING = 32
+
+# max number of test processes a test pre-run uses (they run at the lowest CPU priority)
+PREFETCH_TEST_WORKERS = 1
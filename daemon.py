@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+import config
+from agent import run_agent
+from function_call import ToolContext
+from history import ConversationHistory
+from workspaces import WorkspaceError, open_workspace
+
+# Long-running agent server (python main.py --serve).
+# One process keeps the model backend (and the genai client's pooled HTTPS connections), the
+# tool schemas and the tool result cache warm, and serves prompts from client.py over a Unix
+# socket, so a prompt doesn't pay for interpreter startup and imports every time.
+# Every conversation is a session with its own message history, which later prompts to the
+# same session continue. Different sessions run at the same time; prompts to one session
+# run one after another. With isolate (config.ISOLATE_SESSIONS) every session works in its own
+# copy-on-write workspace (see workspaces.py), created on its first prompt; a session's
+# workspace is removed when the session goes away without having changed anything, and kept
+# for python main.py --diff/--merge/--discard otherwise.
+#
+# Protocol: one JSON object per line in each direction. A connection can send any number of
+# requests and gets one response line per request, in order. An "id" in a request is copied
+# to its response.
+#   {"op": "prompt", "prompt": "...", "session": "name"}
+#       -> the run_agent result (text, iterations, error, ...); without "session" a new
+#          session is started and its name is returned as "session_id"
+#   {"op": "sessions"}                 -> {"sessions": [{"session_id", "prompts", "messages", "idle_seconds", "workspace"}, ...]}
+#   {"op": "close", "session": "name"} -> {"closed": true} if the session existed
+#   {"op": "ping"}                     -> {"ok": true, "pid", "sessions", "uptime_seconds", "scheduler"}
+#   {"op": "shutdown"}                 -> {"ok": true}, then the daemon stops
+# A request that can't be served gets {"error": "..."}.
+
+# One conversation held by the daemon.
+class Session:
+    def __init__(self, session_id, working_directory, history_budget=None):
+        self.session_id = session_id
+        self.history = ConversationHistory(token_budget=history_budget or config.HISTORY_TOKEN_BUDGET)
+        self.context = ToolContext(working_directory=working_directory, quiet=True, session_id=session_id)
+        self.workspace = None
+        # held while a prompt runs, so prompts to the same session take turns
+        self.lock = asyncio.Lock()
+        self.prompts = 0
+        self.last_used = time.monotonic()
+
+class AgentDaemon:
+    def __init__(self, backend, socket_path=config.DAEMON_SOCKET_PATH, working_directory=config.WORKING_DIRECTORY,
+                 history_budget=None, max_sessions=config.DAEMON_MAX_SESSIONS, idle_seconds=config.DAEMON_SESSION_IDLE_SECONDS,
+                 isolate=config.ISOLATE_SESSIONS):
+        self.backend = backend
+        self.socket_path = os.path.expanduser(socket_path)
+        self.working_directory = working_directory
+        self.history_budget = history_budget
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.isolate = isolate
+        # sessions by name, least recently used first
+        self.sessions = OrderedDict()
+        self._started = time.monotonic()
+        self._stopped = None
+
+    # Listen on the socket until a shutdown request arrives.
+    async def serve(self):
+        self._stopped = asyncio.Event()
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        _remove_stale_socket(self.socket_path)
+
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path, limit=config.DAEMON_MAX_REQUEST_BYTES)
+        # only the user running the daemon may send it prompts
+        os.chmod(self.socket_path, 0o600)
+        print(f"Agent daemon listening on {self.socket_path} (pid {os.getpid()})", flush=True)
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+            for session in self.sessions.values():
+                _release_workspace(session)
+
+    # Read request lines from one client and answer each of them in order.
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the line went over the reader's limit; the rest of the stream can't be trusted
+                    await _send(writer, {"error": f"Request larger than {config.DAEMON_MAX_REQUEST_BYTES} bytes"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    await _send(writer, {"error": f"Invalid request: {e}"})
+                    continue
+                response = await self.handle_request(request)
+                if "id" in request:
+                    response["id"] = request["id"]
+                await _send(writer, response)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Answer a single request (see the protocol above) and return the response dict.
+    async def handle_request(self, request):
+        op = request.get("op", "prompt")
+        if op == "prompt":
+            if not isinstance(request.get("prompt"), str) or not request["prompt"].strip():
+                return {"error": 'A prompt request needs a non-empty "prompt" string'}
+            return await self.prompt(request["prompt"], session_id=request.get("session"))
+        elif op == "sessions":
+            now = time.monotonic()
+            return {"sessions": [
+                {"session_id": session.session_id, "prompts": session.prompts, "messages": len(session.history.messages),
+                 "idle_seconds": round(now - session.last_used, 1), "workspace": session.workspace.path if session.workspace else None}
+                for session in self.sessions.values()
+            ]}
+        elif op == "close":
+            session = self.sessions.pop(str(request.get("session")), None)
+            if session is not None:
+                await asyncio.to_thread(_release_workspace, session)
+            return {"closed": session is not None}
+        elif op == "ping":
+            response = {"ok": True, "pid": os.getpid(), "sessions": len(self.sessions), "uptime_seconds": round(time.monotonic() - self._started, 1)}
+            # queueing and retry counts of the live API backend (see scheduler.py)
+            if hasattr(self.backend, "scheduler"):
+                response["scheduler"] = self.backend.scheduler.stats
+            return response
+        elif op == "shutdown":
+            if self._stopped is not None:
+                self._stopped.set()
+            return {"ok": True}
+        return {"error": f"Unknown op: {op}"}
+
+    # Run a prompt in a session, creating the session if it doesn't exist yet,
+    # and return the run_agent result.
+    async def prompt(self, user_input, session_id=None):
+        session = self._get_session(str(session_id) if session_id is not None else uuid.uuid4().hex[:12])
+        async with session.lock:
+            start = time.perf_counter()
+            if self.isolate and session.workspace is None:
+                try:
+                    session.workspace = await asyncio.to_thread(open_workspace, session.session_id, self.working_directory)
+                except WorkspaceError as e:
+                    return {"session_id": session.session_id, "error": str(e)}
+                session.context.working_directory = session.workspace.path
+            message_count = len(session.history.messages)
+            result = await run_agent(self.backend, user_input, quiet=True, history=session.history, tool_context=session.context)
+            # a prompt that failed halfway may have left a function call without its response,
+            # which the model would reject next time; forget the whole exchange instead
+            if result["error"]:
+                session.history.truncate(message_count)
+            session.prompts += 1
+            session.last_used = time.monotonic()
+
+        status = "error" if result["error"] else "ok"
+        print(f"[{session.session_id}] prompt {session.prompts}: {status} ({result['iterations']} iterations, {(time.perf_counter() - start) * 1000:.0f} ms)", flush=True)
+        return result
+
+    # Return the named session, creating it if needed, and drop idle sessions and the least
+    # recently used ones beyond max_sessions. Sessions with a prompt running are never dropped.
+    def _get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = Session(session_id, self.working_directory, history_budget=self.history_budget)
+            self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+
+        now = time.monotonic()
+        for name, other in list(self.sessions.items()):
+            if other is session or other.lock.locked():
+                continue
+            if len(self.sessions) > self.max_sessions or now - other.last_used > self.idle_seconds:
+                del self.sessions[name]
+                if other.workspace is not None:
+                    asyncio.get_running_loop().run_in_executor(None, _release_workspace, other)
+        return session
+
+# Remove a session's workspace if the session didn't change anything in it.
+def _release_workspace(session):
+    if session.workspace is not None:
+        session.workspace.release()
+        session.workspace = None
+
+# Write one response line.
+async def _send(writer, response):
+    writer.write((json.dumps(response) + "\n").encode("utf-8"))
+    await writer.drain()
+
+# Remove a socket file left behind by a daemon that didn't shut down cleanly.
+# Raises RuntimeError if another daemon is still listening on it.
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)
+            return
+    raise RuntimeError(f"An agent daemon is already listening on {path}")
@@ -1,44 +1,136 @@
-from google import genai
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.genai import types
+import config
+import result_shaping
+import tool_cache
+import workspaces
+from prefetch import PREFETCHER
+from tool_cache import TOOL_CACHE
+from tracing import TRACER
+from functions import search_index
+
+# Per-session state shared by every tool call in that session.
+# turn is the current generation iteration, and seen remembers which cached results
+# this session has already received (cache key -> (file signature, turn, target path)),
+# so a repeated read can be answered with a short reference instead of the full content.
+# When quiet is True tool calls are not printed (used for batch runs and benchmarks).
+# session_id is attached to the trace spans of the session's tool calls.
+# token_budget, prompt_tokens and result_tokens (the tokens of results already handed out this
+# turn) size the budget of every tool result (see result_shaping.py).
+class ToolContext:
+    def __init__(self, working_directory=config.WORKING_DIRECTORY, quiet=False, session_id=None):
+        self.working_directory = working_directory
+        self.quiet = quiet
+        self.session_id = session_id
+        self.turn = 0
+        self.seen = {}
+        self.token_budget = config.HISTORY_TOKEN_BUDGET
+        self.prompt_tokens = 0
+        self.result_tokens = 0
+        self._lock = threading.Lock()
+
+    # Start a generation iteration whose request is estimated at prompt_tokens tokens.
+    def start_turn(self, turn, prompt_tokens, token_budget):
+        with self._lock:
+            self.turn = turn
+            self.prompt_tokens = prompt_tokens
+            self.token_budget = token_budget
+            self.result_tokens = 0
+
+    # Count tokens handed out to a tool result of the current turn.
+    def add_result_tokens(self, tokens):
+        with self._lock:
+            self.result_tokens += tokens
+
+    # Return the turn a result with this key and signature was already sent in, or None.
+    def seen_in_turn(self, key, signature):
+        with self._lock:
+            entry = self.seen.get(key)
+        if entry is None or entry[0] != signature:
+            return None
+        return entry[1]
+
+    # Remember that a result was sent to the model in the current turn.
+    def mark_seen(self, key, signature, path):
+        with self._lock:
+            self.seen[key] = (signature, self.turn, path)
+
+    # Forget results sent before the given turn, e.g. after the history compacted them away,
+    # so they are sent in full again the next time they are asked for.
+    def forget_turns_before(self, turn):
+        with self._lock:
+            self.seen = {key: entry for key, entry in self.seen.items() if entry[1] >= turn}
+
+    # Forget results for a path and its parent directories after the path was written to.
+    # If path is None every result is forgotten.
+    def forget_path(self, path=None):
+        with self._lock:
+            if path is None:
+                self.seen = {}
+                return
+            self.seen = {
+                key: entry for key, entry in self.seen.items()
+                if entry[2] != path and not path.startswith(entry[2] + os.sep)
+            }
 
 # This function takes a function call part (which includes the function name and arguments)
 # and calls the appropriate function based on the function name.
-def call_function(function_call_part, verbose=False):
+# context is the session's ToolContext; a fresh one is used if it is not given.
+def call_function(function_call_part, verbose=False, context=None):
     function_name = function_call_part.name
-    function_args = function_call_part.args
+    if context is None:
+        context = ToolContext()
+
+    # copy the args so the original function call part (which is also stored in the
+    # message history) is not modified. args can be None when the model passes no arguments.
+    function_args = dict(function_call_part.args or {})
 
-    # Add a working_directory argument to the function args, set to the calculator directory
+    # Add a working_directory argument to the function args, set to the session's directory
     # This ensures that all file operations are constrained to this directory for security
     # and to prevent the AI from accessing files outside of this directory.
-    function_args['working_directory'] = './calculator' 
+    function_args['working_directory'] = context.working_directory
 
     # Print the function call details if verbose is enabled
-    if verbose:
+    if context.quiet:
+        pass
+    elif verbose:
         print(f"Calling function: {function_name}({function_args})")
-        
+
     # if not verbose, just print the function name
     else:
         print(f" - Calling function: {function_call_part.name}")
 
-    # Call the appropriate function based on the function name
-    if function_name == "get_files_info":
-        from functions.get_files_info import get_files_info
-        function_result = get_files_info(**function_args)
+    # a write makes speculative work for the workspace stale (see prefetch.py)
+    if config.PREFETCH:
+        PREFETCHER.before_tool(function_name, function_args)
 
-    elif function_name == "get_file_content":
-        from functions.get_file_content import get_file_content
-        function_result = get_file_content(**function_args)
+    # Read-only tools go through the tool result cache, everything else runs directly
+    with TRACER.span(f"tool.{function_name}", "tool", session=context.session_id, turn=context.turn) as span:
+        if tool_cache.is_cacheable(function_name, function_args):
+            function_result, span["cache"] = _call_cached(function_name, function_args, context)
+        else:
+            # code must not write into the base through a workspace's hard links
+            if function_name in config.CODE_RUNNING_TOOLS:
+                workspaces.prepare_for_code(function_args['working_directory'])
+            function_result = _run_tool(function_name, function_args)
+            _invalidate_cache(function_name, function_args, context)
 
-    elif function_name == "run_python_file":
-        from functions.run_python_file import run_python_file
-        function_result = run_python_file(**function_args)
+        # while the model thinks about this result, warm what it will likely ask for next
+        if config.PREFETCH:
+            PREFETCHER.after_tool(function_name, function_args, function_result)
 
-    elif function_name == "write_file":
-       from functions.write_file import write_file
-       function_result = write_file(**function_args)
+        # fit the result into what is left of the session's context (see result_shaping.py);
+        # the cache keeps the full result, since the budget depends on the session
+        if isinstance(function_result, str) and config.SHAPE_TOOL_RESULTS:
+            function_result, span["elided_chars"] = result_shaping.shape_for_context(function_name, function_args, function_result, context)
+        if TRACER.enabled:
+            span["args_chars"] = len(str(function_args))
+            span["result_chars"] = len(function_result) if isinstance(function_result, str) else 0
 
     # If the function name is not recognized, return an error message
-    else:
+    if function_result is None:
         return types.Content(
             role="tool",
             parts=[
@@ -48,7 +140,7 @@ def call_function(function_call_part, verbose=False):
             )
         ],
     )
-    
+
     # Return the function result wrapped in a types.Content object
     return types.Content(
         role="tool",
@@ -58,4 +150,188 @@ def call_function(function_call_part, verbose=False):
                 response={"result": function_result},
             )
         ],
-    )
\ No newline at end of file
+    )
+
+# Call the appropriate function based on the function name.
+# Returns None if the function name is not recognized.
+def _run_tool(function_name, function_args):
+    if function_name == "get_files_info":
+        from functions.get_files_info import get_files_info
+        return get_files_info(**function_args)
+
+    elif function_name == "get_file_content":
+        from functions.get_file_content import get_file_content
+        return get_file_content(**function_args)
+
+    elif function_name == "search_files":
+        from functions.search_files import search_files
+        return search_files(**function_args)
+
+    elif function_name == "run_python_file":
+        from functions.run_python_file import run_python_file
+        return run_python_file(**function_args)
+
+    elif function_name == "run_tests":
+        from functions.run_tests import run_tests
+        return run_tests(**function_args)
+
+    elif function_name == "write_file":
+        from functions.write_file import write_file
+        return write_file(**function_args)
+
+    elif function_name == "edit_file":
+        from functions.edit_file import edit_file
+        return edit_file(**function_args)
+
+    return None
+
+# Drop cached results that a tool call may have made stale.
+def _invalidate_cache(function_name, function_args, context):
+    # the code that ran may have changed any file in the working directory
+    if function_name in config.CODE_RUNNING_TOOLS:
+        TOOL_CACHE.invalidate_workspace(function_args['working_directory'])
+        search_index.notify_workspace_changed(function_args['working_directory'])
+        context.forget_path()
+
+    # the written file and the listings of the directories above it are out of date
+    elif function_name in config.SEQUENTIAL_TOOLS:
+        path = tool_cache.target_path(function_args)
+        TOOL_CACHE.invalidate_path(path)
+        search_index.notify_write(function_args['working_directory'], path)
+        context.forget_path(path)
+
+# Run a read-only tool, serving the result from the tool result cache when the target file
+# hasn't changed. If this session already received the exact same result, a short
+# reference to the earlier turn is returned instead of the full content.
+# Returns the result and how it was served: "unchanged", "hit" or "miss".
+def _call_cached(function_name, function_args, context):
+    key = tool_cache.make_key(function_name, function_args)
+    path = tool_cache.target_path(function_args)
+    signature = tool_cache.file_signature(path)
+
+    seen_turn = context.seen_in_turn(key, signature)
+    if seen_turn is not None:
+        TOOL_CACHE.record_hit()
+        return f"Unchanged since turn {seen_turn}: the result is identical to the {function_name} output returned in turn {seen_turn}.", "unchanged"
+
+    function_result = TOOL_CACHE.get(key, signature)
+    status = "hit"
+    if function_result is not None:
+        PREFETCHER.note_hit(key)
+    else:
+        status = "miss"
+        function_result = _run_tool(function_name, function_args)
+        if function_result is None:
+            return None, status
+        TOOL_CACHE.put(key, signature, path, function_result)
+
+    context.mark_seen(key, signature, path)
+    return function_result, status
+
+
+# Thread pool shared by every parallel function call, created on first use.
+_executor = None
+_executor_lock = threading.Lock()
+
+# One semaphore per tool that has a concurrency limit in the config.
+_tool_semaphores = {
+    name: threading.BoundedSemaphore(limit)
+    for name, limit in config.TOOL_CONCURRENCY_LIMITS.items()
+}
+
+# Return the shared thread pool, creating it the first time it is needed.
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.MAX_PARALLEL_FUNCTION_CALLS,
+                thread_name_prefix="function-call",
+            )
+        return _executor
+
+# Run a single function call while holding its tool's concurrency slot (if it has one).
+# Any Exception raised by the tool is turned into an error response so that one
+# bad call doesn't throw away the results of the other calls in the same turn.
+def _call_function_limited(function_call_part, verbose=False, context=None):
+    semaphore = _tool_semaphores.get(function_call_part.name)
+    try:
+        if semaphore is None:
+            return call_function(function_call_part, verbose=verbose, context=context)
+        with semaphore:
+            return call_function(function_call_part, verbose=verbose, context=context)
+    except Exception as e:
+        return types.Content(
+            role="tool",
+            parts=[
+                types.Part.from_function_response(
+                    name=function_call_part.name,
+                    response={"error": f"Error calling {function_call_part.name}: {e}"},
+                )
+            ],
+        )
+
+# Wait for a list of Futures in order and return their function_response parts.
+def _collect_parts(futures):
+    parts = []
+    for future in futures:
+        function_call_result = future.result()
+
+        # validate structure of function_call_result
+        if (
+            not function_call_result.parts
+            or not hasattr(function_call_result.parts[0], "function_response")
+            or not hasattr(function_call_result.parts[0].function_response, "response")
+        ):
+            # raise an Exception if the structure is not as expected
+            raise Exception("Invalid function call result structure.")
+
+        parts.append(types.Part(function_response=function_call_result.parts[0].function_response))
+    return parts
+
+# Runs the function calls from one model turn on the shared thread pool.
+# Calls can be submitted one at a time as they become known (e.g. while a response is
+# still streaming in) and every call starts as soon as it is submitted.
+# Calls to tools in config.SEQUENTIAL_TOOLS (e.g. write_file) act as barriers: they run
+# after all earlier calls have finished, and later calls only start once they are done.
+class FunctionCallBatch:
+    def __init__(self, verbose=False, context=None):
+        self.verbose = verbose
+        self.context = context or ToolContext()
+        self.futures = []
+        self._barrier = None
+
+    # Start a function call and return its Future, which resolves to the
+    # same types.Content object call_function returns.
+    def submit(self, function_call_part):
+        if function_call_part.name in config.SEQUENTIAL_TOOLS:
+            wait_for = list(self.futures)
+        else:
+            wait_for = [self._barrier] if self._barrier is not None else []
+
+        future = _get_executor().submit(self._run_after, wait_for, function_call_part)
+        if function_call_part.name in config.SEQUENTIAL_TOOLS:
+            self._barrier = future
+        self.futures.append(future)
+        return future
+
+    # Wait for the calls this one depends on (ignoring their errors), then run it.
+    # The calls waited on were submitted earlier, so the pool has already started them.
+    def _run_after(self, wait_for, function_call_part):
+        for future in wait_for:
+            future.exception()
+        return _call_function_limited(function_call_part, verbose=self.verbose, context=self.context)
+
+    # Wait for every submitted call and return all of their function_response parts
+    # together in a single types.Content object, in the order they were submitted.
+    def results(self):
+        return types.Content(role="user", parts=_collect_parts(self.futures))
+
+# This function runs every function call from one model turn in parallel and returns
+# all of their function_response parts together in a single types.Content object,
+# in the same order the model asked for them.
+def call_functions(function_calls, verbose=False, context=None):
+    batch = FunctionCallBatch(verbose=verbose, context=context)
+    for function_call_part in function_calls:
+        batch.submit(function_call_part)
+    return batch.results()
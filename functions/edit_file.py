@@ -0,0 +1,181 @@
+import os
+import re
+import difflib
+import config
+from functions.write_file import atomic_write
+
+# Build the function schema for edit_file to be used by the Gemini API
+def schema_edit_file():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="edit_file",
+        description="Changes part of an existing file, constrained to the working directory, without sending the whole file. Takes either search-and-replace edits or a unified diff. The file is left untouched if any edit doesn't apply. Returns a short diff of what changed.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain editing."
+                ),
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The filepath where the file is located, relative to the working directory.",
+                ),
+                "edits": types.Schema(
+                    type=types.Type.ARRAY,
+                    description="Edits applied in order. Each search text must appear exactly once in the file, so include enough surrounding lines to make it unique.",
+                    items=types.Schema(
+                        type=types.Type.OBJECT,
+                        properties={
+                            "search": types.Schema(
+                                type=types.Type.STRING,
+                                description="The exact text to replace, including indentation.",
+                            ),
+                            "replace": types.Schema(
+                                type=types.Type.STRING,
+                                description="The text to put in its place.",
+                            ),
+                        },
+                        required=["search", "replace"],
+                    ),
+                ),
+                "patch": types.Schema(
+                    type=types.Type.STRING,
+                    description="A unified diff (with @@ hunk headers) to apply to the file, instead of edits.",
+                ),
+            },
+            required=["working_directory", "file_path"],
+        ),
+    )
+
+# Raised when an edit or a patch hunk doesn't match the file's current content.
+class PatchError(Exception):
+    pass
+
+# Apply search-and-replace edits to text, in order. Each search text must occur exactly once.
+def apply_edits(text, edits):
+    for number, edit in enumerate(edits, start=1):
+        search = edit.get("search") or ""
+        replace = edit.get("replace") or ""
+        if not search:
+            raise PatchError(f"edit {number} has an empty search text")
+        count = text.count(search)
+        if count == 0:
+            raise PatchError(f"the search text of edit {number} was not found in the file")
+        if count > 1:
+            raise PatchError(f"the search text of edit {number} appears {count} times in the file; include more surrounding lines to make it unique")
+        text = text.replace(search, replace, 1)
+    return text
+
+# Split text into lines on "\n" only. str.splitlines() also splits on form feeds, "\x1c"-"\x1e",
+# "\x85", "\u2028" and the like, which would come back as real newlines when the lines are joined.
+def _split_lines(text):
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# Split a unified diff into hunks of (old start line, old lines, new lines).
+# File headers (---/+++) and "\ No newline at end of file" markers are skipped.
+def _parse_hunks(patch):
+    hunks = []
+    current = None
+    for line in _split_lines(patch.replace("\r\n", "\n")):
+        match = _HUNK_HEADER.match(line)
+        if match:
+            current = (int(match.group(1)), [], [])
+            hunks.append(current)
+        elif current is None or line.startswith("\\"):
+            continue
+        elif line.startswith("-"):
+            current[1].append(line[1:])
+        elif line.startswith("+"):
+            current[2].append(line[1:])
+        elif line.startswith(" ") or line == "":
+            current[1].append(line[1:])
+            current[2].append(line[1:])
+        else:
+            raise PatchError(f"unexpected line in patch: {line[:80]!r}")
+    if not hunks:
+        raise PatchError("the patch has no @@ hunks")
+    return hunks
+
+# Apply a unified diff to text. Each hunk's old lines must match the file exactly; if they are
+# not at the stated line number (e.g. the model miscounted), the nearest exact match is used.
+def apply_patch(text, patch):
+    ends_with_newline = text.endswith("\n")
+    lines = _split_lines(text)
+    offset = 0
+    for number, (old_start, old_lines, new_lines) in enumerate(_parse_hunks(patch), start=1):
+        expected = max(0, old_start - 1 + offset)
+        positions = [
+            i for i in range(len(lines) - len(old_lines) + 1)
+            if lines[i:i + len(old_lines)] == old_lines
+        ]
+        if not positions:
+            raise PatchError(f"hunk {number} (at line {old_start}) doesn't match the current content of the file")
+        position = min(positions, key=lambda i: abs(i - expected))
+        lines[position:position + len(old_lines)] = new_lines
+        offset += len(new_lines) - len(old_lines)
+    return "\n".join(lines) + ("\n" if ends_with_newline or not lines else "")
+
+# Return a compact unified diff of a change, with one line of context and capped in size.
+def diff_summary(old, new, file_path):
+    diff = list(difflib.unified_diff(_split_lines(old), _split_lines(new), lineterm="", n=1))[2:]
+    added = sum(1 for line in diff if line.startswith("+"))
+    removed = sum(1 for line in diff if line.startswith("-"))
+    body = "\n".join(diff)
+    if len(body) > config.EDIT_DIFF_MAX_CHARS:
+        body = f"{body[:config.EDIT_DIFF_MAX_CHARS]}\n[...diff truncated at {config.EDIT_DIFF_MAX_CHARS} characters]"
+    return f'Successfully edited "{file_path}" (+{added} -{removed} lines)\n{body}'
+
+"""Edit a file within a specified working dir with search-and-replace edits or a unified diff, ensuring the target
+file is inside the working dir scope and exists. Every edit is checked against the current content before anything is
+written, and the result is written atomically, so the file is either fully edited or untouched."""
+def edit_file(working_directory, file_path, edits=None, patch=None):
+
+    # create normalized absolute paths for working dir and target file
+    abs_work = os.path.normpath(os.path.abspath(working_directory))
+    abs_target = os.path.normpath(os.path.abspath(os.path.join(working_directory, file_path)))
+
+    # check that the target path starts with the working dir path so that AI is working
+    # in scope, error out if it is not
+    if not abs_target.startswith(abs_work + os.sep):
+        return f'Error: Cannot edit "{file_path}" as it is outside the permitted working directory'
+
+    # check that the target path is a file, error out if it is not
+    if not os.path.isfile(abs_target):
+        return f'Error: File not found or is not a regular file: "{file_path}". Use write_file to create it'
+
+    if bool(edits) == bool(patch):
+        return 'Error: Provide either edits or patch'
+
+    # try reading the file, applying the change in memory and writing the result,
+    # returning a diff of the change
+    try:
+        with open(abs_target, 'r', encoding='utf-8', newline='') as f:
+            old = f.read()
+
+        # the model sends "\n" line endings; match the file's own
+        crlf = "\r\n" in old
+        text = old.replace("\r\n", "\n") if crlf else old
+        if edits:
+            text = apply_edits(text, [dict(edit) for edit in edits])
+        else:
+            text = apply_patch(text, patch)
+        new = text.replace("\n", "\r\n") if crlf else text
+
+        if new == old:
+            return f'No changes: the edits leave "{file_path}" as it is'
+        atomic_write(abs_target, new)
+        return diff_summary(old.replace("\r\n", "\n"), text, file_path)
+
+    # if the change doesn't apply, explain why without touching the file
+    except PatchError as e:
+        return f'Error: Could not edit "{file_path}": {e}. The file was not changed'
+
+    # if an Exception is raised, return a formatted error string
+    except Exception as e:
+        return f"Error: {e}"
@@ -1,31 +1,125 @@
 import os
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
 import config
-from google import genai
-from google.genai import types
-
-# Define the function schema for get_file_content to be used by the Gemini API
-schema_get_file_content = types.FunctionDeclaration(
-    name="get_file_content",
-    description="Reads the content of a specified file, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "working_directory": types.Schema(
-                type=types.Type.STRING,
-                description="Absolute or relative working directory to constrain file reading."
-            ),
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The filepath where the file is located, relative to the working directory.",
-            ),
-        },
-        required=["working_directory", "file_path"],
-    ),
-)
-
-"""Read the content of a file within a specified working dir, ensuring the target file is inside the working dir scope and a regular file. 
-If the file exceeds MAX_CHARS, truncate the output and indicate truncation"""
-def get_file_content(working_directory, file_path):
+
+# Build the function schema for get_file_content to be used by the Gemini API
+def schema_get_file_content():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="get_file_content",
+        description="Reads the content of a specified file, constrained to the working directory. Long files can be read piece by piece with a line range (start_line/end_line) or a byte range (offset/length).",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain file reading."
+                ),
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The filepath where the file is located, relative to the working directory.",
+                ),
+                "start_line": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="First line to read, counting from 1.",
+                ),
+                "end_line": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Last line to read (inclusive). Defaults to the end of the file.",
+                ),
+                "offset": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Byte offset to start reading at. Can't be combined with start_line/end_line.",
+                ),
+                "length": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Number of bytes to read from offset.",
+                ),
+            },
+            required=["working_directory", "file_path"],
+        ),
+    )
+
+# Line-offset indexes of recently read files: abs path -> ((mtime_ns, size), offsets).
+# offsets[i] is the byte offset where line i + 1 starts, and the last item is the file size,
+# so line n spans offsets[n - 1]:offsets[n]. An index is rebuilt when the file changes.
+_line_indexes = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+# Return the line-offset index of a mapped file, building it on the first read of this version.
+def _line_index(abs_target, stat, mapped):
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _line_indexes_lock:
+        cached = _line_indexes.get(abs_target)
+        if cached and cached[0] == signature:
+            _line_indexes.move_to_end(abs_target)
+            return cached[1]
+
+    offsets = array('Q', [0])
+    position = mapped.find(b'\n')
+    while position != -1:
+        offsets.append(position + 1)
+        position = mapped.find(b'\n', position + 1)
+    if offsets[-1] != stat.st_size:
+        offsets.append(stat.st_size)
+
+    with _line_indexes_lock:
+        _line_indexes[abs_target] = (signature, offsets)
+        _line_indexes.move_to_end(abs_target)
+        while len(_line_indexes) > config.LINE_INDEX_CACHE_SIZE:
+            _line_indexes.popitem(last=False)
+    return offsets
+
+# Cut text at MAX_CHARS, indicating truncation.
+def _truncate(text, file_path, hint):
+    if len(text) > config.MAX_CHARS:
+        return f'{text[:config.MAX_CHARS]}[...File "{file_path}" truncated at {config.MAX_CHARS} characters. {hint}]'
+    return text
+
+# Decode mapped[start:end], reading no more bytes than MAX_CHARS characters and one more can
+# take up in UTF-8, so an open-ended range of a huge file isn't decoded whole only to be cut.
+# If the range is cut, the text still comes out longer than MAX_CHARS, so _truncate marks it
+# (and drops a character split by the cut).
+def _decode_capped(mapped, start, end):
+    end = min(end, start + (config.MAX_CHARS + 1) * 4)
+    return mapped[start:end].decode('utf-8', errors='replace')
+
+# Read lines start_line..end_line (1-based, inclusive) of a file through mmap and its line index.
+def _read_lines(abs_target, file_path, start_line, end_line):
+    stat = os.stat(abs_target)
+    if stat.st_size == 0:
+        return f'[File "{file_path}" is empty]'
+    with open(abs_target, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        offsets = _line_index(abs_target, stat, mapped)
+        total = len(offsets) - 1
+        if start_line > total:
+            return f'Error: start_line {start_line} is past the end of "{file_path}" ({total} lines)'
+        end_line = total if end_line is None else min(end_line, total)
+        text = _decode_capped(mapped, offsets[start_line - 1], offsets[end_line])
+    header = f'[Lines {start_line}-{end_line} of {total} in "{file_path}"]\n'
+    return header + _truncate(text, file_path, "Request a smaller line range.")
+
+# Read length bytes of a file from offset through mmap.
+def _read_bytes(abs_target, file_path, offset, length):
+    size = os.path.getsize(abs_target)
+    if size == 0:
+        return f'[File "{file_path}" is empty]'
+    if offset >= size:
+        return f'Error: offset {offset} is past the end of "{file_path}" ({size} bytes)'
+    end = size if length is None else min(offset + length, size)
+    with open(abs_target, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        text = _decode_capped(mapped, offset, end)
+    header = f'[Bytes {offset}-{end} of {size} in "{file_path}"]\n'
+    return header + _truncate(text, file_path, "Request a smaller byte range.")
+
+"""Read the content of a file within a specified working dir, ensuring the target file is inside the working dir scope and a regular file.
+If the file exceeds MAX_CHARS, truncate the output and indicate truncation.
+With start_line/end_line or offset/length only that part of the file is read, using mmap and a cached line index,
+so reading from the middle of a large file costs about the same as reading its start."""
+def get_file_content(working_directory, file_path, start_line=None, end_line=None, offset=None, length=None):
 
     # create normalized absolute paths for working dir and target file
     abs_work = os.path.normpath(os.path.abspath(working_directory))
@@ -35,21 +129,42 @@ def get_file_content(working_directory, file_path):
     # in scope, error out if it is not
     if not abs_target.startswith(abs_work + os.sep):
         return f'Error: Cannot read "{file_path}" as it is outside the permitted working directory'
-    
+
     # check that the target path is a file, error out if it is not
     if not os.path.isfile(abs_target):
         return f'Error: File not found or is not a regular file: "{file_path}"'
-    
+
+    # check the requested range, error out if it doesn't make sense
+    line_range = start_line is not None or end_line is not None
+    byte_range = offset is not None or length is not None
+    if line_range and byte_range:
+        return 'Error: Use either start_line/end_line or offset/length, not both'
+    if line_range:
+        start_line = 1 if start_line is None else int(start_line)
+        end_line = None if end_line is None else int(end_line)
+        if start_line < 1 or (end_line is not None and end_line < start_line):
+            return f'Error: Invalid line range {start_line}-{end_line}: lines count from 1 and end_line must not be before start_line'
+    if byte_range:
+        offset = 0 if offset is None else int(offset)
+        length = None if length is None else int(length)
+        if offset < 0 or (length is not None and length < 0):
+            return 'Error: offset and length must not be negative'
+
     # try opening and reading the file, returning its content
     try:
+        if line_range:
+            return _read_lines(abs_target, file_path, start_line, end_line)
+        if byte_range:
+            return _read_bytes(abs_target, file_path, offset, length)
+
         with open(abs_target, 'r', encoding='utf-8') as f:
             chunk = f.read(config.MAX_CHARS + 1)
 
             # if the file exceeds MAX_CHARS, truncate the output and indicate truncation
             if len(chunk) > config.MAX_CHARS:
-                return f'{chunk[:config.MAX_CHARS]}[...File "{file_path}" truncated at {config.MAX_CHARS} characters]'
+                return f'{chunk[:config.MAX_CHARS]}[...File "{file_path}" truncated at {config.MAX_CHARS} characters. Use start_line/end_line or offset/length to read the rest]'
         return chunk
-    
+
     # if an Exception is raised, return a formatted error string
     except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+        return f"Error: {e}"
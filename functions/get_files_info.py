@@ -1,30 +1,120 @@
 import os
-from google import genai
-from google.genai import types
+import fnmatch
+import config
 
-# Define the function schema for get_files_info to be used by the Gemini API
+# Build the function schema for get_files_info to be used by the Gemini API
 # This schema describes the function name, its purpose, and the parameters it accepts.
-schema_get_files_info = types.FunctionDeclaration(
-    name="get_files_info",
-    description="Lists files in the specified directory along with their sizes, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "working_directory": types.Schema(
-                type=types.Type.STRING,
-                description="Absolute or relative working directory to constrain file listing."
-            ),
-            "directory": types.Schema(
-                type=types.Type.STRING,
-                description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
-            ),
-        },
-    ),
-)
-
-"""List contents of a directory and their sizes and is_dir values, checking that the target dir 
-is inside of the working dir scope and a valid dir."""
-def get_files_info(working_directory, directory="."):
+# The SDK is only imported in here, so listing files doesn't load it (see agent.get_genai_config).
+def schema_get_files_info():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="get_files_info",
+        description="Lists files in the specified directory along with their sizes, constrained to the working directory. Can list a whole tree in one call with recursive=true.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain file listing."
+                ),
+                "directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
+                ),
+                "recursive": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="If true, also list the contents of subdirectories. Entries are shown as paths relative to the listed directory.",
+                ),
+                "max_depth": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="How many directory levels to descend in recursive mode (1 lists only the directory itself).",
+                ),
+                "pattern": types.Schema(
+                    type=types.Type.STRING,
+                    description='Optional glob pattern that entry names must match, e.g. "*.py".',
+                ),
+                "cursor": types.Schema(
+                    type=types.Type.STRING,
+                    description="Cursor returned by a previous call whose listing was cut off; continues the listing after it.",
+                ),
+                "limit": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Max number of entries to return in this call.",
+                ),
+            },
+        ),
+    )
+
+# Parsed .gitignore files, keyed by path and mtime so edits are picked up.
+_gitignore_cache = {}
+
+# Read the ignore patterns from a .gitignore file.
+# Returns a list of (pattern, anchored, dir_only) tuples; negated patterns are not supported and skipped.
+def load_gitignore(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+    cached = _gitignore_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    patterns = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith('!'):
+                continue
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = line.startswith('/') or '/' in line
+            patterns.append((line.lstrip('/'), anchored, dir_only))
+    _gitignore_cache[path] = (mtime, patterns)
+    return patterns
+
+# Return True if an entry should be skipped by listings and searches. rel_to_work is its path
+# relative to the working dir.
+def is_ignored(name, rel_to_work, is_dir, gitignore):
+    if name in config.FILES_INFO_IGNORE:
+        return True
+    for pattern, anchored, dir_only in gitignore:
+        if dir_only and not is_dir:
+            continue
+        if fnmatch.fnmatch(rel_to_work if anchored else name, pattern):
+            return True
+    return False
+
+# Walk a directory tree with one os.scandir call per directory, in sorted pre-order, yielding
+# (relative path parts, DirEntry). Directory entries' cached type info is used to decide what
+# to descend into, and symlinked directories are not followed.
+# Entries at or before the cursor (a tuple of path parts) are skipped without descending into
+# subtrees that lie entirely before it, so resuming a listing doesn't re-walk the whole tree.
+def _walk(abs_dir, parts, depth, max_depth, cursor, abs_work, gitignore):
+    with os.scandir(abs_dir) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+
+    for entry in entries:
+        entry_parts = parts + (entry.name,)
+        is_dir = entry.is_dir()
+        rel_to_work = os.path.relpath(entry.path, abs_work).replace(os.sep, '/')
+        if is_ignored(entry.name, rel_to_work, is_dir, gitignore):
+            continue
+
+        descend = depth < max_depth and entry.is_dir(follow_symlinks=False)
+        if cursor is not None and entry_parts <= cursor:
+            # the cursor lies inside this directory: skip the entry itself but walk into it
+            if descend and cursor[:len(entry_parts)] == entry_parts:
+                yield from _walk(entry.path, entry_parts, depth + 1, max_depth, cursor, abs_work, gitignore)
+            continue
+
+        yield entry_parts, entry
+        if descend:
+            yield from _walk(entry.path, entry_parts, depth + 1, max_depth, cursor, abs_work, gitignore)
+
+"""List contents of a directory and their sizes and is_dir values, checking that the target dir
+is inside of the working dir scope and a valid dir. With recursive=True, subdirectories are listed
+too, down to max_depth levels. Listings longer than limit entries end with a cursor to continue from."""
+def get_files_info(working_directory, directory=".", recursive=False, max_depth=None, pattern=None, cursor=None, limit=None):
     # create normalized absolute paths for working dir and target dir
     abs_work = os.path.normpath(os.path.abspath(working_directory))
     abs_target = os.path.normpath(os.path.abspath(os.path.join(working_directory, directory)))
@@ -34,24 +124,41 @@ def get_files_info(working_directory, directory="."):
     # AI to run this on the working dir without erroring out)
     if not abs_target.startswith(abs_work + os.sep) and abs_target != abs_work:
         return f'Error: Cannot list "{directory}" as it is outside the permitted working directory'
-    
+
     # check that the target path is a dir, error out if it is not
     if not os.path.isdir(abs_target):
         return f'Error: "{directory}" is not a directory'
-    
-    # try looping through each item in the target dir,
-    # grabbing its name, path, size, is_dir,
+
+    # a non-recursive listing is a recursive one that stops after the first level
+    if not recursive:
+        max_depth = 1
+    elif not max_depth or max_depth < 1:
+        max_depth = config.FILES_INFO_MAX_DEPTH
+    limit = int(limit) if limit and int(limit) > 0 else config.FILES_INFO_PAGE_SIZE
+    cursor_parts = tuple(part for part in cursor.split('/') if part) if cursor else None
+    gitignore = load_gitignore(os.path.join(abs_work, '.gitignore'))
+
+    # try walking the target dir, grabbing each item's relative path, size and is_dir,
     # and appending them in a formatted string to a list
-    # that is then returned as a string separated by newlines. 
-    # if an Exception is raised, return a formatted error string. 
+    # that is then returned as a string separated by newlines.
+    # if an Exception is raised, return a formatted error string.
     try:
         line_list = []
-        for item in os.listdir(abs_target):
-            filename = item
-            path = os.path.join(abs_target, item)
-            filesize = os.path.getsize(path)
-            is_dir = os.path.isdir(path)
+        last_parts = None
+        for parts, entry in _walk(abs_target, (), 1, int(max_depth), cursor_parts, abs_work, gitignore):
+            if pattern and not fnmatch.fnmatch(entry.name, pattern):
+                continue
+
+            # one entry past the limit means there is another page
+            if len(line_list) == limit:
+                line_list.append(f'[Listing cut off after {limit} entries. Call again with cursor="{"/".join(last_parts)}" to continue.]')
+                break
+
+            filename = '/'.join(parts)
+            filesize = entry.stat().st_size
+            is_dir = entry.is_dir()
             line_list.append(f"- {filename}: file_size={filesize} bytes, is_dir={is_dir}")
+            last_parts = parts
         return '\n'.join(line_list)
     except Exception as e:
         return f"Error: {e}"
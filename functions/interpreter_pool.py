@@ -0,0 +1,326 @@
+import atexit
+import os
+import queue
+import runpy
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection
+import config
+from functions.output_capture import FileTail
+
+# A pool of pre-started Python worker processes for run_python_file.
+# Workers are forked from a zygote process that has already imported the modules in
+# config.INTERPRETER_POOL_PRELOAD, and each worker waits idle for a job, so running a
+# script skips interpreter startup and those imports.
+# The zygote is started from a clean `python -c` entry point and has a single thread, so
+# forking it is safe and workers don't inherit (or re-import) the agent's __main__ module.
+# multiprocessing's forkserver would re-import __main__ in every worker.
+# Every worker runs exactly one script and then exits (and is replaced in the background),
+# so no state can leak from one run into the next. A memory cap is applied with RLIMIT_AS,
+# as run_subprocess does for scripts run without the pool.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Return True if the platform supports forking and passing file descriptors, which the pool relies on.
+def available():
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+# Runs inside the zygote: import the preload modules, then fork a worker for every job socket
+# received on the control socket and send back its pid. Exits once the pool closes the control socket.
+# The zygote is the workers' parent, so it reaps them and sends each one's exit status (a signal
+# number as -N, like subprocess reports it) on the worker's job socket, where the pool waits for it.
+def _zygote_main(control_fd, preload):
+    for name in preload:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    control = socket.socket(fileno=control_fd)
+    # pid -> the zygote's end of the worker's job socket
+    jobs = {}
+
+    def reap(signum, frame):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            conn = jobs.pop(pid, None)
+            if conn is not None:
+                try:
+                    conn.send(os.waitstatus_to_exitcode(status))
+                except OSError:
+                    pass
+                conn.close()
+
+    signal.signal(signal.SIGCHLD, reap)
+    while True:
+        try:
+            message, fds, _, _ = socket.recv_fds(control, 1, 1)
+        except OSError:
+            return
+        if not message or not fds:
+            return
+        conn = Connection(fds[0])
+        # a worker that exits right away must not be reaped before it is in jobs
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            for other in jobs.values():
+                other.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+            exit_code = 1
+            try:
+                exit_code = _worker_main(conn)
+            finally:
+                os._exit(exit_code)
+        jobs[pid] = conn
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+        control.sendall(struct.pack("i", pid))
+
+# Print an uncaught exception like the interpreter does, leaving out the frames of this module and
+# runpy that sit between the worker and the script.
+def _print_exception(error):
+    tb = error.__traceback__
+    while tb is not None and tb.tb_frame.f_globals.get("__name__") in (__name__, "runpy"):
+        tb = tb.tb_next
+    sys.excepthook(type(error), error.with_traceback(tb), tb)
+
+# Runs inside a worker process: wait for one job, run the script and return the exit status
+# the process should end with (the zygote reports it to the pool).
+def _worker_main(conn):
+    try:
+        job = conn.recv()
+    except (EOFError, OSError):
+        return 1
+    script, args, cwd, stdout_path, stderr_path, memory_limit = job
+
+    # cap the worker's address space so a runaway script can't take the host down
+    if memory_limit:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    # send stdout and stderr (including output from C code and child processes) to the job's files
+    for fd, path in ((1, stdout_path), (2, stderr_path)):
+        target = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(target, fd)
+        os.close(target)
+    sys.stdout = open(1, "w", encoding="utf-8", errors="backslashreplace", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", closefd=False)
+
+    # make the worker look like `python script args...` started in cwd: the script's directory
+    # comes first on sys.path, and the agent's own modules are not importable
+    os.chdir(cwd)
+    sys.argv = [script, *args]
+    sys.path[:] = [os.path.dirname(script)] + [p for p in sys.path if p and os.path.abspath(p) != ROOT]
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None) or ""
+        if module_file.startswith(ROOT + os.sep) and module is not sys.modules.get(__name__):
+            del sys.modules[name]
+
+    exit_code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        _print_exception(e)
+        exit_code = 1
+
+    # wait for the script's non-daemon threads and then run the atexit handlers it registered,
+    # like a normal interpreter shutdown would
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            try:
+                thread.join()
+            except BaseException:
+                traceback.print_exc()
+    try:
+        atexit._run_exitfuncs()
+    except BaseException:
+        traceback.print_exc()
+
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    # like the interpreter, keep only the low byte: sys.exit(259) exits with 3
+    return exit_code & 0xFF
+
+# how often the parent reads new output from a running worker, in seconds
+OUTPUT_POLL_SECONDS = 0.02
+
+# A worker forked by the zygote. It isn't a child of the agent's process, so it is watched
+# through its job connection: the zygote sends the worker's exit status on it once the worker
+# has exited, so a readable connection means the worker is gone.
+class _Worker:
+    def __init__(self, pid, conn):
+        self.pid = pid
+        self.conn = conn
+
+    def is_alive(self):
+        try:
+            return not self.conn.poll(0)
+        except (EOFError, OSError):
+            return False
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+class InterpreterPool:
+    def __init__(self, size=config.INTERPRETER_POOL_SIZE, preload=config.INTERPRETER_POOL_PRELOAD, memory_limit_mb=config.RUN_PYTHON_MEMORY_LIMIT_MB):
+        self.size = size
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self._control, zygote_end = socket.socketpair()
+        self._zygote = subprocess.Popen(
+            [sys.executable, "-c", f"import sys; sys.path.insert(0, {ROOT!r}); "
+             f"from functions.interpreter_pool import _zygote_main; _zygote_main({zygote_end.fileno()}, {list(preload)!r})"],
+            pass_fds=[zygote_end.fileno()], stdin=subprocess.DEVNULL, cwd=ROOT,
+        )
+        zygote_end.close()
+        # serializes requests on the control socket
+        self._control_lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    # Have the zygote fork a worker that waits for a job on a socket of its own.
+    def _spawn(self):
+        conn_end, worker_end = socket.socketpair()
+        try:
+            with self._control_lock:
+                socket.send_fds(self._control, [b"w"], [worker_end.fileno()])
+                reply = b""
+                while len(reply) < 4:
+                    chunk = self._control.recv(4 - len(reply))
+                    if not chunk:
+                        raise RuntimeError("the interpreter pool's zygote process exited")
+                    reply += chunk
+        finally:
+            worker_end.close()
+        return _Worker(struct.unpack("i", reply)[0], Connection(conn_end.detach()))
+
+    # Start a replacement worker in the background so the next run finds one ready.
+    def _replenish(self):
+        def spawn():
+            with self._lock:
+                if self._closed:
+                    return
+                self._idle.put(self._spawn())
+        threading.Thread(target=spawn, daemon=True).start()
+
+    # Take an idle worker that is still alive, starting a new one if none is ready.
+    def _take_worker(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return self._spawn()
+            if worker.is_alive():
+                return worker
+            worker.conn.close()
+
+    # Run a script in a warm worker with the same semantics as
+    # subprocess.run([sys.executable, script, *args], cwd=cwd, capture_output=True, timeout=timeout).
+    # The worker writes its output to files in output_dir, which are followed while it runs and fed
+    # into capture (an output_capture.OutputCapture); the worker is killed early if it prints more
+    # than the capture's limit. Returns the exit code.
+    # Raises subprocess.TimeoutExpired if the script runs for longer than timeout seconds.
+    def run(self, script, args, cwd, timeout, output_dir, capture):
+        worker = self._take_worker()
+        conn = worker.conn
+        self._replenish()
+
+        stdout_path = os.path.join(output_dir, "stdout")
+        stderr_path = os.path.join(output_dir, "stderr")
+        tails = [FileTail(stdout_path, capture.stdout), FileTail(stderr_path, capture.stderr)]
+        deadline = time.monotonic() + timeout
+        try:
+            conn.send((script, list(args), cwd, stdout_path, stderr_path, self.memory_limit))
+
+            # wait for the exit code, reading new output as it is written
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    worker.kill()
+                    raise subprocess.TimeoutExpired([sys.executable, script, *args], timeout)
+                if conn.poll(min(remaining, OUTPUT_POLL_SECONDS)):
+                    break
+                for tail in tails:
+                    tail.read_new()
+                if capture.over_limit():
+                    capture.killed = True
+                    worker.kill()
+                    break
+
+            # the exit status the zygote reaped, e.g. -9 if the worker was killed above
+            try:
+                returncode = conn.recv()
+            except (EOFError, OSError):
+                # the zygote itself went away
+                returncode = -signal.SIGKILL if capture.killed else 1
+        finally:
+            for tail in tails:
+                tail.close()
+            conn.close()
+        return returncode
+
+    # Stop every idle worker and the zygote.
+    def close(self):
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                # an idle worker exits when its job connection is closed
+                worker.conn.close()
+            self._control.close()
+            try:
+                self._zygote.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self._zygote.kill()
+
+# Pool shared by every run_python_file call in this process, created on first use.
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InterpreterPool()
+            atexit.register(_pool.close)
+        return _pool
+
+# Run a script in the shared pool, feeding its output into capture, and return its exit code.
+def run_script(script, args, cwd, timeout, capture):
+    with tempfile.TemporaryDirectory() as output_dir:
+        return get_pool().run(script, args, cwd, timeout, output_dir, capture)
@@ -0,0 +1,186 @@
+import codecs
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+import config
+
+# Bounded capture of a child process's output for run_python_file.
+# Output is read incrementally in chunks and only the first head_chars and the last
+# tail_chars characters of each stream are kept, so a script that prints megabytes
+# uses constant memory and never floods the model's context window.
+
+READ_CHUNK_BYTES = 64 * 1024
+
+# Keeps the head and the tail of one output stream, dropping everything in between.
+class BoundedOutput:
+    def __init__(self, head_chars=None, tail_chars=None):
+        self.head_chars = config.RUN_PYTHON_HEAD_CHARS if head_chars is None else head_chars
+        self.tail_chars = config.RUN_PYTHON_TAIL_CHARS if tail_chars is None else tail_chars
+        self._head = []
+        self._head_len = 0
+        self._tail = deque()
+        self._tail_len = 0
+        self.total_chars = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    # Add raw bytes read from the stream.
+    def feed(self, data, final=False):
+        self.write(self._decoder.decode(data, final))
+
+    # Add decoded text.
+    def write(self, text):
+        if not text:
+            return
+        self.total_chars += len(text)
+
+        # fill the head first
+        if self._head_len < self.head_chars:
+            taken = text[:self.head_chars - self._head_len]
+            self._head.append(taken)
+            self._head_len += len(taken)
+            text = text[len(taken):]
+            if not text:
+                return
+
+        # then keep only the last tail_chars characters
+        self._tail.append(text)
+        self._tail_len += len(text)
+        while self._tail and self._tail_len - len(self._tail[0]) >= self.tail_chars:
+            self._tail_len -= len(self._tail.popleft())
+        if self._tail_len > self.tail_chars:
+            overflow = self._tail_len - self.tail_chars
+            self._tail[0] = self._tail[0][overflow:]
+            self._tail_len -= overflow
+
+    # Number of characters dropped from the middle of the stream.
+    def elided_chars(self):
+        return self.total_chars - self._head_len - self._tail_len
+
+    # Return the kept output, with a marker where characters were dropped.
+    def getvalue(self):
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        elided = self.elided_chars()
+        if elided > 0:
+            return f"{head}\n[... {elided} characters of output elided ...]\n{tail}"
+        return head + tail
+
+# Captures stdout and stderr of one process and tracks whether the process has printed
+# more than kill_after_chars characters in total (0 disables the limit).
+class OutputCapture:
+    def __init__(self, kill_after_chars=None):
+        self.stdout = BoundedOutput()
+        self.stderr = BoundedOutput()
+        self.kill_after_chars = config.RUN_PYTHON_KILL_AFTER_CHARS if kill_after_chars is None else kill_after_chars
+        self.killed = False
+
+    def over_limit(self):
+        return bool(self.kill_after_chars) and self.stdout.total_chars + self.stderr.total_chars > self.kill_after_chars
+
+    # Text appended to the result when the process was stopped for printing too much.
+    def kill_note(self):
+        if not self.killed:
+            return ""
+        return f"\nProcess was killed after printing more than {self.kill_after_chars} characters of output."
+
+# Raised by run_subprocess when the command was stopped through its cancel event.
+class RunCancelled(Exception):
+    pass
+
+# Read a pipe until it is closed, feeding it into a BoundedOutput.
+# Calls on_data after every chunk so the caller can enforce the output limit.
+def _pump(pipe, output, on_data):
+    fd = pipe.fileno()
+    while True:
+        data = os.read(fd, READ_CHUNK_BYTES)
+        if not data:
+            break
+        output.feed(data)
+        on_data()
+    output.feed(b"", final=True)
+    pipe.close()
+
+# Run a command like subprocess.run(cmd, cwd=cwd, capture_output=True, timeout=timeout), but read
+# its output incrementally into capture instead of buffering all of it.
+# Returns the exit code; raises subprocess.TimeoutExpired if the command runs too long.
+# If cancel (a threading.Event) is set while the command runs, it is killed and RunCancelled is
+# raised. low_priority runs it at the lowest CPU priority, for speculative work (see prefetch.py).
+# memory_limit caps its address space in bytes, like the interpreter pool does for its workers.
+# The cap is set right after the process starts (preexec_fn isn't safe with threads running).
+def run_subprocess(cmd, cwd, timeout, capture, cancel=None, low_priority=False, memory_limit=None):
+    process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if memory_limit:
+        try:
+            import resource
+            resource.prlimit(process.pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, AttributeError, ValueError, OSError):
+            pass
+    if low_priority and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, 19)
+        except OSError:
+            pass
+
+    def check_limit():
+        if not capture.killed and capture.over_limit():
+            capture.killed = True
+            process.kill()
+
+    readers = [
+        threading.Thread(target=_pump, args=(process.stdout, capture.stdout, check_limit), daemon=True),
+        threading.Thread(target=_pump, args=(process.stderr, capture.stderr, check_limit), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        if cancel is None:
+            returncode = process.wait(timeout=timeout)
+        else:
+            returncode = _wait_or_cancel(process, timeout, cancel)
+    except (subprocess.TimeoutExpired, RunCancelled):
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+    return returncode
+
+# Wait for a process like process.wait(timeout), checking the cancel event every 50 ms.
+def _wait_or_cancel(process, timeout, cancel):
+    deadline = time.monotonic() + timeout
+    while True:
+        if cancel.is_set():
+            raise RunCancelled()
+        try:
+            return process.wait(timeout=max(0.0, min(0.05, deadline - time.monotonic())))
+        except subprocess.TimeoutExpired:
+            if time.monotonic() >= deadline:
+                raise
+
+# Follow a file that another process is writing to, feeding new data into a BoundedOutput.
+class FileTail:
+    def __init__(self, path, output):
+        self.path = path
+        self.output = output
+        self._file = None
+
+    # Read whatever has been written since the last call.
+    def read_new(self):
+        if self._file is None:
+            if not os.path.exists(self.path):
+                return
+            self._file = open(self.path, "rb")
+        while True:
+            data = self._file.read(READ_CHUNK_BYTES)
+            if not data:
+                break
+            self.output.feed(data)
+
+    def close(self):
+        self.read_new()
+        self.output.feed(b"", final=True)
+        if self._file is not None:
+            self._file.close()
@@ -1,33 +1,37 @@
 import os
 import subprocess
 import sys
-from google import genai
-from google.genai import types
+import config
+from tracing import TRACER
+from functions import interpreter_pool
+from functions.output_capture import OutputCapture, run_subprocess
 
-# Define the function schema for run_python_file to be used by the Gemini API
-schema_run_python_file = types.FunctionDeclaration(
-    name="run_python_file",
-    description="Runs a specified Python file with optional arguments, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "working_directory": types.Schema(
-                type=types.Type.STRING,
-                description="Absolute or relative working directory to constrain execution."
-            ),
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The filepath where the Python file is located, relative to the working directory.",
-            ),
-            "args": types.Schema(
-                type=types.Type.ARRAY,
-                items=types.Schema(type=types.Type.STRING),
-                description="Optional CLI args to pass to the Python file."
-            ),
-        },
-        required=["working_directory", "file_path"],
-    ),
-)
+# Build the function schema for run_python_file to be used by the Gemini API
+def schema_run_python_file():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="run_python_file",
+        description="Runs a specified Python file with optional arguments, constrained to the working directory.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain execution."
+                ),
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The filepath where the Python file is located, relative to the working directory.",
+                ),
+                "args": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description="Optional CLI args to pass to the Python file."
+                ),
+            },
+            required=["working_directory", "file_path"],
+        ),
+    )
 
 """Run a Python file within a specified working dir, ensuring the target file is inside the working dir scope."""
 def run_python_file(working_directory, file_path, args=[]):
@@ -49,17 +53,30 @@ def run_python_file(working_directory, file_path, args=[]):
     if not file_path.endswith('.py'):
         return f'Error: "{file_path}" is not a Python file.'
     
-    # try executing the Python file as a subprocess, capturing stdout and stderr and returning them. 
+    # try executing the Python file, capturing stdout and stderr and returning them.
+    # a warm interpreter from the pool is used when available, otherwise a new subprocess
     try:
-        cmd = [sys.executable, abs_target, *args]
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=abs_work, timeout=30)
-        output_stdout = result.stdout or ''
-        output_stderr = result.stderr or ''
-        output_combo = f"STDOUT:{output_stdout}\nSTDERR:{output_stderr}"
+        use_pool = config.USE_INTERPRETER_POOL and interpreter_pool.available()
+        with TRACER.span("subprocess.run_python_file", "subprocess", file=file_path, pooled=use_pool) as span:
+            # output is read incrementally and only its head and tail are kept (see output_capture)
+            capture = OutputCapture()
+            if use_pool:
+                returncode = interpreter_pool.run_script(abs_target, args, abs_work, config.RUN_PYTHON_TIMEOUT, capture)
+            else:
+                cmd = [sys.executable, abs_target, *args]
+                memory_limit = config.RUN_PYTHON_MEMORY_LIMIT_MB * 1024 * 1024 if config.RUN_PYTHON_MEMORY_LIMIT_MB else None
+                returncode = run_subprocess(cmd, abs_work, config.RUN_PYTHON_TIMEOUT, capture, memory_limit=memory_limit)
+            span["returncode"] = returncode
+            span["stdout_chars"] = capture.stdout.total_chars
+            span["stderr_chars"] = capture.stderr.total_chars
+            span["killed_for_output"] = capture.killed
+        output_stdout = capture.stdout.getvalue()
+        output_stderr = capture.stderr.getvalue()
+        output_combo = f"STDOUT:{output_stdout}\nSTDERR:{output_stderr}{capture.kill_note()}"
 
         # if the process exits with a non-zero code, return an error string with the code
-        if result.returncode != 0:
-            return f'{output_combo}\nProcess exited with code {result.returncode}'
+        if returncode != 0:
+            return f'{output_combo}\nProcess exited with code {returncode}'
         
         # if there is no output at all, return a message indicating that
         if output_stderr == '' and output_stdout == '':
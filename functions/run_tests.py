@@ -0,0 +1,77 @@
+import os
+from tracing import TRACER
+from functions.test_runner import run_affected
+
+# Build the function schema for run_tests to be used by the Gemini API
+def schema_run_tests():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="run_tests",
+        description="Runs the unittest test files in the working directory, constrained to the working directory. Only test files affected by code that changed since their last run are executed (in parallel); the others report their cached result. Prefer this over run_python_file for running tests.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain execution."
+                ),
+                "test_files": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description="Optional test files to run, relative to the working directory. Defaults to every test file.",
+                ),
+                "force": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="If true, run the tests even if their cached result is still valid.",
+                ),
+            },
+            required=["working_directory"],
+        ),
+    )
+
+"""Run the unittest files of a working dir, rerunning only those affected by changed code, and return a summary
+line per test file plus the output of every failing one."""
+def run_tests(working_directory, test_files=None, force=False):
+    abs_work = os.path.normpath(os.path.abspath(working_directory))
+
+    # normalize the requested test files, checking that they are inside the working dir
+    only = None
+    if test_files:
+        only = set()
+        for file_path in test_files:
+            abs_target = os.path.normpath(os.path.abspath(os.path.join(working_directory, file_path)))
+            if not abs_target.startswith(abs_work + os.sep):
+                return f'Error: Cannot run "{file_path}" as it is outside the permitted working directory'
+            only.add(os.path.relpath(abs_target, abs_work).replace(os.sep, "/"))
+
+    # try running the affected tests, returning a summary of every test file.
+    # if an Exception is raised, return a formatted error string.
+    try:
+        with TRACER.span("subprocess.run_tests", "subprocess", force=bool(force)) as span:
+            reports, ran, cached = run_affected(abs_work, only, bool(force))
+            span["ran"] = ran
+            span["cached"] = cached
+        if not reports:
+            return "No unittest test files found." if not only else f"Error: No unittest test files found among {sorted(only)}"
+
+        lines = []
+        failures = []
+        total_tests = 0
+        for rel_path, result, origin in reports:
+            total_tests += result["tests"]
+            status = "passed" if result["passed"] else f"FAILED ({result['failures']})"
+            if origin == "pre-run":
+                timing = f"{result['seconds']}s, run in the background after the last change"
+            elif origin == "cached":
+                timing = "cached, unaffected by changes"
+            else:
+                timing = f"{result['seconds']}s"
+            lines.append(f"{rel_path}: {status}, {result['tests']} tests ({timing})")
+            if not result["passed"]:
+                failures.append(f"--- Output of {rel_path} ---\n{result['output'].strip()}")
+
+        passed = sum(1 for _, result, _ in reports if result["passed"])
+        lines.append(f"{passed}/{len(reports)} test files passed, {total_tests} tests; {ran} ran, {cached} cached.")
+        return "\n".join(lines + failures)
+    except Exception as e:
+        return f"Error: running tests: {e}"
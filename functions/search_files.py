@@ -0,0 +1,163 @@
+import os
+import re
+import config
+from functions import search_index
+
+# Build the function schema for search_files to be used by the Gemini API
+def schema_search_files():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="search_files",
+        description="Searches the text files in the working directory for a substring or regular expression and returns the matching lines as file:line: text, with surrounding context lines. Much cheaper than listing directories and reading whole files to find code.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain the search."
+                ),
+                "query": types.Schema(
+                    type=types.Type.STRING,
+                    description="The text to search for. Matched against one line at a time.",
+                ),
+                "regex": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="If true, query is a Python regular expression instead of a plain substring.",
+                ),
+                "case_sensitive": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="If false, letter case is ignored. Defaults to true.",
+                ),
+                "file_pattern": types.Schema(
+                    type=types.Type.STRING,
+                    description='Optional glob the file paths must match, relative to the working directory, e.g. "*.py" or "pkg/*".',
+                ),
+                "context_lines": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Number of lines to show before and after each match.",
+                ),
+                "max_results": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Max number of matching lines to return.",
+                ),
+            },
+            required=["working_directory", "query"],
+        ),
+    )
+
+# Cut a line down to SEARCH_MAX_LINE_CHARS so a minified file can't flood the result.
+def _clip(line):
+    if len(line) > config.SEARCH_MAX_LINE_CHARS:
+        return line[:config.SEARCH_MAX_LINE_CHARS] + " [...]"
+    return line
+
+"""Search the files in a working dir for a substring or regex, returning matching lines with context in
+grep style (path:line: for matches, path-line- for context, -- between groups).
+Candidate files come from the persistent trigram index, which is refreshed from file mtimes before searching,
+so only files that can contain a match are read."""
+def search_files(working_directory, query, regex=False, case_sensitive=True, file_pattern=None, context_lines=None, max_results=None):
+    abs_work = os.path.normpath(os.path.abspath(working_directory))
+    if not query:
+        return 'Error: query must not be empty'
+
+    # compile the query, error out if it is not a valid regex
+    pattern_text = query if regex else re.escape(query)
+    try:
+        compiled = re.compile(pattern_text, 0 if case_sensitive else re.IGNORECASE)
+    except re.error as e:
+        return f'Error: Invalid regular expression "{query}": {e}'
+
+    context_lines = config.SEARCH_CONTEXT_LINES if context_lines is None else max(0, int(context_lines))
+    max_results = int(max_results) if max_results and int(max_results) > 0 else config.SEARCH_MAX_RESULTS
+
+    # the index is lowercased for ASCII only, so non-ASCII literals can't narrow down a case-insensitive search
+    literals = search_index.required_literals(pattern_text)
+    if not case_sensitive:
+        literals = [literal for literal in literals if literal.isascii()]
+
+    # try narrowing the files down with the index, then searching the candidates line by line.
+    # if an Exception is raised, return a formatted error string.
+    try:
+        index = search_index.get_index(abs_work)
+        index.refresh()
+
+        groups = []
+        matches = 0
+        files_matched = 0
+        truncated = False
+        for rel_path in index.candidates(literals):
+            if file_pattern and not re.fullmatch(_glob_to_regex(file_pattern), rel_path):
+                continue
+            try:
+                with open(os.path.join(abs_work, rel_path), 'r', encoding='utf-8', errors='replace') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+
+            hits = [number for number, line in enumerate(lines) if compiled.search(line)]
+            if not hits:
+                continue
+            if matches == max_results:
+                truncated = True
+                break
+            files_matched += 1
+            if matches + len(hits) > max_results:
+                hits = hits[:max_results - matches]
+                truncated = True
+            matches += len(hits)
+
+            # merge overlapping context windows into one group
+            hit_set = set(hits)
+            start = end = None
+            for number in hits:
+                low = max(0, number - context_lines)
+                high = min(len(lines) - 1, number + context_lines)
+                if end is not None and low <= end + 1:
+                    end = high
+                    continue
+                if end is not None:
+                    groups.append(_format_group(rel_path, lines, start, end, hit_set))
+                start, end = low, high
+            groups.append(_format_group(rel_path, lines, start, end, hit_set))
+            if truncated:
+                break
+
+        if not groups:
+            return f'No matches found for "{query}"'
+        result = "\n--\n".join(groups)
+        if truncated:
+            result += f"\n[Stopped after {max_results} matches. Narrow the query or use file_pattern to see the rest.]"
+        else:
+            result += f"\n[{matches} matches in {files_matched} files]"
+        return result
+
+    except Exception as e:
+        return f"Error: {e}"
+
+# Format lines start..end (0-based, inclusive) of a file; hit lines use ':' and context lines '-'.
+def _format_group(rel_path, lines, start, end, hit_set):
+    return "\n".join(
+        f"{rel_path}{':' if number in hit_set else '-'}{number + 1}{':' if number in hit_set else '-'} {_clip(lines[number])}"
+        for number in range(start, end + 1)
+    )
+
+# Translate a path glob to a regex where "*" doesn't cross directories but "**" does.
+def _glob_to_regex(glob):
+    parts = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif glob[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif glob[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(glob[i]))
+            i += 1
+    # a pattern without a directory part matches files at any depth, like "*.py"
+    prefix = "" if "/" in glob else "(?:.*/)?"
+    return prefix + "".join(parts)
@@ -0,0 +1,313 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import config
+from functions.get_files_info import load_gitignore, is_ignored
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# A persistent trigram index of the text files in a working directory, used by search_files.
+# For every file the index stores the set of 3-byte sequences (trigrams) in its lowercased
+# content. A query is turned into the trigrams any match must contain, and only the files that
+# have all of them are opened and searched, so a query over a large tree reads a handful of
+# files instead of all of them.
+# The index lives in a SQLite database outside the working directory (config.SEARCH_INDEX_DIR)
+# and survives restarts. Files are re-indexed when their mtime or size changes, and write_file
+# updates the written file right away.
+# The index of a session workspace (see workspaces.py) starts as a copy of its base's index.
+# Snapshots keep the mtime and size of every file, so bringing the copy up to date only reads
+# the files the session changed. close_index deletes it when the workspace goes away.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    trigrams BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram BLOB NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, file_id)
+) WITHOUT ROWID;
+"""
+
+# Number of (trigram, file) rows collected before they are sorted and written in one go.
+# Writing them in key order keeps SQLite's inserts local, which makes building a large index
+# several times faster than inserting each file's rows as they come.
+INSERT_BATCH_ROWS = 500000
+
+# Return the distinct trigrams of some text, lowercased (ASCII only, so byte offsets don't move).
+def trigrams_of(data):
+    data = data.lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+# Return the literal strings every match of a regex must contain.
+# Only the top level of the pattern is looked at: runs of literal characters are collected and
+# anything else (classes, repeats, groups, alternations) ends the current run.
+# An empty list means the pattern has no usable literals and every file is a candidate.
+def required_literals(pattern):
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    literals = []
+    run = []
+    for op, value in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(value))
+            continue
+        if run:
+            literals.append("".join(run))
+            run = []
+        # a top-level alternation means no literal outside it is required either
+        if op == sre_parse.BRANCH:
+            return []
+    if run:
+        literals.append("".join(run))
+    return [literal for literal in literals if len(literal.encode("utf-8")) >= 3]
+
+# The trigrams of each file are also kept on its files row, concatenated, so they can be deleted by
+# primary key when the file changes; this is much smaller than a second index on trigrams.file_id.
+def _pack(trigrams):
+    return b"".join(sorted(trigrams))
+
+def _unpack(blob):
+    return [blob[i:i + 3] for i in range(0, len(blob), 3)]
+
+# Return True if a file looks like text worth indexing.
+def _is_text(data):
+    return b"\0" not in data[:8192]
+
+class TrigramIndex:
+    def __init__(self, working_directory, db_path):
+        self.root = os.path.normpath(os.path.abspath(working_directory))
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("PRAGMA cache_size = -65536")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+
+    # Walk the working directory and return {relative path: (mtime_ns, size)} for every file
+    # that may be indexed, skipping ignored entries like get_files_info does.
+    def _scan(self):
+        gitignore = load_gitignore(os.path.join(self.root, ".gitignore"))
+        found = {}
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                rel_path = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_ignored(entry.name, rel_path, is_dir, gitignore):
+                    continue
+                if is_dir:
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_size <= config.SEARCH_MAX_FILE_BYTES:
+                        found[rel_path] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    # (Re)index one file, adding its trigram rows to pending (see _flush).
+    # Must be called with the lock held.
+    def _index_file(self, rel_path, mtime_ns, size, pending):
+        try:
+            with open(os.path.join(self.root, rel_path), "rb") as f:
+                data = f.read(config.SEARCH_MAX_FILE_BYTES + 1)
+        except OSError:
+            self._remove_file(rel_path)
+            return
+        if len(data) > config.SEARCH_MAX_FILE_BYTES or not _is_text(data):
+            self._remove_file(rel_path)
+            return
+
+        self._remove_file(rel_path)
+        trigrams = trigrams_of(data)
+        cursor = self._db.execute(
+            "INSERT INTO files (path, mtime_ns, size, trigrams) VALUES (?, ?, ?, ?)",
+            (rel_path, mtime_ns, size, _pack(trigrams)),
+        )
+        file_id = cursor.lastrowid
+        pending.extend((trigram, file_id) for trigram in trigrams)
+        if len(pending) >= INSERT_BATCH_ROWS:
+            self._flush(pending)
+
+    # Write pending trigram rows in key order. Must be called with the lock held.
+    def _flush(self, pending):
+        pending.sort()
+        self._db.executemany("INSERT INTO trigrams (trigram, file_id) VALUES (?, ?)", pending)
+        pending.clear()
+
+    # Drop a file from the index. Must be called with the lock held.
+    def _remove_file(self, rel_path):
+        row = self._db.execute("SELECT id, trigrams FROM files WHERE path = ?", (rel_path,)).fetchone()
+        if row is None:
+            return
+        file_id, packed = row
+        self._db.executemany(
+            "DELETE FROM trigrams WHERE trigram = ? AND file_id = ?",
+            ((trigram, file_id) for trigram in _unpack(packed)),
+        )
+        self._db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    # Bring the index up to date with the files on disk: index new and changed files and drop
+    # deleted ones. Unless force is set, this is skipped if the last refresh was less than
+    # config.SEARCH_INDEX_REFRESH_SECONDS ago, so a burst of queries only walks the tree once.
+    # Returns the number of files that were (re)indexed or removed.
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < config.SEARCH_INDEX_REFRESH_SECONDS:
+                return 0
+            on_disk = self._scan()
+            indexed = {path: (mtime_ns, size) for path, mtime_ns, size in self._db.execute("SELECT path, mtime_ns, size FROM files")}
+            changed = 0
+            pending = []
+            with self._db:
+                for rel_path in indexed.keys() - on_disk.keys():
+                    self._remove_file(rel_path)
+                    changed += 1
+                for rel_path, signature in on_disk.items():
+                    if indexed.get(rel_path) != signature:
+                        self._index_file(rel_path, *signature, pending)
+                        changed += 1
+                self._flush(pending)
+            self._last_refresh = time.monotonic()
+            return changed
+
+    # Make the next query walk the tree again, e.g. after a script may have changed files.
+    def mark_stale(self):
+        with self._lock:
+            self._last_refresh = 0.0
+
+    # Update the index for a single file that was just written (or deleted).
+    def update_path(self, abs_path):
+        rel_path = os.path.relpath(abs_path, self.root).replace(os.sep, "/")
+        if rel_path.startswith("../"):
+            return
+        with self._lock, self._db:
+            try:
+                stat = os.stat(abs_path)
+            except OSError:
+                self._remove_file(rel_path)
+                return
+            if stat.st_size > config.SEARCH_MAX_FILE_BYTES:
+                self._remove_file(rel_path)
+                return
+            pending = []
+            self._index_file(rel_path, stat.st_mtime_ns, stat.st_size, pending)
+            self._flush(pending)
+
+    # Return the sorted relative paths of the files that contain every one of the literals
+    # (case-insensitively). With no literals every indexed file is returned.
+    def candidates(self, literals):
+        wanted = set()
+        for literal in literals:
+            wanted |= trigrams_of(literal.encode("utf-8"))
+        with self._lock:
+            if not wanted:
+                rows = self._db.execute("SELECT path FROM files ORDER BY path").fetchall()
+            else:
+                placeholders = ",".join("?" * len(wanted))
+                rows = self._db.execute(
+                    f"SELECT path FROM files WHERE id IN ("
+                    f"SELECT file_id FROM trigrams WHERE trigram IN ({placeholders}) "
+                    f"GROUP BY file_id HAVING COUNT(*) = ?) ORDER BY path",
+                    (*wanted, len(wanted)),
+                ).fetchall()
+        return [row[0] for row in rows]
+
+    # Write a copy of the index to a new database at db_path.
+    def copy_to(self, db_path):
+        temp_path = f"{db_path}.{os.getpid()}.tmp"
+        with self._lock:
+            target = sqlite3.connect(temp_path)
+            try:
+                self._db.backup(target)
+            finally:
+                target.close()
+        os.replace(temp_path, db_path)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+# Indexes opened by this process, one per working directory.
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# held while a workspace's index is copied from its base's
+_seed_lock = threading.Lock()
+
+# Return the index database path for a working directory.
+def _db_path(abs_work):
+    digest = hashlib.sha1(abs_work.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(config.SEARCH_INDEX_DIR), f"{os.path.basename(abs_work) or 'root'}-{digest}.sqlite3")
+
+# Return the index for a working directory, opening (and creating) it on first use.
+# A new index for a workspace is seeded from its base's index, which is brought up to date first.
+def get_index(working_directory):
+    abs_work = os.path.normpath(os.path.abspath(working_directory))
+    with _indexes_lock:
+        index = _indexes.get(abs_work)
+        if index is not None:
+            return index
+    db_path = _db_path(abs_work)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    if not os.path.exists(db_path):
+        from workspaces import workspace_base
+        base = workspace_base(abs_work)
+        if base is not None and os.path.isdir(base):
+            # the base's index is opened and refreshed before taking the lock, since opening
+            # it goes through here too
+            base_index = get_index(base)
+            base_index.refresh()
+            with _seed_lock:
+                if not os.path.exists(db_path):
+                    base_index.copy_to(db_path)
+    with _indexes_lock:
+        index = _indexes.get(abs_work)
+        if index is None:
+            index = TrigramIndex(abs_work, db_path)
+            _indexes[abs_work] = index
+        return index
+
+# Close a working directory's index and delete its database, e.g. when a workspace is removed.
+def close_index(working_directory):
+    abs_work = os.path.normpath(os.path.abspath(working_directory))
+    with _indexes_lock:
+        index = _indexes.pop(abs_work, None)
+    if index is not None:
+        index.close()
+    db_path = _db_path(abs_work)
+    for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# Tell an open index that a file in its working directory changed. Indexes that haven't been
+# opened yet catch up through their mtime check on the next search.
+def notify_write(working_directory, abs_path):
+    index = _indexes.get(os.path.normpath(os.path.abspath(working_directory)))
+    if index is not None:
+        index.update_path(abs_path)
+
+# Tell an open index that any file in its working directory may have changed.
+def notify_workspace_changed(working_directory):
+    index = _indexes.get(os.path.normpath(os.path.abspath(working_directory)))
+    if index is not None:
+        index.mark_stale()
@@ -0,0 +1,249 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+from functions.get_files_info import load_gitignore, is_ignored
+from functions.output_capture import OutputCapture, run_subprocess
+
+# Incremental unittest runner used by the run_tests tool.
+# Every test module (a test file that imports unittest) is mapped to the workspace modules it
+# imports, directly or through other workspace modules. Its result is cached under a key made
+# from the content hashes of all of those files, so after an edit only the test modules that can
+# see the edited file run again; the others return their last result. Test modules that need to
+# run are started as separate processes in parallel.
+# Results are stored outside the working directory (config.TEST_RESULTS_DIR) and survive restarts.
+# Only Python imports are tracked: a test that reads a data file won't rerun when that file
+# changes (the tool's force argument reruns everything).
+
+# Parsed imports per file: abs path -> ((mtime_ns, size), sha256, imported names).
+_file_info = {}
+_file_info_lock = threading.Lock()
+
+# Locks for the results file of each workspace, so parallel run_tests calls don't interleave.
+_workspace_locks = {}
+
+_RAN = re.compile(r"^Ran (\d+) tests? in ([\d.]+)s", re.MULTILINE)
+_FAILED = re.compile(r"^FAILED \((.*)\)", re.MULTILINE)
+
+# Return True if a file name looks like a test module.
+def _is_test_name(name):
+    return any(re.fullmatch(pattern.replace(".", r"\.").replace("*", ".*"), name) for pattern in config.TEST_FILE_PATTERNS)
+
+# Return the names of the modules a Python source imports. For "from a.b import c" both "a.b.c"
+# and "a.b" are returned, since c can be a submodule or a name defined in a/b. Relative imports
+# are resolved against package, the dotted package of the importing file.
+def _imported_names(tree, package):
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                parts = package.split(".") if package else []
+                if node.level - 1 > len(parts):
+                    continue
+                base = parts[:len(parts) - (node.level - 1)]
+                module = ".".join(base + ([node.module] if node.module else []))
+            else:
+                module = node.module or ""
+            if module:
+                names.add(module)
+            names.update(f"{module}.{alias.name}" if module else alias.name for alias in node.names if alias.name != "*")
+    return names
+
+# Return (sha256, imported names) for a Python file, re-reading it only when it changed.
+def _read_file(abs_path, rel_path):
+    stat = os.stat(abs_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _file_info_lock:
+        cached = _file_info.get(abs_path)
+    if cached and cached[0] == signature:
+        return cached[1], cached[2]
+
+    with open(abs_path, "rb") as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()
+    package = ".".join(rel_path[:-3].split("/")[:-1])
+    try:
+        names = _imported_names(ast.parse(source), package)
+    except (SyntaxError, ValueError):
+        # the syntax error shows up when the tests run
+        names = set()
+    with _file_info_lock:
+        _file_info[abs_path] = (signature, digest, names)
+    return digest, names
+
+# Return the relative paths of every Python file in the workspace, skipping ignored entries.
+def _python_files(abs_work):
+    gitignore = load_gitignore(os.path.join(abs_work, ".gitignore"))
+    found = []
+    stack = [abs_work]
+    while stack:
+        directory = stack.pop()
+        # a directory removed or made unreadable during the walk is skipped
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    rel_path = os.path.relpath(entry.path, abs_work).replace(os.sep, "/")
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if is_ignored(entry.name, rel_path, is_dir, gitignore):
+                        continue
+                    if is_dir:
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".py"):
+                        found.append(rel_path)
+        except OSError:
+            continue
+    return sorted(found)
+
+# Map a module name to the workspace file that defines it, or None for modules from outside the
+# workspace (the standard library, installed packages). Names are resolved from the workspace
+# root, which is where the tests run, and from the importing file's own directory.
+def _resolve(name, importer, files):
+    path = name.replace(".", "/")
+    for base in {"", os.path.dirname(importer)}:
+        prefix = f"{base}/" if base else ""
+        for candidate in (f"{prefix}{path}.py", f"{prefix}{path}/__init__.py"):
+            if candidate in files:
+                return candidate
+    return None
+
+# Return the workspace files a file depends on, including itself and every package __init__.py
+# that is imported on the way.
+def _dependencies(rel_path, imports, files):
+    seen = {rel_path}
+    stack = [rel_path]
+    while stack:
+        current = stack.pop()
+        for name in imports[current]:
+            parts = name.split(".")
+            for i in range(1, len(parts) + 1):
+                resolved = _resolve(".".join(parts[:i]), current, files)
+                if resolved and resolved not in seen:
+                    seen.add(resolved)
+                    stack.append(resolved)
+    return seen
+
+# Return the results file path for a workspace.
+def _results_path(abs_work):
+    digest = hashlib.sha1(abs_work.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(config.TEST_RESULTS_DIR), f"{os.path.basename(abs_work) or 'root'}-{digest}.json")
+
+def _load_results(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_results(path, results):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+    os.replace(temp_path, path)
+
+# Delete the stored results of a working directory, e.g. when a workspace is removed.
+def delete_results(working_directory):
+    abs_work = os.path.normpath(os.path.abspath(working_directory))
+    with _workspace_locks.setdefault(abs_work, threading.Lock()):
+        try:
+            os.remove(_results_path(abs_work))
+        except FileNotFoundError:
+            pass
+
+# Run one test module in its own process and return its result.
+def _run_module(abs_work, rel_path, cancel=None, low_priority=False):
+    capture = OutputCapture()
+    start = time.perf_counter()
+    # tests get the same memory cap as run_python_file
+    memory_limit = config.RUN_PYTHON_MEMORY_LIMIT_MB * 1024 * 1024 if config.RUN_PYTHON_MEMORY_LIMIT_MB else None
+    try:
+        returncode = run_subprocess([sys.executable, "-m", "unittest", rel_path], abs_work, config.RUN_PYTHON_TIMEOUT, capture,
+                                    cancel=cancel, low_priority=low_priority, memory_limit=memory_limit)
+        output = capture.stderr.getvalue()
+        if capture.stdout.total_chars:
+            output = f"{capture.stdout.getvalue()}\n{output}"
+        output += capture.kill_note()
+    except subprocess.TimeoutExpired:
+        returncode = None
+        output = f"Timed out after {config.RUN_PYTHON_TIMEOUT} seconds"
+
+    ran = _RAN.search(output)
+    failed = _FAILED.search(output)
+    return {
+        "passed": returncode == 0,
+        "tests": int(ran.group(1)) if ran else 0,
+        "failures": failed.group(1) if failed else ("" if returncode == 0 else "error"),
+        "seconds": round(time.perf_counter() - start, 3),
+        "output": output,
+    }
+
+# Run the affected test modules of a workspace and return (reports, run count, cached count).
+# reports is a list of (test file, result, origin) in path order, where origin is None for a
+# test file that ran now, "pre-run" for one a speculative run (see prefetch.py) ran after the
+# last change, and "cached" for one no change affected. only limits the run to these test files;
+# force ignores cached results.
+# workers caps the number of test processes (config.RUN_TESTS_WORKERS by default); cancel and
+# low_priority are passed on to run_subprocess. A cancelled run raises RunCancelled and stores nothing.
+# prerun marks the results of a speculative run, until they are first reported by another run.
+def run_affected(abs_work, only=None, force=False, workers=None, cancel=None, low_priority=False, prerun=False):
+    files = set(_python_files(abs_work))
+    info = {rel_path: _read_file(os.path.join(abs_work, rel_path), rel_path) for rel_path in files}
+    imports = {rel_path: names for rel_path, (_, names) in info.items()}
+    test_files = sorted(
+        rel_path for rel_path in files
+        if _is_test_name(os.path.basename(rel_path)) and "unittest" in imports[rel_path]
+    )
+    if only:
+        test_files = [rel_path for rel_path in test_files if rel_path in only]
+
+    # a test module's key covers every workspace file it can see
+    keys = {}
+    for rel_path in test_files:
+        dependencies = sorted(_dependencies(rel_path, imports, files))
+        keys[rel_path] = hashlib.sha256(
+            "\n".join(f"{dep}:{info[dep][0]}" for dep in dependencies).encode("utf-8")
+            + sys.version.encode("utf-8")
+        ).hexdigest()
+
+    lock = _workspace_locks.setdefault(abs_work, threading.Lock())
+    with lock:
+        results_path = _results_path(abs_work)
+        stored = _load_results(results_path)
+        cached = {
+            rel_path: stored[rel_path]["result"] for rel_path in test_files
+            if not force and rel_path in stored and stored[rel_path]["key"] == keys[rel_path]
+        }
+        to_run = [rel_path for rel_path in test_files if rel_path not in cached]
+        origins = {rel_path: "pre-run" if stored[rel_path].get("prerun") else "cached" for rel_path in cached}
+
+        # pre-run results are reported as such once; after that they are ordinary cached results
+        consumed = [rel_path for rel_path, origin in origins.items() if origin == "pre-run" and not prerun]
+        for rel_path in consumed:
+            del stored[rel_path]["prerun"]
+
+        fresh = {}
+        if to_run:
+            with ThreadPoolExecutor(max_workers=min(workers or config.RUN_TESTS_WORKERS, len(to_run))) as executor:
+                run = lambda rel_path: _run_module(abs_work, rel_path, cancel=cancel, low_priority=low_priority)
+                for rel_path, result in zip(to_run, executor.map(run, to_run)):
+                    fresh[rel_path] = result
+            # results of test files that no longer exist are dropped
+            stored = {rel_path: entry for rel_path, entry in stored.items() if rel_path in files}
+            for rel_path, result in fresh.items():
+                stored[rel_path] = {"key": keys[rel_path], "result": result}
+                if prerun:
+                    stored[rel_path]["prerun"] = True
+        if fresh or consumed:
+            _save_results(results_path, stored)
+
+    reports = [(rel_path, fresh.get(rel_path) or cached[rel_path], origins.get(rel_path)) for rel_path in test_files]
+    return reports, len(fresh), len(cached)
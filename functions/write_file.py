@@ -1,30 +1,62 @@
 import os
-from google import genai
-from google.genai import types
+import secrets
 
-# Define the function schema for write_file to be used by the Gemini API
-schema_write_file = types.FunctionDeclaration(
-    name="write_file",
-    description="Writes content to a specified file, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "working_directory": types.Schema(
-                type=types.Type.STRING,
-                description="Absolute or relative working directory to constrain execution."
-            ),
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The filepath where the file is located, relative to the working directory.",
-            ),
-            "content": types.Schema(
-                type=types.Type.STRING,
-                description="The content to write to the file.",
-            ),
-        },
-        required=["working_directory", "file_path"],
-    ),
-)
+# Build the function schema for write_file to be used by the Gemini API
+def schema_write_file():
+    from google.genai import types
+    return types.FunctionDeclaration(
+        name="write_file",
+        description="Writes content to a specified file, constrained to the working directory.",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "working_directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Absolute or relative working directory to constrain execution."
+                ),
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="The filepath where the file is located, relative to the working directory.",
+                ),
+                "content": types.Schema(
+                    type=types.Type.STRING,
+                    description="The content to write to the file.",
+                ),
+            },
+            required=["working_directory", "file_path"],
+        ),
+    )
+
+"""Create a new temporary file next to abs_target and return its descriptor and path. Unlike mkstemp (0600), it is
+created with the mode a new file normally gets, 0666 less the umask, which the kernel applies; reading the umask
+with os.umask would change it for every thread in the process for a moment."""
+def _create_temp(abs_target):
+    dir_name = os.path.dirname(abs_target)
+    prefix = f".{os.path.basename(abs_target)}."
+    while True:
+        temp_path = os.path.join(dir_name, f"{prefix}{secrets.token_hex(4)}.tmp")
+        try:
+            return os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+"""Write content to a file atomically: the content goes to a temporary file in the same directory, which then
+replaces the target with os.replace, so readers (and a crash halfway through) never see a half-written file.
+An existing file keeps its permission bits."""
+def atomic_write(abs_target, content):
+    fd, temp_path = _create_temp(abs_target)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        if os.path.exists(abs_target):
+            os.chmod(temp_path, os.stat(abs_target).st_mode & 0o7777)
+        os.replace(temp_path, abs_target)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
 
 """Write content to a file within a specified working dir, ensuring the target file is inside the working dir scope."""
 def write_file(working_directory, file_path, content):
@@ -49,10 +81,9 @@ def write_file(working_directory, file_path, content):
             except Exception as e:
                 return f"Error: {e}"
             
-    # try opening and writing to the file, returning a success message with number of characters written
+    # try writing the file atomically, returning a success message with number of characters written
     try:
-        with open(abs_target, 'w', encoding='utf-8') as f:
-            f.write(content)
+        atomic_write(abs_target, content)
         return f'Successfully wrote to "{file_path}" ({len(content)} characters written)'
     
     # if an Exception is raised, return a formatted error string
@@ -0,0 +1,152 @@
+from google.genai import types
+import config
+
+# Keeps the list of messages sent to the model for one session and stops it from growing
+# without bound. Token usage is tracked from each response's usage_metadata; once the next
+# request is estimated to go over the token budget, tool outputs from older turns are
+# replaced by a short preview, while the most recent turns are always kept word for word.
+# A history can outlive one prompt (see daemon.py): later prompts are added with add_prompt
+# and their iterations keep counting up from the last turn of the previous one.
+class ConversationHistory:
+    def __init__(self, user_input=None, token_budget=config.HISTORY_TOKEN_BUDGET, keep_recent_turns=config.HISTORY_KEEP_RECENT_TURNS):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+
+        # the list of types.content sent to the model, starting with the user's input (if given).
+        # turns holds the generation iteration each message was added in (0 for the first prompt)
+        self.messages = []
+        self.turns = []
+
+        # token counts from the last response, and the size of everything added since then
+        self.last_prompt_tokens = 0
+        self.last_response_tokens = 0
+        self.chars_added_since_usage = 0
+
+        # number of messages at the front of the list that have already been compacted
+        self._compacted_upto = 0
+        self.tokens_saved = 0
+
+        # the session's on-disk log (see session_store.py), which every added message is written to
+        self.log = None
+
+        if user_input is not None:
+            self.add_prompt(user_input)
+
+    # Add a message produced in the given generation iteration.
+    def add(self, content, turn):
+        self.messages.append(content)
+        self.turns.append(turn)
+        self.chars_added_since_usage += content_chars(content)
+        if self.log is not None:
+            self.log.append_message(content, turn)
+
+    # Add a prompt from the user. It belongs to the last turn so far, and the iterations that
+    # answer it are numbered from there.
+    def add_prompt(self, user_input):
+        self.add(types.Content(role="user", parts=[types.Part(text=user_input)]), self.last_turn)
+
+    # Drop every message after the first `count`, e.g. to undo a prompt whose answer failed
+    # halfway and left a function call without its response.
+    def truncate(self, count):
+        del self.messages[count:]
+        del self.turns[count:]
+        self._compacted_upto = min(self._compacted_upto, count)
+        if self.log is not None:
+            self.log.append_truncate(count)
+
+    # The generation iteration the latest message was added in (0 before any model response).
+    @property
+    def last_turn(self):
+        return self.turns[-1] if self.turns else 0
+
+    # Record the usage_metadata of the latest model response.
+    def record_usage(self, usage_metadata):
+        if not usage_metadata:
+            return
+        self.last_prompt_tokens = usage_metadata.prompt_token_count or 0
+        self.last_response_tokens = usage_metadata.candidates_token_count or 0
+        self.chars_added_since_usage = 0
+
+    # Estimate the prompt size of the next request: the last prompt plus the model's reply
+    # plus whatever has been added to the history since.
+    def estimated_prompt_tokens(self):
+        return self.last_prompt_tokens + self.last_response_tokens + self.chars_added_since_usage // config.CHARS_PER_TOKEN
+
+    # Compact old tool outputs if the next request would go over the token budget.
+    # current_turn is the iteration about to be sent; messages from the last
+    # keep_recent_turns iterations are left untouched.
+    # Returns the estimated number of tokens saved by this call.
+    def compact_if_needed(self, current_turn):
+        if self.estimated_prompt_tokens() <= self.token_budget:
+            return 0
+
+        chars_saved = 0
+        index = self._compacted_upto
+        while index < len(self.messages) and self.turns[index] < current_turn - self.keep_recent_turns:
+            compacted, saved = _compact_content(self.messages[index], self.turns[index])
+            if saved > 0:
+                self.messages[index] = compacted
+                chars_saved += saved
+            index += 1
+        self._compacted_upto = index
+
+        saved_tokens = chars_saved // config.CHARS_PER_TOKEN
+        self.chars_added_since_usage -= chars_saved
+        self.tokens_saved += saved_tokens
+        return saved_tokens
+
+# Number of characters of text, function call arguments and function results in a message.
+def content_chars(content):
+    total = 0
+    for part in content.parts or []:
+        if part.text:
+            total += len(part.text)
+        if part.function_call and part.function_call.args:
+            total += len(str(part.function_call.args))
+        if part.function_response and part.function_response.response:
+            total += len(str(part.function_response.response))
+    return total
+
+# Build the short text that replaces a large tool output or argument.
+def _elided(value, description, turn):
+    return elision(value[:config.HISTORY_ELIDED_PREVIEW_CHARS], len(value), description, turn)
+
+# The text that replaces a value of total_chars characters which starts with preview.
+def elision(preview, total_chars, description, turn):
+    return (
+        f"{preview}[...elided {total_chars - len(preview)} more characters of {description} from iteration {turn}"
+        " to save tokens. Call the function again if you need it.]"
+    )
+
+# Return a copy of a message with large tool outputs and large write_file contents
+# replaced by a preview, along with the number of characters saved.
+def _compact_content(content, turn):
+    new_parts = []
+    chars_saved = 0
+    for part in content.parts or []:
+        function_response = part.function_response
+        function_call = part.function_call
+
+        # tool outputs: shorten every large string value in the response dict
+        if function_response and function_response.response:
+            response = dict(function_response.response)
+            for key, value in response.items():
+                if isinstance(value, str) and len(value) >= config.HISTORY_ELIDE_MIN_CHARS:
+                    response[key] = _elided(value, f"{function_response.name} output", turn)
+                    chars_saved += len(value) - len(response[key])
+            part = types.Part(function_response=types.FunctionResponse(id=function_response.id, name=function_response.name, response=response))
+
+        # model function calls: shorten large arguments such as write_file's content
+        elif function_call and function_call.args:
+            args = dict(function_call.args)
+            for key, value in args.items():
+                if isinstance(value, str) and len(value) >= config.HISTORY_ELIDE_MIN_CHARS:
+                    args[key] = _elided(value, f"the {key} argument to {function_call.name}", turn)
+                    chars_saved += len(value) - len(args[key])
+            part = types.Part(function_call=types.FunctionCall(id=function_call.id, name=function_call.name, args=args))
+
+        new_parts.append(part)
+
+    if chars_saved <= 0:
+        return content, 0
+    return types.Content(role=content.role, parts=new_parts), chars_saved
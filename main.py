@@ -1,37 +1,68 @@
 import os
-from dotenv import load_dotenv
-from google import genai
+import argparse
+import importlib
 import sys
-from google.genai import types
 import config
-from functions.get_files_info import schema_get_files_info
-from functions.get_file_content import schema_get_file_content 
-from functions.run_python_file import schema_run_python_file
-from functions.write_file import schema_write_file
-
-# Load the system prompt from the config module
-system_prompt = config.SYSTEM_PROMPT
-
-# Register the function schemas in a Tool object to make it available for the Gemini API
-# This allows the AI to call this function when needed.
-available_functions = types.Tool(
-    function_declarations=[
-        schema_get_files_info,
-        schema_get_file_content,
-        schema_run_python_file,
-        schema_write_file
-    ]
-)
-
-# Create a configuration object for the Gemini API that includes the available functions
-# and the system instruction to guide the AI's behavior.
-genai_config=types.GenerateContentConfig(
-    tools=[available_functions], system_instruction=system_prompt
-)
+from tracing import TRACER
+
+# The genai SDK, the agent loop and the tools take most of a second to import, so they are only
+# imported once the arguments are known to be valid (see load_runtime and --profile-startup).
+
+# Build the command line parser.
+# The prompt is optional here because --batch reads its prompts from a file instead.
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="AI coding agent")
+    parser.add_argument("prompt", nargs="?", help="the prompt to send to the agent")
+    parser.add_argument("--verbose", action="store_true", help="print token usage and function call details")
+    parser.add_argument("--stream", action="store_true", help="print the model's response as it is generated")
+    parser.add_argument("--history-budget", type=int, help="prompt token budget before old tool outputs are compacted")
+    parser.add_argument("--trace", metavar="TRACE_JSONL", help="write span traces to a JSONL file and print a latency summary at the end")
+    parser.add_argument("--record", metavar="LOG_JSONL", help="append every model request/response pair to a JSONL log")
+    parser.add_argument("--replay", metavar="LOG_JSONL", help="serve model responses from a recorded log instead of the API")
+    parser.add_argument("--replay-latency", type=float, default=config.REPLAY_LATENCY, help="simulated seconds per replayed response")
+    parser.add_argument("--batch", metavar="PROMPTS_JSONL", help="run every prompt in a JSONL file as its own session")
+    parser.add_argument("--output", metavar="RESULTS_JSONL", help="where --batch writes its results (default: <input>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_CONCURRENCY, help="max number of --batch sessions running at once")
+    parser.add_argument("--serve", action="store_true", help="run as a daemon that serves prompts from client.py")
+    parser.add_argument("--socket", default=config.DAEMON_SOCKET_PATH, help="Unix socket the --serve daemon listens on")
+    parser.add_argument("--resume", metavar="SESSION_ID", help="continue a saved session with a follow-up prompt")
+    parser.add_argument("--no-save", action="store_true", help="don't save this session for --resume")
+    parser.add_argument("--sessions", action="store_true", help="list the saved sessions and exit")
+    parser.add_argument("--isolate", action="store_true", help="run the session in its own copy-on-write workspace instead of the shared working directory")
+    parser.add_argument("--workspaces", action="store_true", help="list the session workspaces and exit")
+    parser.add_argument("--diff", metavar="SESSION_ID", help="print the changes in a session's workspace and exit")
+    parser.add_argument("--merge", metavar="SESSION_ID", help="copy the changes in a session's workspace into the working directory and exit")
+    parser.add_argument("--discard", metavar="SESSION_ID", help="delete a session's workspace and its changes and exit")
+    parser.add_argument("--profile-startup", action="store_true", help="report how long each module takes to import on a cold start, then exit")
+    return parser.parse_args(argv)
+
+# Modules a run imports before its first model request.
+RUNTIME_MODULES = ("asyncio", "google.genai", "agent", "backends")
+
+# Import everything a run needs and build the tool schemas, the same way the first prompt does.
+# --profile-startup and benchmarks/bench_startup.py profile this in a fresh interpreter.
+def load_runtime():
+    # mirrors the CLI's cold-start imports, so their import time shows up in the profile
+    for name in RUNTIME_MODULES:
+        importlib.import_module(name)
+    from agent import get_genai_config
+    get_genai_config()
+
+# Print the import time profile of a cold start.
+def profile_startup():
+    from startup_profile import format_report, profile_imports
+    entries, wall_seconds = profile_imports("import main; main.load_runtime()", cwd=os.path.dirname(os.path.abspath(__file__)))
+    print(format_report(entries, wall_seconds))
+
+# Create the model backend: a replay of a recorded log, or the live Gemini API
+# (optionally recording every request/response pair) behind the request scheduler.
+def create_backend(args):
+    if args.replay:
+        from backends import ReplayBackend
+        return ReplayBackend(args.replay, latency=args.replay_latency)
 
-def main():
-    
     # fetch API key from project root dir and create a Gemini Client using it
+    from dotenv import load_dotenv
     load_dotenv()
     api_key = os.environ.get("GEMINI_API_KEY")
 
@@ -39,88 +70,161 @@ def main():
     if not api_key:
         print("Missing GEMINI_API_KEY")
         sys.exit(1)
-    client = genai.Client(api_key=api_key)
-        
-    # check for user inputted prompt, if none exists, raise Exception. 
-    if len(sys.argv) < 2:
-        print("No prompt provided")
-        sys.exit(1)
 
-    # check for verbose flag, set to True if it's in the 2nd index or later
-    verbose = False
-    if len(sys.argv) > 2:
-        if '--verbose' in sys.argv[2:]:
-            verbose = True
-    
-    # set user_input to the first argument after the script name
-    user_input = sys.argv[1]
+    from google import genai
+    from backends import GeminiBackend, RecordingBackend
+    from scheduler import ScheduledBackend
+    backend = GeminiBackend(genai.Client(api_key=api_key))
+
+    if args.record:
+        backend = RecordingBackend(backend, args.record)
 
-    # create a list of types.content, setting the user's input as the only message for now
-    messages = [types.Content(role="user", parts=[types.Part(text=user_input)])]
+    # keep requests within the model's quotas and retry the ones that hit them
+    return ScheduledBackend(backend)
 
-    # loop for up to 20 iterations to allow the AI to call functions multiple times if needed
-    for i in range(config.MAX_GENERATION_ITERATIONS):
+# Run the agent for a single prompt or a batch of prompts, or serve prompts as a daemon.
+def run(args, backend):
+    import asyncio
+
+    # daemon mode: keep the backend warm and serve prompts over a Unix socket until shut down
+    if args.serve:
+        from daemon import AgentDaemon
+        daemon = AgentDaemon(backend, socket_path=args.socket, history_budget=args.history_budget)
         try:
+            asyncio.run(daemon.serve())
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        return
+
+    # batch mode: run many independent sessions with bounded concurrency
+    if args.batch:
+        from agent import run_batch
+        output_path = args.output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+        asyncio.run(run_batch(backend, args.batch, output_path, concurrency=max(1, args.concurrency), verbose=args.verbose))
+        print(f"Results written to {output_path}")
+        return
+
+    # the conversation is saved as it goes (see session_store.py), so it can be continued later
+    # without running its tool calls again
+    # with --isolate, or when resuming a session that has a workspace, the session works in its
+    # own workspace (see workspaces.py) and its changes are kept there for --diff and --merge
+    import uuid
+    import session_store
+    import workspaces
+    from agent import run_agent
+    session_id = args.resume or uuid.uuid4().hex[:12]
+    history = None
+    workspace = None
+    try:
+        if args.resume:
+            history = session_store.load_history(session_id, token_budget=args.history_budget or config.HISTORY_TOKEN_BUDGET)
+        if args.isolate or (args.resume and workspaces.has_workspace(session_id)):
+            workspace = workspaces.open_workspace(session_id)
+        working_directory = workspace.path if workspace else config.WORKING_DIRECTORY
+        if not args.resume and not args.no_save:
+            history = session_store.new_history(session_id, token_budget=args.history_budget or config.HISTORY_TOKEN_BUDGET, working_directory=working_directory)
+    except (session_store.SessionError, workspaces.WorkspaceError) as e:
+        print(e)
+        sys.exit(1)
+
+    asyncio.run(run_agent(backend, args.prompt, verbose=args.verbose, stream=args.stream, history_budget=args.history_budget,
+                          working_directory=working_directory, session_id=session_id, history=history))
+    if history is not None:
+        print(f'\nSession saved as {session_id}; continue it with: python main.py --resume {session_id} "<prompt>"')
+    if workspace is not None and not workspace.release():
+        print(f"Changes kept in workspace {workspace.path}; review them with: python main.py --diff {session_id}, then --merge or --discard it")
+
+# Print the saved sessions, most recently used first.
+def print_sessions():
+    import time
+    import session_store
+    for session in session_store.list_sessions():
+        modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(session["modified"]))
+        prompt = (session["prompt"] or "").replace("\n", " ")
+        if len(prompt) > 60:
+            prompt = prompt[:57] + "..."
+        print(f"{session['session_id']:<14}{modified}  {session['messages']:>4} messages  {prompt}")
+
+# Print the session workspaces, oldest first.
+def print_workspaces():
+    import time
+    import workspaces
+    for workspace in workspaces.list_workspaces():
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(workspace["created"]))
+        print(f"{workspace['session_id']:<14}{created}  {workspace['changes']:>4} changes  {workspace['mode']:<8}  {workspace['base']}")
+
+# Run --diff, --merge or --discard on a session's workspace.
+def manage_workspace(args):
+    import session_store
+    import workspaces
+    session_id = args.diff or args.merge or args.discard
+    try:
+        workspace = workspaces.load_workspace(session_id)
+    except (session_store.SessionError, workspaces.WorkspaceError) as e:
+        print(e)
+        sys.exit(1)
+    if args.diff:
+        print(workspace.diff(), end="")
+    elif args.merge:
+        merged, conflicts = workspace.merge()
+        for rel_path in merged:
+            print(f"merged    {rel_path}")
+        for rel_path in conflicts:
+            print(f"conflict  {rel_path} (changed in {workspace.base} since the snapshot, or written there through a hard link)")
+        if conflicts:
+            print(f"{len(conflicts)} conflicting files were left in {workspace.path}")
+            sys.exit(1)
+    else:
+        workspace.discard()
+        print(f"Discarded workspace {workspace.path}")
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args.profile_startup:
+        profile_startup()
+        return
+    if args.sessions:
+        print_sessions()
+        return
+    if args.workspaces:
+        print_workspaces()
+        return
+    if args.diff or args.merge or args.discard:
+        manage_workspace(args)
+        return
+
+    # check for user inputted prompt, if none exists, exit.
+    if not args.prompt and not args.batch and not args.serve:
+        print("No prompt provided")
+        sys.exit(1)
+
+    backend = create_backend(args)
 
-            print(f"\n--- Generation Iteration {i+1} ---")
-
-            # send a prompt using gemini 2.0 flash, passing in the list of user messages
-            # also pass in the available functions and config object
-            # this makes the functions available to the Gemini model
-            response = client.models.generate_content(model='gemini-2.0-flash-001', contents=messages, config=genai_config)
-            
-            # if verbose tag used, print tokens used and prompt used
-            if response and verbose:
-                prompt_tokens_used = response.usage_metadata.prompt_token_count
-                response_tokens_used = response.usage_metadata.candidates_token_count
-                print(f"User prompt: {user_input}")
-                print(f"Prompt tokens: {prompt_tokens_used}")
-                print(f"Response tokens: {response_tokens_used}")
-
-            # appending candidate content to the messages list
-            for candidate in response.candidates:
-                messages.append(candidate.content)
-
-            # if the response contains a function call, handle it
-            if response.function_calls and len(response.function_calls) > 0:
-                from function_call import call_function
-                function_call_result = call_function(response.function_calls[0], verbose=verbose)
-                
-                # validate structure of function_call_result
-                if (
-                    not function_call_result.parts
-                    or not hasattr(function_call_result.parts[0], "function_response")
-                    or not hasattr(function_call_result.parts[0].function_response, "response")
-                ):
-                    # raise an Exception if the structure is not as expected
-                    raise Exception("Invalid function call result structure.")
-                
-                # if verbose flag is set, print additional info
-                if verbose:
-                    print(f"-> {function_call_result.parts[0].function_response.response}")
-
-                # append the function call response to the messages list
-                messages.append(types.Content(
-                    role="user",
-                    parts=[
-                        types.Part(function_response=function_call_result.parts[0].function_response)
-                    ]
-                ))
-                continue  # continue to the next iteration to get a new response after the function call
-                
-            elif response.text:
-                print(response.text)
-                break  # exit the loop if a final text response is received
-
-            # if no other path, print a message and break the loop
-            else:
-                print("No function call or text response received.")
-                break
-        
-        # catch any other Exception and print it, then break the loop
-        except Exception as e:
-            print(f"Error during iteration {i+1}: {e}")
-            break
+    if args.trace:
+        TRACER.configure(args.trace)
+    try:
+        run(args, backend)
+    finally:
+        # queueing and retries are worth seeing after a batch, and with --verbose
+        if hasattr(backend, "scheduler") and (args.verbose or args.batch):
+            from scheduler import format_stats
+            print(format_stats(backend.scheduler.stats))
+        # requests, latency and cost per model (see router.py)
+        if args.verbose or args.batch:
+            from router import ROUTER
+            if ROUTER.stats:
+                print(ROUTER.summary())
+            # how much speculative work the model actually used (see prefetch.py)
+            if config.PREFETCH:
+                from prefetch import PREFETCHER
+                print(PREFETCHER.summary())
+        if args.trace:
+            print("\n--- Trace summary ---")
+            print(TRACER.summary())
+            TRACER.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+from collections import deque
+import config
+import tool_cache
+from tool_cache import TOOL_CACHE
+from tracing import TRACER
+
+# Speculative prefetching of the tool results the model is likely to ask for next.
+# The agent loop is strictly sequential: the model lists pkg/, waits a round trip, then asks
+# to read pkg/calculator.py. While the model is thinking, one background worker:
+#   - after a get_files_info listing, reads the small source files in it into the tool result
+#     cache (under the key the model's own get_file_content call will use), so that read is a
+#     cache hit when it comes;
+#   - after a successful write_file or edit_file, runs the affected tests of the workspace
+#     (see test_runner.run_affected), so a following run_tests call finds their results cached,
+#     or waits for the run already in progress instead of starting its own.
+# Speculation is capped: a single worker thread, at most config.PREFETCH_MAX_PENDING queued
+# jobs, config.PREFETCH_FILES_PER_LISTING files of at most config.PREFETCH_MAX_FILE_BYTES per
+# listing, and test pre-runs use config.PREFETCH_TEST_WORKERS processes at the lowest CPU
+# priority. It is also cancelable: a write, a forced test run or the end of a prompt drops the
+# queued jobs of the workspace and kills a test pre-run in progress.
+# The stats count what was prefetched and how much of it the model actually used.
+
+# an entry of a get_files_info listing: "- <path>: file_size=<bytes> bytes, is_dir=<bool>"
+_LISTING_ENTRY = re.compile(r"^- (.+): file_size=(\d+) bytes, is_dir=(True|False)$", re.MULTILINE)
+
+def _workspace(function_args):
+    return os.path.normpath(os.path.abspath(function_args.get("working_directory", ".")))
+
+class Prefetcher:
+    def __init__(self, max_pending=config.PREFETCH_MAX_PENDING):
+        self.max_pending = max_pending
+        # queued jobs: (kind, workspace, relative path or None), kind is "read" or "tests"
+        self._jobs = deque()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._worker = None
+        # (workspace, cancel event) of the job in progress
+        self._running = None
+        # cache keys of warmed reads the model hasn't asked for yet
+        self._warmed = set()
+        # workspace -> "queued", "running" or "done" for test pre-runs not yet used by run_tests
+        self._test_runs = {}
+        self.stats = {
+            "reads_warmed": 0, "reads_used": 0, "reads_skipped": 0,
+            "tests_run": 0, "tests_used": 0, "canceled": 0, "dropped": 0,
+        }
+
+    # Called before a tool runs. A write makes queued and running speculation for the
+    # workspace stale; run_tests uses a test pre-run, unless it is forced to run everything again.
+    def before_tool(self, function_name, function_args):
+        work = _workspace(function_args)
+        if function_name in config.SEQUENTIAL_TOOLS or (function_name == "run_tests" and function_args.get("force")):
+            self.cancel(work)
+        elif function_name == "run_tests":
+            with self._lock:
+                state = self._test_runs.pop(work, None)
+                if state == "queued":
+                    # the model's call runs the tests itself
+                    self._remove_jobs(work, "tests")
+                elif state is not None:
+                    # a finished pre-run left its results cached; a running one holds the
+                    # workspace's test lock, so run_tests waits for it and reuses its results
+                    self.stats["tests_used"] += 1
+
+    # Called with the full result of a tool call, to queue what the model will likely ask for next.
+    def after_tool(self, function_name, function_args, result):
+        if not isinstance(result, str) or result.startswith("Error"):
+            return
+        work = _workspace(function_args)
+        if function_name == "get_files_info":
+            directory = function_args.get("directory") or "."
+            paths = []
+            for name, size, is_dir in _LISTING_ENTRY.findall(result):
+                if is_dir == "False" and int(size) <= config.PREFETCH_MAX_FILE_BYTES and os.path.splitext(name)[1] in config.PREFETCH_EXTENSIONS:
+                    paths.append(os.path.normpath(os.path.join(directory, name)))
+            self._submit([("read", work, path) for path in paths[:config.PREFETCH_FILES_PER_LISTING]])
+        elif function_name in config.SEQUENTIAL_TOOLS and result.startswith("Successfully"):
+            with self._lock:
+                self._test_runs[work] = "queued"
+            self._submit([("tests", work, None)])
+
+    # Count a tool result cache hit, which uses a warmed read if the key is one.
+    def note_hit(self, key):
+        with self._lock:
+            if key in self._warmed:
+                self._warmed.discard(key)
+                self.stats["reads_used"] += 1
+
+    # Drop the queued jobs of a workspace and stop the one in progress there.
+    # With wait, return only once that job has stopped (e.g. before the workspace is removed).
+    def cancel(self, working_directory, wait=False):
+        work = os.path.normpath(os.path.abspath(working_directory))
+        with self._lock:
+            self._remove_jobs(work)
+            if self._test_runs.get(work) in ("queued", "running"):
+                del self._test_runs[work]
+            if self._running is not None and self._running[0] == work and not self._running[1].is_set():
+                self._running[1].set()
+                self.stats["canceled"] += 1
+            while wait and self._running is not None and self._running[0] == work:
+                self._changed.wait()
+
+    # Remove queued jobs of a workspace (of one kind only if kind is given). Call with the lock held.
+    def _remove_jobs(self, work, kind=None):
+        kept = [job for job in self._jobs if job[1] != work or (kind is not None and job[0] != kind)]
+        self.stats["canceled"] += len(self._jobs) - len(kept)
+        self._jobs = deque(kept)
+
+    # Queue jobs, dropping those beyond max_pending, and start the worker if needed.
+    def _submit(self, jobs):
+        with self._lock:
+            for job in jobs:
+                if len(self._jobs) >= self.max_pending:
+                    self.stats["dropped"] += 1
+                    continue
+                self._jobs.append(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="prefetch", daemon=True)
+                self._worker.start()
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._jobs:
+                    self._changed.wait()
+                kind, work, rel_path = self._jobs.popleft()
+                cancel = threading.Event()
+                self._running = (work, cancel)
+                if kind == "tests":
+                    self._test_runs[work] = "running"
+            try:
+                if kind == "read":
+                    self._warm_read(work, rel_path)
+                else:
+                    self._pre_run_tests(work, cancel)
+            except Exception:
+                # speculation never fails the session; the model's own call reports the error
+                pass
+            finally:
+                with self._lock:
+                    self._running = None
+                    self._changed.notify_all()
+
+    # Read a file into the tool result cache under the key of the model's get_file_content call.
+    def _warm_read(self, work, rel_path):
+        from functions.get_file_content import get_file_content
+        function_args = {"working_directory": work, "file_path": rel_path}
+        key = tool_cache.make_key("get_file_content", function_args)
+        path = tool_cache.target_path(function_args)
+        signature = tool_cache.file_signature(path)
+        if signature is None or TOOL_CACHE.contains(key, signature):
+            with self._lock:
+                self.stats["reads_skipped"] += 1
+            return
+        with TRACER.span("prefetch.read", "prefetch", path=rel_path):
+            result = get_file_content(**function_args)
+        if result.startswith("Error"):
+            return
+        TOOL_CACHE.put(key, signature, path, result)
+        with self._lock:
+            self._warmed.add(key)
+            self.stats["reads_warmed"] += 1
+
+    # Run the workspace's affected tests so their results are cached for run_tests.
+    def _pre_run_tests(self, work, cancel):
+        from functions import search_index
+        from functions.output_capture import RunCancelled
+        from functions.test_runner import run_affected
+        from workspaces import prepare_for_code
+        prepare_for_code(work)
+        try:
+            with TRACER.span("prefetch.tests", "prefetch") as span:
+                _, span["ran"], span["cached"] = run_affected(work, workers=config.PREFETCH_TEST_WORKERS, cancel=cancel,
+                                                              low_priority=True, prerun=True)
+        except RunCancelled:
+            return
+        finally:
+            # the tests may have changed files; only results of those are dropped, so the
+            # reads warmed for this workspace survive
+            TOOL_CACHE.invalidate_changed(work)
+            search_index.notify_workspace_changed(work)
+        with self._lock:
+            self.stats["tests_run"] += 1
+            if self._test_runs.get(work) == "running":
+                self._test_runs[work] = "done"
+
+    # One-line summary of the stats: how much was prefetched and how much of it was used.
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        hit_rate = stats["reads_used"] / stats["reads_warmed"] * 100 if stats["reads_warmed"] else 0.0
+        return (
+            f"Prefetch: {stats['reads_warmed']} files warmed, {stats['reads_used']} used ({hit_rate:.0f}% hit rate), "
+            f"{stats['reads_skipped']} already cached; {stats['tests_run']} test pre-runs, {stats['tests_used']} used; "
+            f"{stats['canceled']} jobs canceled, {stats['dropped']} dropped"
+        )
+
+# Prefetcher shared by every session in this process.
+PREFETCHER = Prefetcher()
@@ -0,0 +1,279 @@
+import ast
+import re
+import config
+
+# Fits every tool result into a token budget before it is sent to the model (see call_function).
+# The budget is a share (config.TOOL_RESULT_BUDGET_SHARE) of what is left of the session's
+# history token budget, counting the results already handed out in the same turn, and is kept
+# between config.TOOL_RESULT_MIN_TOKENS and config.TOOL_RESULT_MAX_TOKENS. Early in a session
+# results get plenty of room; late in a long session they shrink instead of pushing earlier
+# messages out of the window through compaction.
+# A result over its budget is cut in a way that suits the tool:
+#   get_file_content   Python source keeps its outline (imports, class and def lines with the
+#                      first docstring line), then as much of the top as fits; other text keeps
+#                      its head and tail. Elided line ranges say which start_line/end_line to read.
+#   run_python_file,   logs keep their head, their tail and the error lines in between
+#   run_tests
+#   get_files_info     listings keep their first entries and count the rest per directory,
+#                      with the cursor to continue from
+#   search_files       keeps whole match groups and counts the remaining matches per file
+#   anything else      keeps the head and the tail
+# Every cut is marked with what was elided, so the model can ask for exactly that part.
+
+# lines of a log worth keeping from the part that doesn't fit
+_LOG_KEEP = re.compile(r"Traceback|Error|Exception|FAIL|assert|^\s*File \"", re.IGNORECASE)
+
+# header get_file_content puts before a line range
+_LINES_HEADER = re.compile(r'^\[Lines (\d+)-(\d+) of (\d+) in "[^"]*"\]\n')
+
+# a matching line in search_files output: path:line number: text
+_SEARCH_MATCH = re.compile(r"^(.+?):(\d+): ")
+
+# rough size of an elision marker, reserved in the budget for every cut
+_MARKER_CHARS = 70
+
+# Return the token budget for the next tool result of a session (see ToolContext).
+def result_budget(context):
+    remaining = context.token_budget - context.prompt_tokens - context.result_tokens
+    return max(config.TOOL_RESULT_MIN_TOKENS, min(config.TOOL_RESULT_MAX_TOKENS, int(remaining * config.TOOL_RESULT_BUDGET_SHARE)))
+
+# Cut a result to the session's current budget and count it against the rest of the turn.
+# Returns the result and the number of characters elided.
+def shape_for_context(function_name, function_args, result, context):
+    shaped, elided = shape_result(function_name, function_args, result, result_budget(context))
+    context.add_result_tokens(len(shaped) // config.CHARS_PER_TOKEN)
+    return shaped, elided
+
+# Return the result cut to budget_tokens and the number of characters elided.
+def shape_result(function_name, function_args, result, budget_tokens):
+    budget = budget_tokens * config.CHARS_PER_TOKEN
+    if len(result) <= budget:
+        return result, 0
+
+    if function_name == "get_file_content":
+        shaped = _shape_file_content(function_args, result, budget)
+    elif function_name in ("run_python_file", "run_tests"):
+        shaped = _shape_log(result, budget)
+    elif function_name == "get_files_info":
+        shaped = _shape_listing(result, budget)
+    elif function_name == "search_files":
+        shaped = _shape_search(result, budget)
+    else:
+        shaped = _shape_head_tail(result, budget)
+    return shaped, max(0, len(result) - len(shaped))
+
+def _head_tail_marker(elided_chars):
+    return f"\n[... {elided_chars} characters elided to fit the context ...]\n"
+
+# Keep the first two thirds of the budget from the head and the rest from the tail.
+def _shape_head_tail(text, budget):
+    budget = max(0, budget - _MARKER_CHARS)
+    head = budget * 2 // 3
+    tail = budget - head
+    return text[:head] + _head_tail_marker(len(text) - head - tail) + (text[-tail:] if tail else "")
+
+# Read hint for an elided range of a file's lines.
+def _range_marker(first, last):
+    return f"[... lines {first}-{last} elided; read them with start_line={first}, end_line={last} ...]\n"
+
+# Join the kept lines of a file, replacing every run of elided lines with a read hint.
+# first_line is the line number of lines[0].
+def _render_kept(lines, kept, first_line):
+    out = []
+    gap_start = None
+    for index, line in enumerate(lines):
+        if index in kept:
+            if gap_start is not None:
+                out.append(_range_marker(first_line + gap_start, first_line + index - 1))
+                gap_start = None
+            out.append(line if line.endswith("\n") else line + "\n")
+        elif gap_start is None:
+            gap_start = index
+    if gap_start is not None:
+        out.append(_range_marker(first_line + gap_start, first_line + len(lines) - 1))
+    return "".join(out)
+
+# Indexes of the lines that make up a Python file's outline, in order of importance:
+# imports and module-level names, then class and def lines (with decorators and every line of
+# the signature) and the first line of their docstrings. Returns None if the text doesn't parse,
+# e.g. because it is only part of a file.
+def _outline(text):
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    module_lines, definition_lines = [], []
+
+    def visit(nodes, top_level):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                first = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                body_start = node.body[0].lineno
+                definition_lines.extend(range(first - 1, max(first, body_start - 1)))
+                docstring = node.body[0]
+                if isinstance(docstring, ast.Expr) and isinstance(docstring.value, ast.Constant) and isinstance(docstring.value.value, str):
+                    definition_lines.append(docstring.lineno - 1)
+                visit(node.body, False)
+            elif top_level and node.lineno == node.end_lineno:
+                module_lines.append(node.lineno - 1)
+    visit(tree.body, True)
+    return module_lines + definition_lines
+
+# Cut a file read to budget, keeping the outline of Python source and the head and tail of
+# anything else, with read hints for every elided line range.
+def _shape_file_content(function_args, result, budget):
+    file_path = function_args.get("file_path", "")
+    header = ""
+    first_line = 1
+    match = _LINES_HEADER.match(result)
+    if match:
+        header = match.group(0)
+        first_line = int(match.group(1))
+    elif result.startswith("[Bytes "):
+        return _shape_head_tail(result, budget) + "[Request a smaller byte range to read the elided part.]"
+    body = result[len(header):]
+    lines = body.splitlines(keepends=True)
+    budget -= len(header)
+
+    # lines are kept in this order while they fit. The first `optional` of them (the outline) are
+    # each kept if they fit; after that, the first line that doesn't fit ends the result, so the
+    # rest of the kept text is contiguous
+    order = _outline(body) if file_path.endswith(".py") else None
+    optional = 0
+    if order is None:
+        # head and tail: two thirds of the lines that fit from the top, the rest from the bottom
+        order = []
+        head, tail = 0, len(lines) - 1
+        while head <= tail:
+            order.append(head)
+            head += 1
+            if len(order) % 3 == 0 and head <= tail:
+                order.append(tail)
+                tail -= 1
+    else:
+        # after the outline, as much of the file from the top as fits
+        outlined = set(order)
+        optional = len(order)
+        order += [index for index in range(len(lines)) if index not in outlined]
+
+    kept = set()
+    used = 0
+    for position, index in enumerate(order):
+        if index in kept:
+            continue
+        cost = len(lines[index]) + (_MARKER_CHARS if index - 1 not in kept else 0)
+        if used + cost > budget:
+            if position < optional:
+                continue
+            break
+        kept.add(index)
+        used += cost
+    if not kept:
+        # not even one line fits, e.g. minified code
+        return header + _shape_head_tail(body, budget)
+    return header + _render_kept(lines, kept, first_line)
+
+# Cut a log to budget: its head, its tail (where tracebacks and summaries end up), and the
+# error lines from the middle.
+def _shape_log(text, budget):
+    lines = text.splitlines(keepends=True)
+    budget = max(0, budget - 2 * _MARKER_CHARS)
+    head_budget, tail_budget = budget // 4, budget // 2
+
+    head_end, used = 0, 0
+    while head_end < len(lines) and used + len(lines[head_end]) <= head_budget:
+        used += len(lines[head_end])
+        head_end += 1
+    tail_start, used = len(lines), 0
+    while tail_start > head_end and used + len(lines[tail_start - 1]) <= tail_budget:
+        tail_start -= 1
+        used += len(lines[tail_start])
+
+    kept_middle = []
+    middle_budget = budget - sum(len(line) for line in lines[:head_end]) - used
+    for index in range(head_end, tail_start):
+        if not _LOG_KEEP.search(lines[index]):
+            continue
+        # a line right after another kept line doesn't need a marker of its own
+        cost = len(lines[index]) + (0 if kept_middle and kept_middle[-1] == index - 1 else _MARKER_CHARS)
+        if cost <= middle_budget:
+            kept_middle.append(index)
+            middle_budget -= cost
+
+    out = lines[:head_end]
+    previous = head_end - 1
+    for index in kept_middle + [tail_start]:
+        if index - previous > 1:
+            elided = lines[previous + 1:index]
+            out.append(f"[... {len(elided)} lines ({sum(len(line) for line in elided)} characters) of output elided to fit the context ...]\n")
+        if index < tail_start:
+            out.append(lines[index])
+        previous = index
+    out.extend(lines[tail_start:])
+    return "".join(out)
+
+# Cut a get_files_info listing to budget: the first entries, then how many entries were left
+# out per top-level directory and the cursor to continue from. If the listing was already cut
+# off with a cursor, that trailer is dropped: continuing from it would skip the elided entries.
+def _shape_listing(text, budget):
+    lines = text.splitlines()
+    trailer = lines.pop() if lines and lines[-1].startswith("[") else None
+    cut_off = trailer is not None and trailer.startswith("[Listing cut off")
+    if cut_off:
+        trailer = None
+    budget -= 2 * _MARKER_CHARS + (len(trailer) if trailer else 0)
+
+    kept, used = [], 0
+    for line in lines:
+        if used + len(line) + 1 > budget:
+            break
+        kept.append(line)
+        used += len(line) + 1
+    rest = lines[len(kept):]
+
+    counts = {}
+    for line in rest:
+        path = line[2:].split(": file_size=")[0]
+        top = path.split("/")[0] + "/" if "/" in path else "."
+        counts[top] = counts.get(top, 0) + 1
+    summary = ", ".join(f"{top} {count}" for top, count in sorted(counts.items(), key=lambda item: -item[1])[:10])
+    last_path = kept[-1][2:].split(": file_size=")[0] if kept else None
+    hint = f' Call again with cursor="{last_path}" to continue, or list a directory or pattern.' if last_path else " List a directory or use pattern."
+    more = " and more after them" if cut_off else ""
+    kept.append(f"[... {len(rest)} more entries elided to fit the context ({summary}){more}.{hint}]")
+    if trailer:
+        kept.append(trailer)
+    return "\n".join(kept)
+
+# Cut search_files output to budget: whole match groups, then how many matches were left out
+# in which files.
+def _shape_search(text, budget):
+    groups = text.split("\n--\n")
+    last_lines = groups[-1].rsplit("\n", 1)
+    trailer = None
+    if len(last_lines) == 2 and last_lines[1].startswith("["):
+        groups[-1], trailer = last_lines
+    budget -= 2 * _MARKER_CHARS + (len(trailer) if trailer else 0)
+
+    kept, used = [], 0
+    for group in groups:
+        if used + len(group) + 4 > budget:
+            break
+        kept.append(group)
+        used += len(group) + 4
+    if not kept:
+        return _shape_head_tail(text, budget)
+
+    counts = {}
+    for group in groups[len(kept):]:
+        for line in group.splitlines():
+            match = _SEARCH_MATCH.match(line)
+            if match:
+                counts[match.group(1)] = counts.get(match.group(1), 0) + 1
+    elided = sum(counts.values())
+    files = ", ".join(f"{path} ({count})" for path, count in sorted(counts.items(), key=lambda item: -item[1])[:10])
+    result = "\n--\n".join(kept)
+    result += f"\n[... {elided} more matches elided to fit the context: {files}. Narrow the query or use file_pattern to see them.]"
+    if trailer:
+        result += "\n" + trailer
+    return result
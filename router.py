@@ -0,0 +1,131 @@
+import threading
+import config
+from tracing import percentile
+
+# Picks the model for each generation iteration of a session (see config.MODEL_ROUTES).
+#   plan       the first iteration of a prompt, which decides how to go about it
+#   tool_step  an iteration that follows tool results: usually just choosing the next tool call
+#   escalated  used instead of the above for a few iterations after a tool call or a model
+#              request failed, and whenever the request is large
+# When config.ROUTE_FINAL_ANSWER_MODEL is set and a different model gave the final answer, that
+# answer is dropped and the final answer model is asked again with the same history.
+# Every request's latency and token counts are recorded per model, so the routes can be tuned.
+
+# Routing state of one prompt: how many iterations stay escalated and why.
+class Route:
+    def __init__(self):
+        self.iteration = 0
+        self.escalated_for = 0
+        self.reason = None
+        self.final_review_done = False
+
+class ModelRouter:
+    def __init__(self, routes=None, escalate_context_tokens=config.ROUTE_ESCALATE_CONTEXT_TOKENS,
+                 escalate_iterations=config.ROUTE_ESCALATE_ITERATIONS, final_answer_model=config.ROUTE_FINAL_ANSWER_MODEL):
+        self.routes = routes or config.MODEL_ROUTES
+        self.escalate_context_tokens = escalate_context_tokens
+        self.escalate_iterations = escalate_iterations
+        self.final_answer_model = final_answer_model
+        self._lock = threading.Lock()
+        # model -> {"requests", "errors", "seconds": [...], "prompt_tokens", "response_tokens", "routes": {route: count}}
+        self.stats = {}
+
+    # Return (model, route name) for the next iteration of a prompt.
+    def choose(self, route, estimated_prompt_tokens):
+        route.iteration += 1
+        if route.escalated_for > 0:
+            route.escalated_for -= 1
+            name = "escalated"
+        elif self.escalate_context_tokens and estimated_prompt_tokens > self.escalate_context_tokens:
+            name = "escalated"
+            route.reason = "large context"
+        elif route.iteration == 1:
+            name = "plan"
+        else:
+            name = "tool_step"
+        return self.routes[name], name
+
+    # Use the escalated model for the next escalate_iterations iterations.
+    def escalate(self, route, reason):
+        route.escalated_for = self.escalate_iterations
+        route.reason = reason
+
+    # Call after a model request raised: returns True if the iteration should be tried again on
+    # the escalated model, which is only worth it if a different model failed.
+    def retry_on_error(self, route, model):
+        with self._lock:
+            self._stats_for(model)["errors"] += 1
+        if model == self.routes["escalated"]:
+            return False
+        self.escalate(route, "model error")
+        return True
+
+    # Call with the tool results of an iteration; failed tool calls escalate the next iterations.
+    # Returns the number of failed calls.
+    def after_tools(self, route, function_call_results):
+        failures = count_failures(function_call_results)
+        if failures:
+            self.escalate(route, f"{failures} failed tool call{'s' if failures != 1 else ''}")
+        return failures
+
+    # Return the model that should re-answer a final answer given by `model`, or None to keep it.
+    # A prompt's final answer is only reviewed once.
+    def final_answer_review(self, route, model):
+        if not self.final_answer_model or model == self.final_answer_model or route.final_review_done:
+            return None
+        route.final_review_done = True
+        route.escalated_for = 1
+        return self.final_answer_model
+
+    # Record one model request.
+    def record(self, model, route_name, seconds, usage_metadata):
+        with self._lock:
+            stats = self._stats_for(model)
+            stats["requests"] += 1
+            stats["seconds"].append(seconds)
+            stats["routes"][route_name] = stats["routes"].get(route_name, 0) + 1
+            if usage_metadata:
+                stats["prompt_tokens"] += usage_metadata.prompt_token_count or 0
+                stats["response_tokens"] += usage_metadata.candidates_token_count or 0
+
+    def _stats_for(self, model):
+        return self.stats.setdefault(model, {"requests": 0, "errors": 0, "seconds": [], "prompt_tokens": 0, "response_tokens": 0, "routes": {}})
+
+    # Estimated cost in dollars of the requests recorded for a model (see config.MODEL_PRICES).
+    def cost(self, model):
+        stats = self.stats.get(model)
+        prices = config.MODEL_PRICES.get(model)
+        if not stats or not prices:
+            return 0.0
+        return (stats["prompt_tokens"] * prices[0] + stats["response_tokens"] * prices[1]) / 1_000_000
+
+    # Per-model table of requests, latency, tokens and estimated cost.
+    def summary(self):
+        with self._lock:
+            models = {model: dict(stats, seconds=sorted(stats["seconds"])) for model, stats in self.stats.items()}
+        if not models:
+            return "No model requests recorded."
+        lines = [f"{'model':<30}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'prompt tok':>12}{'resp tok':>10}{'cost $':>10}  routes"]
+        for model, stats in sorted(models.items()):
+            routes = ", ".join(f"{name} {count}" for name, count in sorted(stats["routes"].items()))
+            lines.append(
+                f"{model:<30}{stats['requests']:>9}{stats['errors']:>8}"
+                f"{percentile(stats['seconds'], 50) * 1000:>9.0f}{percentile(stats['seconds'], 95) * 1000:>9.0f}"
+                f"{stats['prompt_tokens']:>12}{stats['response_tokens']:>10}{self.cost(model):>10.4f}  {routes}"
+            )
+        return "\n".join(lines)
+
+# Number of function responses in a tool results message that report an error.
+def count_failures(function_call_results):
+    failures = 0
+    for part in function_call_results.parts or []:
+        response = part.function_response.response if part.function_response else None
+        if not response:
+            continue
+        result = response.get("result")
+        if "error" in response or (isinstance(result, str) and result.startswith("Error")):
+            failures += 1
+    return failures
+
+# Router shared by every session in the process.
+ROUTER = ModelRouter()
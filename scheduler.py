@@ -0,0 +1,280 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+import httpx
+from google.genai import errors
+import config
+from history import content_chars
+from tracing import TRACER
+
+# Client-side request scheduler for the model API.
+# ScheduledBackend wraps another backend (see backends.py) and sends every request through a
+# RequestScheduler, which
+#   - keeps requests within the model's requests-per-minute and tokens-per-minute quotas with
+#     two token buckets; the tokens a request will use are estimated from its size and corrected
+#     with the response's usage_metadata,
+#   - lets waiting requests go in priority order, so interactive sessions overtake batch ones,
+#   - retries 429s, 5xx responses and network errors with jittered exponential backoff (or the
+#     delay the server asks for), and after a 429 holds back every queued request for that long,
+# so quota pressure slows sessions down instead of failing them, and throughput stays at the quota.
+
+# request priorities; lower goes first
+INTERACTIVE = 0
+BATCH = 1
+
+# priority of the requests made in the current asyncio task (run_batch sets BATCH)
+REQUEST_PRIORITY = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+# HTTP status codes worth retrying: quota exhausted, and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Refills continuously at per_minute units per minute and holds at most burst_seconds worth
+# (a minute's worth by default, since quotas are counted per minute).
+# The level may go below zero when a request turns out to have used more than was reserved;
+# later requests then wait until the debt is paid off.
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=60):
+        self.per_second = per_minute / 60
+        self.capacity = self.per_second * burst_seconds
+        self.level = float(self.capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.per_second)
+        self._updated = now
+
+    # Return the seconds until `amount` can be taken (0 if it can be taken now).
+    # A request larger than the whole bucket only waits for a full bucket.
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.per_second
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    # Put back (a positive amount) or take more (a negative amount) after the fact.
+    def adjust(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+    # Empty the bucket, e.g. after a 429 showed the server's view of the quota is tighter.
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+class RequestScheduler:
+    def __init__(self, requests_per_minute=config.MODEL_REQUESTS_PER_MINUTE, tokens_per_minute=config.MODEL_TOKENS_PER_MINUTE, burst_seconds=60):
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        # waiting requests as a heap of (priority, arrival number)
+        self._waiting = []
+        self._arrivals = itertools.count()
+        # every request waits until this time.monotonic() value, set after a 429
+        self._paused_until = 0.0
+        # set and replaced whenever the queue changes, to wake the waiting requests
+        self._changed = None
+        self._loop = None
+        self.stats = {
+            "requests": 0, "queued": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0,
+            "retries": 0, "retry_seconds": 0.0, "errors": {}, "failed": 0, "tokens": 0,
+        }
+
+    # The event the waiting requests sleep on. asyncio objects belong to one event loop, and a
+    # scheduler may outlive one (e.g. one asyncio.run per benchmark session).
+    def _event(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _wake(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    # Wait until a request of about `tokens` tokens may be sent: it is the first in line, the
+    # scheduler isn't paused after a 429, and both buckets have room. Reserves the request and
+    # its tokens and returns the seconds spent waiting.
+    async def acquire(self, tokens, priority=INTERACTIVE):
+        entry = (priority, next(self._arrivals))
+        heapq.heappush(self._waiting, entry)
+        start = time.monotonic()
+        queued = False
+        try:
+            while True:
+                event = self._event()
+                timeout = None
+                if self._waiting[0] == entry:
+                    now = time.monotonic()
+                    timeout = max(
+                        self._paused_until - now,
+                        self.requests.wait_time(1, now) if self.requests else 0.0,
+                        self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+                    )
+                    if timeout <= 0:
+                        break
+                queued = True
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except TimeoutError:
+                    pass
+        except BaseException:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._wake()
+            raise
+
+        heapq.heappop(self._waiting)
+        now = time.monotonic()
+        if self.requests:
+            self.requests.take(1, now)
+        if self.tokens:
+            self.tokens.take(tokens, now)
+        self._wake()
+
+        waited = now - start
+        self.stats["requests"] += 1
+        if queued:
+            self.stats["queued"] += 1
+            self.stats["queue_seconds"] += waited
+            self.stats["max_queue_seconds"] = max(self.stats["max_queue_seconds"], waited)
+        return waited
+
+    # Correct the token bucket once a request's real usage is known. usage_metadata may be None
+    # (e.g. the request failed), in which case the reserved tokens are given back.
+    def record_usage(self, reserved_tokens, usage_metadata):
+        used = 0
+        if usage_metadata:
+            used = usage_metadata.total_token_count or (
+                (usage_metadata.prompt_token_count or 0) + (usage_metadata.candidates_token_count or 0))
+        if self.tokens:
+            self.tokens.adjust(reserved_tokens - used)
+        self.stats["tokens"] += used
+
+    # Hold back every request for `seconds` after the server said the quota is exhausted.
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self.requests:
+            self.requests.drain()
+
+    def record_retry(self, code, delay):
+        self.stats["retries"] += 1
+        self.stats["retry_seconds"] += delay
+        self.stats["errors"][code] = self.stats["errors"].get(code, 0) + 1
+
+# One-line summary of a scheduler's stats, for --verbose and batch runs.
+def format_stats(stats):
+    errors_text = ", ".join(f"{code}: {count}" for code, count in sorted(stats["errors"].items(), key=str)) or "none"
+    return (
+        f"Scheduler: {stats['requests']} requests, {stats['queued']} queued "
+        f"({stats['queue_seconds']:.1f} s total, {stats['max_queue_seconds']:.1f} s max), "
+        f"{stats['retries']} retries ({stats['retry_seconds']:.1f} s backoff; errors {errors_text}), "
+        f"{stats['failed']} failed, {stats['tokens']} tokens"
+    )
+
+# Return the seconds the server asked to wait before retrying, or None if it didn't say.
+# Gemini puts it in a RetryInfo detail ("retryDelay": "34s"); other servers use Retry-After.
+def _server_delay(error):
+    details = error.details if isinstance(getattr(error, "details", None), dict) else {}
+    for detail in (details.get("error") or {}).get("details") or []:
+        if isinstance(detail, dict) and isinstance(detail.get("retryDelay"), str):
+            try:
+                return float(detail["retryDelay"].rstrip("s"))
+            except ValueError:
+                pass
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers and headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return None
+
+# Return the status code of a retryable error ("network" for connection problems), or None.
+def _retryable_code(error):
+    if isinstance(error, errors.APIError) and error.code in RETRY_STATUS_CODES:
+        return error.code
+    if isinstance(error, httpx.TransportError):
+        return "network"
+    return None
+
+# Sends another backend's requests through a RequestScheduler and retries the ones that fail
+# with a retryable error. A streamed request is only retried if it failed before its first chunk.
+class ScheduledBackend:
+    def __init__(self, inner, scheduler=None, max_retries=config.MODEL_MAX_RETRIES):
+        self.inner = inner
+        self.scheduler = scheduler or RequestScheduler()
+        self.max_retries = max_retries
+
+    # Rough token count of a request: its contents plus the system prompt, in characters per token.
+    def _estimate_tokens(self, contents):
+        return (sum(content_chars(content) for content in contents) + len(config.SYSTEM_PROMPT)) // config.CHARS_PER_TOKEN
+
+    # Return how long to wait before retrying after `error`, or None if it should be raised.
+    async def _backoff(self, error, attempt):
+        code = _retryable_code(error)
+        if code is None or attempt >= self.max_retries:
+            self.scheduler.stats["failed"] += 1
+            return None
+        delay = _server_delay(error)
+        if delay is None:
+            # full jitter: anywhere up to the exponential backoff, so retries don't arrive in waves
+            delay = random.uniform(0, min(config.MODEL_RETRY_MAX_SECONDS, config.MODEL_RETRY_BASE_SECONDS * 2 ** attempt))
+        if code == 429:
+            self.scheduler.pause(delay)
+        self.scheduler.record_retry(code, delay)
+        with TRACER.span("model.retry_wait", "scheduler", code=code, attempt=attempt + 1, delay_s=delay):
+            await asyncio.sleep(delay)
+        return delay
+
+    async def _acquire(self, tokens):
+        with TRACER.span("model.queue", "scheduler", tokens=tokens) as span:
+            span["waited_ms"] = await self.scheduler.acquire(tokens, REQUEST_PRIORITY.get()) * 1000
+
+    async def generate(self, model, contents, config):
+        tokens = self._estimate_tokens(contents)
+        attempt = 0
+        while True:
+            await self._acquire(tokens)
+            try:
+                response = await self.inner.generate(model, contents, config)
+            except Exception as e:
+                self.scheduler.record_usage(tokens, None)
+                if await self._backoff(e, attempt) is None:
+                    raise
+                attempt += 1
+                continue
+            self.scheduler.record_usage(tokens, response.usage_metadata)
+            return response
+
+    async def generate_stream(self, model, contents, config):
+        tokens = self._estimate_tokens(contents)
+        attempt = 0
+        while True:
+            await self._acquire(tokens)
+            usage_metadata = None
+            started = False
+            try:
+                async for chunk in self.inner.generate_stream(model, contents, config):
+                    started = True
+                    if chunk.usage_metadata:
+                        usage_metadata = chunk.usage_metadata
+                    yield chunk
+            except Exception as e:
+                self.scheduler.record_usage(tokens, usage_metadata)
+                if started:
+                    # part of the response has already been handed out, so it can't be sent again
+                    self.scheduler.stats["failed"] += 1
+                    raise
+                if await self._backoff(e, attempt) is None:
+                    raise
+                attempt += 1
+                continue
+            self.scheduler.record_usage(tokens, usage_metadata)
+            return
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import config
+from functions.write_file import atomic_write
+
+# On-disk store for conversations, so a session can be continued later with --resume.
+#
+# Every session is one append-only log, config.SESSIONS_DIR/<session id>.log, made of
+# length-prefixed records: a 4-byte big-endian length followed by that many bytes of JSON.
+#   {"type": "meta", "session_id", "working_directory", "created"}   first record
+#   {"type": "message", "turn": N, "content": {...}}                  one per history message
+#   {"type": "truncate", "count": N}                                  drop messages after the first N
+# A record cut short by a crash is ignored when the log is read.
+# Listing sessions only reads the logs; the genai SDK is imported once a history is loaded.
+#
+# Tool outputs and function call arguments (e.g. write_file's content) of at least
+# config.SESSION_BLOB_MIN_CHARS characters are stored once by content hash in
+# config.SESSIONS_DIR/blobs and referenced from the message as
+# {"$blob": sha256, "chars": length, "preview": first characters}, so the same file read in
+# many turns or sessions takes up disk space once.
+#
+# Resuming reads the log but not the blobs of older turns: if the whole conversation would go
+# over the history token budget, large outputs from before the most recent turns come back
+# already compacted (from the preview stored in the message), exactly as ConversationHistory
+# would have compacted them. Tool calls are never run again.
+
+_LENGTH = struct.Struct(">I")
+
+# session ids are used as file names
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+class SessionError(Exception):
+    pass
+
+def _sessions_dir():
+    return os.path.expanduser(config.SESSIONS_DIR)
+
+# Raise SessionError unless session_id is safe to use as a file name (sessions and workspaces are stored by id).
+def check_session_id(session_id):
+    if not _SESSION_ID.match(session_id) or session_id.startswith("."):
+        raise SessionError(f'Invalid session id "{session_id}": use letters, digits, "_", "-" and "."')
+
+def session_path(session_id):
+    check_session_id(session_id)
+    return os.path.join(_sessions_dir(), f"{session_id}.log")
+
+def _blob_path(digest):
+    return os.path.join(_sessions_dir(), "blobs", digest[:2], digest)
+
+# Appends the records of one session to its log.
+class SessionLog:
+    def __init__(self, session_id, working_directory=config.WORKING_DIRECTORY):
+        self.session_id = session_id
+        self.path = session_path(session_id)
+        self._lock = threading.Lock()
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._append({"type": "meta", "session_id": session_id, "working_directory": working_directory, "created": time.time()})
+        else:
+            # cut off a record left unfinished by a crash, or everything appended after it would be lost
+            end = _complete_length(self.path)
+            if end < os.path.getsize(self.path):
+                os.truncate(self.path, end)
+
+    def append_message(self, content, turn):
+        data = content.model_dump(mode="json", exclude_none=True)
+        for part in data.get("parts", []):
+            for holder in (part.get("function_response", {}).get("response"), part.get("function_call", {}).get("args")):
+                if not isinstance(holder, dict):
+                    continue
+                for key, value in holder.items():
+                    if isinstance(value, str) and len(value) >= config.SESSION_BLOB_MIN_CHARS:
+                        holder[key] = _store_blob(value)
+        self._append({"type": "message", "turn": turn, "content": data})
+
+    def append_truncate(self, count):
+        self._append({"type": "truncate", "count": count})
+
+    # Write one record. The length prefix and the payload go out in a single write, so a record
+    # is either complete or cut short at the end of the file, never interleaved with another.
+    def _append(self, record):
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(_LENGTH.pack(len(payload)) + payload)
+
+# Store a large string once under its content hash and return the reference to it.
+def _store_blob(value):
+    digest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+    path = _blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, value)
+    return {"$blob": digest, "chars": len(value), "preview": value[:config.HISTORY_ELIDED_PREVIEW_CHARS]}
+
+def _is_blob(value):
+    return isinstance(value, dict) and "$blob" in value
+
+def _load_blob(ref):
+    try:
+        with open(_blob_path(ref["$blob"]), "r", encoding="utf-8", newline="") as f:
+            return f.read()
+    except FileNotFoundError:
+        raise SessionError(f"Session blob {ref['$blob']} is missing")
+
+# Yield the records of a log in order, stopping at a record cut short by a crash.
+def read_records(path):
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield json.loads(payload)
+
+# Return the length of the part of a log that holds complete records.
+def _complete_length(path):
+    end = 0
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return end
+            (length,) = _LENGTH.unpack(header)
+            if end + _LENGTH.size + length > size:
+                return end
+            end += _LENGTH.size + length
+            f.seek(end)
+
+# Return the (turn, content data) of every message in a log after applying truncate records,
+# cut back to the last finished answer: a model message without function calls. Anything after
+# it (a prompt that was never answered, or an answer that failed halfway and left a function
+# call without its response) would be rejected by the model.
+def _read_messages(path):
+    messages = []
+    for record in read_records(path):
+        if record["type"] == "message":
+            messages.append((record["turn"], record["content"]))
+        elif record["type"] == "truncate":
+            del messages[record["count"]:]
+
+    finished = 0
+    for index, (_, data) in enumerate(messages):
+        parts = data.get("parts", [])
+        if data.get("role") == "model" and not any("function_call" in part for part in parts):
+            finished = index + 1
+    return messages, finished
+
+# Replace the blob references in a message with their contents, or, when elide is True, with the
+# compacted text ConversationHistory would have used for them.
+def _materialize(data, turn, elide):
+    from google.genai import types
+    from history import elision
+    for part in data.get("parts", []):
+        for kind, field in (("function_response", "response"), ("function_call", "args")):
+            holder = part.get(kind, {}).get(field)
+            if not isinstance(holder, dict):
+                continue
+            name = part[kind].get("name")
+            for key, value in holder.items():
+                if not _is_blob(value):
+                    continue
+                if elide:
+                    description = f"{name} output" if kind == "function_response" else f"the {key} argument to {name}"
+                    holder[key] = elision(value["preview"], value["chars"], description, turn)
+                else:
+                    holder[key] = _load_blob(value)
+    return types.Content.model_validate(data)
+
+# Number of characters a message will have once its blobs are loaded.
+def _full_chars(data):
+    total = 0
+    for part in data.get("parts", []):
+        total += len(part.get("text", ""))
+        for holder in (part.get("function_response", {}).get("response"), part.get("function_call", {}).get("args")):
+            if isinstance(holder, dict):
+                total += sum(value["chars"] if _is_blob(value) else len(str(value)) for value in holder.values())
+    return total
+
+# Start the history of a new session that is written to the store as it grows.
+def new_history(session_id, token_budget=config.HISTORY_TOKEN_BUDGET, working_directory=config.WORKING_DIRECTORY):
+    from history import ConversationHistory
+    history = ConversationHistory(token_budget=token_budget)
+    history.log = SessionLog(session_id, working_directory=working_directory)
+    return history
+
+# Load a saved session's history so it can be continued; new messages are appended to its log.
+# Raises SessionError if there is no such session.
+def load_history(session_id, token_budget=config.HISTORY_TOKEN_BUDGET, keep_recent_turns=config.HISTORY_KEEP_RECENT_TURNS):
+    path = session_path(session_id)
+    if not os.path.exists(path):
+        raise SessionError(f"No saved session {session_id}")
+    messages, finished = _read_messages(path)
+
+    from history import ConversationHistory
+    history = ConversationHistory(token_budget=token_budget, keep_recent_turns=keep_recent_turns)
+    kept = messages[:finished]
+    if kept:
+        # the first iteration of the next prompt keeps messages from these turns on word for word
+        last_turn = kept[-1][0]
+        recent_from = last_turn + 1 - keep_recent_turns
+        over_budget = sum(_full_chars(data) for _, data in kept) // config.CHARS_PER_TOKEN > token_budget
+        for turn, data in kept:
+            history.add(_materialize(data, turn, over_budget and turn < recent_from), turn)
+
+    # forget whatever came after the last finished answer, in the log too
+    history.log = SessionLog(session_id)
+    if finished < len(messages):
+        history.log.append_truncate(finished)
+    return history
+
+# Return a summary of every saved session, most recently used first: its id, the first prompt,
+# the number of messages and when it was last written to.
+def list_sessions():
+    directory = _sessions_dir()
+    if not os.path.isdir(directory):
+        return []
+    sessions = []
+    for name in os.listdir(directory):
+        if not name.endswith(".log"):
+            continue
+        path = os.path.join(directory, name)
+        messages, _ = _read_messages(path)
+        first_prompt = next((part.get("text") for _, data in messages[:1] for part in data.get("parts", []) if part.get("text")), None)
+        sessions.append({
+            "session_id": name[:-len(".log")],
+            "prompt": first_prompt,
+            "messages": len(messages),
+            "modified": os.path.getmtime(path),
+        })
+    sessions.sort(key=lambda session: session["modified"], reverse=True)
+    return sessions
@@ -0,0 +1,45 @@
+import re
+import subprocess
+import sys
+import time
+
+# Import time profiling for the CLI (python main.py --profile-startup, benchmarks/bench_startup.py).
+# The code to profile runs in a fresh interpreter started with -X importtime, so every module is
+# imported for the first time, exactly as on a cold start.
+
+# one line of -X importtime output: self and cumulative microseconds, then the indented module name
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# Run `code` in a fresh interpreter with -X importtime and return (entries, wall seconds).
+# entries is a list of (module, self µs, cumulative µs, depth) in the order the imports finished;
+# depth 0 are the imports made directly by the code.
+def profile_imports(code, cwd=None):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True, text=True)
+    wall_seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Profiled code failed: {completed.stderr.strip().splitlines()[-1:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries, wall_seconds
+
+# Format a profile as a short report: the totals, the slowest imports made directly by the
+# code (including everything they imported) and the slowest single modules.
+def format_report(entries, wall_seconds, top=15):
+    total_ms = sum(entry[1] for entry in entries) / 1000
+    lines = [f"Startup: {wall_seconds * 1000:.0f} ms wall, {total_ms:.0f} ms importing {len(entries)} modules"]
+
+    lines.append("\nSlowest top-level imports (including what they import):")
+    direct = sorted((entry for entry in entries if entry[3] == 0), key=lambda entry: entry[2], reverse=True)
+    for module, _, cumulative_us, _ in direct[:top]:
+        lines.append(f"{cumulative_us / 1000:>10.1f} ms  {module}")
+
+    lines.append("\nSlowest modules (own import time only):")
+    for module, self_us, _, _ in sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]:
+        lines.append(f"{self_us / 1000:>10.1f} ms  {module}")
+    return "\n".join(lines)
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import stat
+import threading
+from collections import OrderedDict
+import config
+
+# Argument names that hold a path relative to the working directory.
+PATH_ARGS = ("file_path", "directory")
+
+# Return the absolute path of the file or directory a tool call operates on.
+def target_path(function_args):
+    working_directory = function_args.get("working_directory", ".")
+    for name in PATH_ARGS:
+        if function_args.get(name):
+            return os.path.normpath(os.path.abspath(os.path.join(working_directory, function_args[name])))
+    return os.path.normpath(os.path.abspath(working_directory))
+
+# Build the cache key for a tool call: the tool name, the absolute working directory and the
+# arguments in a normalized form (sorted keys, normalized paths), so that e.g. "pkg/" and "./pkg"
+# share an entry.
+def make_key(function_name, function_args):
+    args = {}
+    for name, value in function_args.items():
+        if name == "working_directory":
+            continue
+        if name in PATH_ARGS and isinstance(value, str):
+            value = os.path.normpath(value)
+        args[name] = value
+    working_directory = os.path.normpath(os.path.abspath(function_args.get("working_directory", ".")))
+    return (function_name, working_directory, json.dumps(args, sort_keys=True, default=str))
+
+# Return True if a tool call can be served from the cache, i.e. its result only depends on its
+# target's signature. A recursive listing depends on every file below its directory, which a
+# signature doesn't cover, so it always runs.
+def is_cacheable(function_name, function_args):
+    if function_name not in config.CACHEABLE_TOOLS:
+        return False
+    return not (function_name == "get_files_info" and function_args.get("recursive"))
+
+# Return a signature of the target file or directory's current state (mtime and size).
+# If the file changes on disk, its signature changes and old cache entries stop matching.
+# A directory's own mtime only changes when entries are added or removed, so its signature also
+# covers the name, size and mtime of every entry directly inside it, which a listing shows.
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return (st.st_mtime_ns, st.st_size)
+    digest = hashlib.sha1()
+    try:
+        with os.scandir(path) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                try:
+                    entry_stat = entry.stat()
+                    digest.update(f"{entry.name}\0{entry_stat.st_size}\0{entry_stat.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+                except OSError:
+                    digest.update(f"{entry.name}\0\n".encode("utf-8", "surrogateescape"))
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, digest.hexdigest())
+
+# A thread-safe LRU cache of tool results.
+# Each entry stores the signature of the file it was computed from, the absolute target path
+# (used for invalidation) and the result itself.
+class ToolResultCache:
+    def __init__(self, max_entries=config.TOOL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Return the cached result for key if it was computed from a file with the same signature,
+    # otherwise None.
+    def get(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    # Return True if key holds a result computed from a file with this signature, without
+    # counting a hit or a miss (used by prefetch.py to skip results that are already cached).
+    def contains(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] == signature
+
+    # Count a hit that was answered without looking the entry up (e.g. a repeated read in a session).
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    # Store a result, dropping the least recently used entry if the cache is full.
+    def put(self, key, signature, path, result):
+        with self._lock:
+            self._entries[key] = (signature, path, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Drop every entry whose target is the given path or one of its parent directories
+    # (a directory listing shows the sizes of the files inside it).
+    def invalidate_path(self, path):
+        path = os.path.normpath(os.path.abspath(path))
+        with self._lock:
+            for key in list(self._entries):
+                entry_path = self._entries[key][1]
+                if entry_path == path or path.startswith(entry_path + os.sep):
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    # Drop the entries inside a working directory whose target changed since they were stored,
+    # e.g. after a test pre-run (see prefetch.py), which shouldn't throw away the reads warmed
+    # for the same session. Signatures are checked on every get anyway; this frees the entries.
+    def invalidate_changed(self, working_directory):
+        working_directory = os.path.normpath(os.path.abspath(working_directory))
+        with self._lock:
+            entries = [(key, entry[0], entry[1]) for key, entry in self._entries.items() if key[1] == working_directory]
+        stale = [key for key, signature, path in entries if file_signature(path) != signature]
+        with self._lock:
+            for key in stale:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    # Drop every entry inside a working directory, e.g. after running a script that may
+    # have changed any file in it.
+    def invalidate_workspace(self, working_directory):
+        working_directory = os.path.normpath(os.path.abspath(working_directory))
+        with self._lock:
+            for key in list(self._entries):
+                if key[1] == working_directory:
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    # Return the hit/miss counters as a dict.
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+# Cache shared by every session in this process.
+TOOL_CACHE = ToolResultCache()
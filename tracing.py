@@ -0,0 +1,122 @@
+import contextvars
+import math
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Span-style tracing for the agent loop.
+# A span covers one unit of work (a model call, a tool dispatch, a subprocess) and records
+# its duration plus any attributes the caller attaches (token counts, payload sizes, cache hits).
+# Finished spans are written as JSONL lines when a trace file is configured, and are kept
+# in memory so an end-of-run summary table can be printed.
+
+# The span currently open in this thread / asyncio task, used as the parent of new spans.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Return the value at percentile p (0-100) of a sorted list, using the nearest-rank method.
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.spans = []
+
+    # Turn tracing on. If path is given every finished span is appended to it as a JSONL line.
+    def configure(self, path=None):
+        self.enabled = True
+        self.path = path
+        if path:
+            self._file = open(path, "a", encoding="utf-8")
+
+    # Open a span around a block of code. kind groups spans in the summary
+    # ("model", "tool" or "subprocess"). The yielded dict holds the span's attributes,
+    # so the block can add values it only knows at the end (e.g. token counts).
+    # A span without a "session" attribute inherits its parent's.
+    @contextmanager
+    def span(self, name, kind, **attributes):
+        if not self.enabled:
+            yield attributes
+            return
+
+        parent = _current_span.get()
+        span_id = next(self._ids)
+        if parent is not None and "session" not in attributes and "session" in parent["attributes"]:
+            attributes["session"] = parent["attributes"]["session"]
+        span = {
+            "id": span_id,
+            "parent_id": parent["id"] if parent else None,
+            "name": name,
+            "kind": kind,
+            "start": time.time(),
+            "attributes": attributes,
+        }
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration_ms"] = (time.perf_counter() - start) * 1000
+            _current_span.reset(token)
+            self._finish(span)
+
+    # Store a finished span and write it to the trace file.
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append({"name": span["name"], "kind": span["kind"], "duration_ms": span["duration_ms"]})
+            if self._file:
+                self._file.write(json.dumps(span, default=str) + "\n")
+                self._file.flush()
+
+    # Return the end-of-run summary: count, total, p50 and p95 duration per span name,
+    # followed by how the time was split between the model and the tools.
+    def summary(self):
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return "No spans recorded."
+
+        by_name = {}
+        totals = {}
+        for span in spans:
+            by_name.setdefault((span["kind"], span["name"]), []).append(span["duration_ms"])
+            totals[span["kind"]] = totals.get(span["kind"], 0.0) + span["duration_ms"]
+
+        lines = [f"{'span':<36}{'count':>7}{'total ms':>12}{'p50 ms':>10}{'p95 ms':>10}"]
+        for (kind, name), durations in sorted(by_name.items()):
+            durations.sort()
+            lines.append(
+                f"{name:<36}{len(durations):>7}{sum(durations):>12.1f}"
+                f"{percentile(durations, 50):>10.1f}{percentile(durations, 95):>10.1f}"
+            )
+
+        # subprocess spans run inside tool spans, so they are not counted again in the split
+        model_ms = totals.get("model", 0.0)
+        tool_ms = totals.get("tool", 0.0)
+        both = model_ms + tool_ms
+        if both > 0:
+            lines.append(
+                f"Time split: model {model_ms:.1f} ms ({model_ms / both:.0%}), "
+                f"tools {tool_ms:.1f} ms ({tool_ms / both:.0%}, summed over parallel calls)"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+# Tracer shared by the whole process. It does nothing until configure() is called.
+TRACER = Tracer()
@@ -0,0 +1,380 @@
+import difflib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import config
+from functions import search_index, test_runner
+from functions.write_file import atomic_write
+from session_store import SessionError, check_session_id
+
+# Per-session copy-on-write workspaces, so sessions running at the same time don't write over
+# each other's files or run each other's half-finished edits.
+#
+# A session's workspace is a snapshot of a base directory (config.WORKING_DIRECTORY) at
+# config.WORKSPACES_DIR/<session id>, with its manifest next to it in <session id>.json.
+# The snapshot copies no file contents: directories are recreated and every file is
+#   - reflinked (a copy-on-write clone, on filesystems such as Btrfs and XFS), or else
+#   - hard linked to the base file, or else
+#   - copied, when the workspaces are on another filesystem than the base.
+# A hard link shares the base file, so it has to be broken before the file is written.
+# write_file and edit_file always do that: atomic_write replaces the file with a new one
+# instead of writing into it. Code run by run_python_file or run_tests may rewrite a file in
+# place, so before code first runs in a hard linked workspace every link is replaced with a
+# copy (see prepare_for_code). A file written in place through a link anyway (e.g. by a
+# process started outside the agent) is reported by changes() as "leaked", and is a conflict
+# for merge().
+#
+# The manifest records the state of every base file and its workspace entry at snapshot time,
+# so changes() only needs to stat the workspace to find what a session changed, and merge()
+# can tell when the base file changed since the snapshot (e.g. another session was merged).
+#   python main.py --workspaces       list workspaces and how many changes each holds
+#   python main.py --diff ID          unified diff of a workspace against its base
+#   python main.py --merge ID         copy the changes into the base, then remove the workspace
+#   python main.py --discard ID       remove the workspace and its changes
+
+# Linux ioctl that makes a file share another file's extents (cp --reflink)
+_FICLONE = 0x40049409
+
+# ways to snapshot a file, cheapest first
+_CLONE_MODES = ("reflink", "hardlink", "copy")
+
+class WorkspaceError(Exception):
+    pass
+
+def _workspaces_dir():
+    return os.path.expanduser(config.WORKSPACES_DIR)
+
+def _manifest_path(session_id):
+    return os.path.join(_workspaces_dir(), f"{session_id}.json")
+
+def _ignored(name):
+    return name in config.WORKSPACE_IGNORE
+
+# The (inode, size, mtime) of a file, which changes when the file is written or replaced.
+# Returns None if there is no such file.
+def _signature(path):
+    try:
+        stat = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return None
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+    # like the other modes, keep the mtime, so the search index seeded from the base's
+    # doesn't see the file as changed
+    shutil.copystat(src, dst)
+
+# Snapshot one file with the first of `modes` that works here and return the modes left to
+# try, so a mode that isn't supported (no reflinks, or another filesystem) is only tried once.
+def _clone(src, dst, modes):
+    while True:
+        try:
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif modes[0] == "reflink":
+                _reflink(src, dst)
+            elif modes[0] == "hardlink":
+                os.link(src, dst)
+            else:
+                shutil.copy2(src, dst)
+            return modes
+        except OSError:
+            if len(modes) == 1:
+                raise
+            try:
+                os.remove(dst)
+            except FileNotFoundError:
+                pass
+            modes = modes[1:]
+
+# Like os.walk, but yields relative directory paths, skips config.WORKSPACE_IGNORE, and
+# lists symlinks to directories as files, so they are snapshotted as links.
+def _walk(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        links = [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))]
+        dirnames[:] = sorted(name for name in dirnames if not _ignored(name) and name not in links)
+        filenames = sorted(name for name in filenames + links if not _ignored(name))
+        yield os.path.relpath(dirpath, root), filenames
+
+def _join(rel_dir, name):
+    return name if rel_dir == "." else os.path.join(rel_dir, name)
+
+# Yield the relative path of every file under root.
+def _walk_files(root):
+    for rel_dir, filenames in _walk(root):
+        for name in filenames:
+            yield _join(rel_dir, name)
+
+# Copy src over dst, creating dst's directory if needed. Like atomic_write, the copy replaces
+# dst in one step, so readers of the base never see a half-copied file.
+def _replace_with_copy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=f".{os.path.basename(dst)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copy2(src, temp_path)
+        os.replace(temp_path, dst)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+# Return the unified diff of two files, labelled with rel_path, or a one-line note if either
+# is not text. A missing file counts as empty.
+def _file_diff(old_path, new_path, rel_path):
+    texts = []
+    for path in (old_path, new_path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if b"\0" in data:
+            return f"Binary files a/{rel_path} and b/{rel_path} differ\n"
+        try:
+            texts.append(data.decode("utf-8").splitlines(keepends=True))
+        except UnicodeDecodeError:
+            return f"Binary files a/{rel_path} and b/{rel_path} differ\n"
+    old_label = f"a/{rel_path}" if os.path.exists(old_path) else "/dev/null"
+    new_label = f"b/{rel_path}" if os.path.exists(new_path) else "/dev/null"
+    lines = difflib.unified_diff(texts[0], texts[1], old_label, new_label)
+    return "".join(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n" for line in lines)
+
+# One session's workspace. Create or reopen one with open_workspace or create_workspace.
+class Workspace:
+    def __init__(self, session_id, manifest):
+        self.session_id = session_id
+        self.path = os.path.join(_workspaces_dir(), session_id)
+        self.base = manifest["base"]
+        self.mode = manifest["mode"]
+        self.created = manifest["created"]
+        # relative path -> [base signature, workspace signature] at snapshot time
+        self.files = manifest["files"]
+
+    def _save(self):
+        manifest = {"session_id": self.session_id, "base": self.base, "mode": self.mode, "created": self.created, "files": self.files}
+        atomic_write(_manifest_path(self.session_id), json.dumps(manifest, separators=(",", ":")))
+
+    # Return the files the session changed as sorted (status, relative path) pairs. status is
+    # "added", "deleted", "modified", or "leaked" for a hard linked file written in place,
+    # whose base file then changed too. A file rewritten with the same content is unchanged.
+    def changes(self):
+        changes = []
+        seen = set()
+        for rel_path in _walk_files(self.path):
+            seen.add(rel_path)
+            recorded = self.files.get(rel_path)
+            if recorded is None:
+                changes.append(("added", rel_path))
+                continue
+            base_signature, snapshot_signature = recorded
+            current = _signature(os.path.join(self.path, rel_path))
+            if current == snapshot_signature:
+                continue
+            if self.mode == "hardlink" and current[0] == base_signature[0]:
+                changes.append(("leaked", rel_path))
+            elif _signature(os.path.join(self.base, rel_path)) != base_signature or not _same_content(
+                    os.path.join(self.base, rel_path), os.path.join(self.path, rel_path)):
+                changes.append(("modified", rel_path))
+        changes.extend(("deleted", rel_path) for rel_path in self.files if rel_path not in seen)
+        return sorted(changes, key=lambda change: change[1])
+
+    # Unified diff of every change against the base as it is now.
+    def diff(self):
+        out = []
+        for status, rel_path in self.changes():
+            base_path = os.path.join(self.base, rel_path)
+            if status == "leaked":
+                out.append(f"# {rel_path}: written in place through a hard link; the base file has the change too\n")
+                continue
+            if status == "modified" and _signature(base_path) != self.files[rel_path][0]:
+                out.append(f"# {rel_path}: the base file changed since the snapshot\n")
+            out.append(_file_diff(base_path, os.path.join(self.path, rel_path), rel_path))
+        return "".join(out)
+
+    # Copy the session's changes into the base. A file whose base file changed since the
+    # snapshot is a conflict and is left alone, and so is a leaked file, whose change went
+    # into the base without a merge. Once nothing is left to merge, the workspace is removed.
+    # Returns the merged and the conflicting relative paths.
+    def merge(self):
+        merged, conflicts = [], []
+        for status, rel_path in self.changes():
+            base_path = os.path.join(self.base, rel_path)
+            recorded = self.files.get(rel_path)
+            if status == "leaked" or _signature(base_path) != (recorded[0] if recorded else None):
+                conflicts.append(rel_path)
+                continue
+            if status == "deleted":
+                os.remove(base_path)
+                del self.files[rel_path]
+            else:
+                _replace_with_copy(os.path.join(self.path, rel_path), base_path)
+                # the merged file is part of the snapshot now, so it stops showing up as a change
+                self.files[rel_path] = [_signature(base_path), _signature(os.path.join(self.path, rel_path))]
+            merged.append(rel_path)
+        if conflicts:
+            self._save()
+        else:
+            self.discard()
+        return merged, conflicts
+
+    # Replace every file still hard linked to its base file with a copy of its own, so code run
+    # in the workspace can't write into the base, and in-place writes to the base don't show up
+    # here. The workspace is a copy snapshot from then on.
+    def detach(self):
+        if self.mode != "hardlink":
+            return
+        for rel_path, (base_signature, snapshot_signature) in self.files.items():
+            path = os.path.join(self.path, rel_path)
+            current = _signature(path)
+            if current is None or os.path.islink(path) or current[0] != base_signature[0]:
+                continue
+            _replace_with_copy(path, path)
+            # a leaked file keeps its snapshot signature, so it still shows up as a change
+            if current == snapshot_signature:
+                self.files[rel_path] = [base_signature, _signature(path)]
+        self.mode = "copy"
+        self._save()
+
+    # Remove the workspace and everything the session changed in it.
+    def discard(self):
+        _detached.discard(os.path.normpath(os.path.abspath(self.path)))
+        search_index.close_index(self.path)
+        test_runner.delete_results(self.path)
+        shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            os.remove(_manifest_path(self.session_id))
+        except FileNotFoundError:
+            pass
+
+    # Remove the workspace if the session didn't change anything. Returns True if it was removed.
+    # A kept workspace's search index and test results are deleted too; they are built again if
+    # the session goes on.
+    def release(self):
+        if self.changes():
+            search_index.close_index(self.path)
+            test_runner.delete_results(self.path)
+            return False
+        self.discard()
+        return True
+
+# Compare two files byte by byte.
+def _same_content(path_a, path_b):
+    try:
+        if os.path.getsize(path_a) != os.path.getsize(path_b):
+            return False
+        with open(path_a, "rb") as a, open(path_b, "rb") as b:
+            while True:
+                chunk_a = a.read(1 << 16)
+                if chunk_a != b.read(1 << 16):
+                    return False
+                if not chunk_a:
+                    return True
+    except OSError:
+        return False
+
+# Snapshot a base directory as a new workspace for a session.
+# Raises WorkspaceError if the session already has one.
+def create_workspace(session_id, base=config.WORKING_DIRECTORY, mode=config.WORKSPACE_MODE):
+    check_session_id(session_id)
+    base = os.path.normpath(os.path.abspath(base))
+    if not os.path.isdir(base):
+        raise WorkspaceError(f"Workspace base {base} is not a directory")
+    path = os.path.join(_workspaces_dir(), session_id)
+    if os.path.exists(_manifest_path(session_id)) or os.path.exists(path):
+        raise WorkspaceError(f"Session {session_id} already has a workspace; merge or discard it first")
+
+    modes = _CLONE_MODES if mode == "auto" else (mode,)
+    files = {}
+    try:
+        os.makedirs(path)
+        for rel_dir, filenames in _walk(base):
+            os.makedirs(os.path.join(path, rel_dir), exist_ok=True)
+            for name in filenames:
+                rel_path = _join(rel_dir, name)
+                src, dst = os.path.join(base, rel_path), os.path.join(path, rel_path)
+                modes = _clone(src, dst, modes)
+                files[rel_path] = [_signature(src), _signature(dst)]
+    except OSError as e:
+        shutil.rmtree(path, ignore_errors=True)
+        raise WorkspaceError(f"Could not create a workspace for {session_id}: {e}")
+
+    workspace = Workspace(session_id, {"base": base, "mode": modes[0], "created": time.time(), "files": files})
+    workspace._save()
+    return workspace
+
+# Return the workspace of a session. Raises WorkspaceError if there is none.
+def load_workspace(session_id):
+    check_session_id(session_id)
+    try:
+        with open(_manifest_path(session_id), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise WorkspaceError(f"No workspace for session {session_id}")
+    return Workspace(session_id, manifest)
+
+# Return the session id of the workspace at an absolute path, or None if it isn't one.
+def _workspace_id(path):
+    if os.path.dirname(path) != os.path.normpath(os.path.abspath(_workspaces_dir())):
+        return None
+    session_id = os.path.basename(path)
+    return session_id if has_workspace(session_id) else None
+
+# Return the base directory of the workspace at path, or None if path is not a workspace.
+def workspace_base(path):
+    session_id = _workspace_id(os.path.normpath(os.path.abspath(path)))
+    if session_id is None:
+        return None
+    try:
+        return load_workspace(session_id).base
+    except (WorkspaceError, SessionError, ValueError):
+        return None
+
+def has_workspace(session_id):
+    return os.path.exists(_manifest_path(session_id))
+
+# Return the session's workspace, snapshotting the base for it if it has none yet.
+def open_workspace(session_id, base=config.WORKING_DIRECTORY):
+    if has_workspace(session_id):
+        return load_workspace(session_id)
+    return create_workspace(session_id, base)
+
+# workspaces known to hold no hard links to their base, and the lock detach runs under
+_detached = set()
+_detach_lock = threading.Lock()
+
+# Called before code runs in a working directory: if it is a hard linked workspace, detach it
+# from its base (see Workspace.detach). Any other directory is left alone.
+def prepare_for_code(working_directory):
+    path = os.path.normpath(os.path.abspath(working_directory))
+    if path in _detached:
+        return
+    with _detach_lock:
+        session_id = _workspace_id(path)
+        if path not in _detached and session_id is not None:
+            load_workspace(session_id).detach()
+        _detached.add(path)
+
+# Return every workspace, oldest first, with its number of changes.
+def list_workspaces():
+    directory = _workspaces_dir()
+    if not os.path.isdir(directory):
+        return []
+    workspaces = []
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            workspace = load_workspace(name[:-len(".json")])
+            workspaces.append({
+                "session_id": workspace.session_id, "base": workspace.base, "mode": workspace.mode,
+                "created": workspace.created, "changes": len(workspace.changes()),
+            })
+    workspaces.sort(key=lambda workspace: workspace["created"])
+    return workspaces